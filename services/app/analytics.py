@@ -0,0 +1,213 @@
+import threading
+import numpy as np
+import pandas as pd
+
+from historical import HistoricalFrame, load_columns
+from queries import asset_generations_query
+from spreads import SPREAD_PERIODS
+
+##############################
+# DENSE YIELD MATRIX
+##############################
+
+# Every daily close as one date x asset float matrix (NaN where an asset has no row), built once per
+# process and brought up to date before every /get_analytics request. Ingest bumps the generation of
+# each asset it writes with the first date it touched; when every asset moved by at most one write
+# since the last refresh, only the rows from the earliest such date on are reloaded and the head of
+# the matrix is kept. Anything else (several writes, an unknown date) rebuilds it.
+
+class YieldMatrix():
+
+    def __init__(self):
+        self.dates = None
+        self.asset_ids = None
+        self.labels = [] # (country, "5Y") of every column, columns are in order of first appearance
+        self.values = None
+        self.generations = {}
+        self.lock = threading.RLock() # held by readers too, a refresh swaps several arrays
+
+    def refresh(self):
+        '''
+        Brings the matrix up to date with bond_yield, needs an app context. Returns "built",
+        "extended" or "current".
+        '''
+        with self.lock:
+            current = {asset_id: (value or 0, changed_from) for asset_id, value, changed_from in asset_generations_query("All")}
+            changed = {asset_id: entry for asset_id, entry in current.items() if entry[0] != self.generations.get(asset_id, 0)}
+            if self.values is not None and not changed:
+                return "current"
+
+            # a deleted asset leaves a column behind, only a rebuild drops it
+            extend = self.values is not None and set(self.generations) <= set(current) and all(
+                generation == self.generations.get(asset_id, 0) + 1 and changed_from is not None
+                for asset_id, (generation, changed_from) in changed.items()
+            )
+            start = min(changed_from for _, changed_from in changed.values()) if extend else "All"
+            self.merge(start, *load_columns("All", start, "All"))
+            self.generations = {asset_id: generation for asset_id, (generation, _) in current.items()}
+            return "extended" if extend else "built"
+
+    def merge(self, start, dates, asset_ids, names, periods, yields):
+        # replaces every row from start on (all rows for "All") with the loaded ones
+        if start == "All" or self.values is None:
+            keep = 0
+            self.asset_ids, self.labels = np.array([], dtype=np.int64), []
+        else:
+            keep = np.searchsorted(self.dates, np.datetime64(start, 'D'))
+
+        new_ids, first = np.unique(asset_ids, return_index=True)
+        added = ~np.isin(new_ids, self.asset_ids)
+        self.asset_ids = np.concatenate([self.asset_ids, new_ids[added]])
+        self.labels = self.labels + [(names[i], f"{periods[i]}Y") for i in first[added]]
+
+        tail_dates, row = np.unique(dates, return_inverse=True)
+        order = np.argsort(self.asset_ids)
+        column = order[np.searchsorted(self.asset_ids, asset_ids, sorter=order)]
+        tail = np.full((len(tail_dates), len(self.asset_ids)), np.nan)
+        tail[row, column] = yields
+
+        head = np.full((keep, len(self.asset_ids)), np.nan)
+        if keep:
+            head[:, :self.values.shape[1]] = self.values[:keep]
+            self.dates = np.concatenate([self.dates[:keep], tail_dates])
+        else:
+            self.dates = tail_dates
+        self.values = np.vstack([head, tail])
+
+    def columns(self, countries):
+        # column indexes of the requested countries, in the order /get_historical uses
+        names = None if countries == "All" else set(countries.split())
+        selected = [index for index, (name, _) in enumerate(self.labels) if names is None or name in names]
+        return sorted(selected, key=self.labels.__getitem__)
+
+##############################
+# VECTORIZED STATISTICS
+##############################
+
+# All of these work on a whole (dates x series) matrix at once with NaN for missing days. Rolling
+# windows count rows (trading dates of the matrix), a window needs ANALYTICS_MIN_FRACTION of its
+# rows present to give a value.
+
+ANALYTICS_MIN_FRACTION = 0.5
+
+def spread_columns(values, labels):
+    # 5Y minus 2Y of every country with both legs among labels
+    short_label, long_label = (f"{period}Y" for period in SPREAD_PERIODS)
+    position = {label: index for index, label in enumerate(labels)}
+    names = sorted({name for name, _ in labels if (name, short_label) in position and (name, long_label) in position})
+    spreads = np.empty((len(values), len(names)))
+    for index, name in enumerate(names):
+        spreads[:, index] = values[:, position[(name, long_label)]] - values[:, position[(name, short_label)]]
+    return spreads, [(name, "spread") for name in names]
+
+def changes(values):
+    # change of every value since the previous present value of its column, NaN where absent
+    valid = ~np.isnan(values)
+    last = np.maximum.accumulate(np.where(valid, np.arange(len(values))[:, None], -1), axis=0)
+    previous = np.vstack([np.full((1, values.shape[1]), -1), last[:-1]])
+    previous_values = np.take_along_axis(values, np.maximum(previous, 0), axis=0)
+    return np.where(valid & (previous >= 0), values - previous_values, np.nan)
+
+def column_means(values, valid):
+    # 0 for a column without any value
+    return np.where(valid, values, 0).sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+
+def rolling_moments(values, window, min_periods=None):
+    '''
+    (count, mean, sample std) over the `window` rows ending at each row, from running sums of the
+    column centred values so long histories keep their precision.
+    '''
+    min_periods = min_periods or max(2, int(np.ceil(window * ANALYTICS_MIN_FRACTION)))
+    valid = ~np.isnan(values)
+    centre = column_means(values, valid)
+    centred = np.where(valid, values - centre, 0)
+
+    def window_sums(column):
+        running = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(column, axis=0)])
+        upper = np.arange(1, len(values) + 1)
+        return running[upper] - running[np.maximum(upper - window, 0)]
+
+    count = window_sums(valid.astype(float))
+    total, squares = window_sums(centred), window_sums(centred * centred)
+    with np.errstate(all='ignore'):
+        mean = total / count
+        variance = np.maximum(squares - count * mean * mean, 0) / (count - 1)
+    enough = count >= min_periods
+    return count, np.where(enough, mean + centre, np.nan), np.where(enough, np.sqrt(variance), np.nan)
+
+def rolling_stat(values, stat, window):
+    _, mean, std = rolling_moments(values, window)
+    if stat == 'mean':
+        return mean
+    if stat == 'std':
+        return std
+    if stat == 'zscore':
+        with np.errstate(all='ignore'):
+            return np.where(std > 0, (values - mean) / std, np.nan)
+    raise ValueError(f"Unknown statistic {stat}")
+
+def correlation(values, min_periods=2):
+    # pairwise complete Pearson correlation of the columns, every pair uses the rows both have
+    present = ~np.isnan(values)
+    valid = present.astype(float)
+    # centred first, the products of long level series would otherwise swamp their covariance
+    filled = np.where(present, values - column_means(values, present), 0)
+    count = valid.T @ valid
+    sums = filled.T @ valid # sums[i, j]: column i over the rows j is present
+    squares = (filled * filled).T @ valid
+    products = filled.T @ filled
+    with np.errstate(all='ignore'):
+        covariance = products - sums * sums.T / count
+        scale = np.sqrt((squares - sums * sums / count) * (squares.T - sums.T * sums.T / count))
+        result = covariance / scale
+    return np.where((count >= min_periods) & (scale > 0), np.clip(result, -1, 1), np.nan)
+
+##############################
+# RESPONSES
+##############################
+
+analytics_stats = ['mean', 'std', 'zscore', 'corr']
+analytics_series = ['yield', 'spread']
+analytics_transforms = ['level', 'change']
+
+def analytics_input(matrix, countries, series, transform):
+    # (values, labels) of the requested series over every date of the matrix
+    columns = matrix.columns(countries)
+    values, labels = matrix.values[:, columns], [matrix.labels[index] for index in columns]
+    if series == 'spread':
+        values, labels = spread_columns(values, labels)
+    if transform == 'change':
+        values = changes(values)
+    return values, labels
+
+def date_range(dates, start_date, end_date):
+    first = 0 if start_date == "All" else np.searchsorted(dates, np.datetime64(start_date, 'D'), 'left')
+    last = len(dates) if end_date == "All" else np.searchsorted(dates, np.datetime64(end_date, 'D'), 'right')
+    return slice(first, last)
+
+def rolling_frame(matrix, countries, stat, window, start_date, end_date, series='yield', transform='level'):
+    # rolled over every date first, so the first rows in range still see a full window
+    values, labels = analytics_input(matrix, countries, series, transform)
+    rows = date_range(matrix.dates, start_date, end_date)
+    return HistoricalFrame(matrix.dates[rows], labels, rolling_stat(values, stat, window)[rows])
+
+def correlation_frame(matrix, countries, window, start_date, end_date, series='yield', transform='change'):
+    '''
+    Correlation matrix of the series over the dates in range, the last `window` of them when
+    window is given. Changes are correlated by default, levels of yields trend together.
+    '''
+    values, labels = analytics_input(matrix, countries, series, transform)
+    values = values[date_range(matrix.dates, start_date, end_date)]
+    if window:
+        values = values[-window:]
+    flat_labels = [f"{name} {label}" for name, label in labels]
+    return pd.DataFrame(correlation(values), index=flat_labels, columns=flat_labels)
+
+def render_correlation(frame, output_format):
+    if output_format == 'html':
+        return frame.to_html()
+    if output_format == 'csv':
+        return frame.to_csv()
+    if output_format == 'json':
+        return frame.to_json(orient='split')
+    raise ValueError(f"Unknown format {output_format}")
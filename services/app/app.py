@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, Response, render_template
+from flask import Flask, request, jsonify, Response, render_template, stream_with_context
 from flask.cli import with_appcontext
 import os
 import logging
@@ -6,11 +6,23 @@ import traceback
 
 from config import Config
 from extensions import db
-from models import BondYield, Asset, BondYieldRealtime
+from models import BondYield, Asset, BondYieldRealtime, BondYieldRollup, BondSpread, BondSpreadRealtime, CacheGeneration, SchemaMigration
 from sqlalchemy import inspect, desc
 from sqlalchemy.orm import joinedload, aliased
 from datetime import datetime
-from utilities import timeframes
+from utilities import timeframes, resolutions
+from metrics import read_snapshots
+from queries import realtime_query, asset_generations_query
+from cache import ResponseCache, CachedResponse, create_backend, REALTIME_CACHE_KEY, normalise_countries, historical_entry_valid
+from historical import load_frame, pivot, stream_historical, historical_formats, stream_formats, arrow_formats, pa
+from migrations import run_migrations, stamp_migrations, explain_endpoint_queries
+from sync_planner import series_watermarks
+from gap_scan import scan_gaps
+from realtime_store import RealtimeStore
+from partitions import run_maintenance
+from archive import HistoricalArchive, refresh_archive, check_archive
+from spreads import load_spread_frame, load_realtime_spread_frame, rebuild_spreads, SPREAD_FIELDS
+from analytics import YieldMatrix, rolling_frame, correlation_frame, render_correlation, analytics_stats, analytics_series, analytics_transforms
 
 import pandas as pd
 import pytz
@@ -31,15 +43,79 @@ app.config.from_object(Config)
 
 db.init_app(app)
 
+response_cache = ResponseCache(
+    create_backend(
+        app.config["RESPONSE_CACHE_BACKEND"],
+        app.config["RESPONSE_CACHE_URL"],
+        app.config["RESPONSE_CACHE_MAX_ENTRIES"],
+        app.config["RESPONSE_CACHE_MAX_BYTES"],
+    ),
+    app.config["RESPONSE_CACHE_MAX_BYTES"],
+)
+
+# the realtime daemon's ring buffers, /get_realtime only queries the table when they cannot answer
+realtime_store = RealtimeStore(app.config["REALTIME_STORE_PATH"])
+
+# Arrow files of every daily series, /get_historical reads them instead of bond_yield while they are current
+historical_archive = HistoricalArchive(app.config["HISTORICAL_ARCHIVE_DIR"])
+
+# every daily close as a date x asset matrix for /get_analytics, extended as ingest appends days
+yield_matrix = YieldMatrix()
+
+# asset id -> (name, period) for labelling rows read from the buffers, reloaded when an id is new
+asset_labels = {}
+
+def get_asset_labels(asset_ids):
+    if any(int(asset_id) not in asset_labels for asset_id in asset_ids):
+        asset_labels.update({_id: key for key, _id in Asset.id_map().items()})
+    return asset_labels
+
+def realtime_asset_ids(countries):
+    # None for every asset, as realtime_query does for "All"
+    if countries == "All":
+        return None
+    country_list = countries.split()
+    if any(country not in {name for name, _ in asset_labels.values()} for country in country_list):
+        asset_labels.update({_id: key for key, _id in Asset.id_map().items()})
+    return [asset_id for asset_id, (name, _) in asset_labels.items() if name in country_list]
+
+def realtime_table(datetimes, names, periods, yields):
+    df = pd.DataFrame({
+        'DateTime': datetimes,
+        'Country': names,
+        'Period': [f"{period}Y" for period in periods],
+        'bond_yield': yields,
+    })
+
+    df['bond_yield'] = pd.to_numeric(df['bond_yield'], errors='coerce')
+
+    pivot_df = df.pivot_table(index='DateTime', columns=['Country', 'Period'], values='bond_yield')
+    pivot_df.sort_values(by="DateTime", inplace=True)
+
+    pivot_df.rename_axis(index=None, inplace=True)
+
+    logging.info(pivot_df.head())
+
+    return pivot_df.to_html()
+
+def cached_response(entry):
+    # conditional requests get a 304 when the client already holds this body
+    response = Response(entry.body, mimetype=entry.mimetype)
+    response.set_etag(entry.etag)
+    return response.make_conditional(request)
+
 @app.cli.command("create_db")
 @with_appcontext
 def create_db():
     # Create an inspector
     inspector = inspect(db.engine)
 
+    # a database without any of our tables gets the current schema straight from the models
+    fresh = not inspector.has_table(Asset.__tablename__)
+
     # List of all tables that should be created
     # Replace 'YourModel' with actual model class names
-    tables = [Asset.__tablename__, BondYield.__tablename__, BondYieldRealtime.__tablename__]
+    tables = [Asset.__tablename__, BondYield.__tablename__, BondYieldRealtime.__tablename__, BondYieldRollup.__tablename__, BondSpread.__tablename__, BondSpreadRealtime.__tablename__, CacheGeneration.__tablename__, SchemaMigration.__tablename__]
 
     # Iterate over the tables and check if they exist
     for table in tables:
@@ -52,6 +128,69 @@ def create_db():
 
     db.session.commit()
 
+    if fresh:
+        stamp_migrations()
+    else:
+        run_migrations()
+
+    # partitions for the months ahead and the realtime retention policy
+    run_maintenance(app.config)
+
+@app.cli.command("maintain_realtime")
+@with_appcontext
+def maintain_realtime():
+    summary = run_maintenance(app.config)
+    print(f"created {summary['created'] or 'no'} partitions, expired {summary['minute_rows_expired']} 1 minute rows, "
+          f"dropped {summary['dropped'] or 'no'} partitions, expired {summary['spread_rows_expired']} spread rows")
+
+@app.cli.command("migrate")
+@with_appcontext
+def migrate():
+    run_migrations()
+
+@app.cli.command("explain_queries")
+@with_appcontext
+def explain_queries():
+    failed = 0
+    for description, index_names, used, indexes in explain_endpoint_queries():
+        status = "OK  " if used else "FAIL"
+        failed += 0 if used else 1
+        print(f"{status} {description}: expected one of {list(index_names)}, plan used {indexes}")
+    if failed:
+        raise SystemExit(1)
+
+@app.cli.command("gap_report")
+@with_appcontext
+def gap_report():
+    # coverage of every stored series against the business day calendar, and what a backfill would fetch
+    for entry in sorted(scan_gaps(series_watermarks()), key=lambda entry: entry["coverage"]):
+        windows = ", ".join(f"{start}..{end}" for start, end in entry["windows"]) or "-"
+        print(f"{entry['name']} {entry['period']}Y: {entry['coverage']:.2%} of {entry['business_days']} business days "
+              f"from {entry['first_date']} to {entry['last_date']}, {entry['missing']} missing, {entry['closed']} closed, "
+              f"backfill {windows}")
+
+@app.cli.command("refresh_archive")
+@with_appcontext
+def refresh_archive_command():
+    refreshed = refresh_archive(app.config["HISTORICAL_ARCHIVE_DIR"])
+    print(f"archived {len(refreshed)} series")
+
+@app.cli.command("check_archive")
+@with_appcontext
+def check_archive_command():
+    # every archived series against bond_yield, exits 1 when a current file differs
+    failed = 0
+    for asset_id, name, period, status in check_archive(app.config["HISTORICAL_ARCHIVE_DIR"]):
+        failed += 0 if status in ("ok", "stale") else 1
+        print(f"{name} {period}Y (asset {asset_id}): {status}")
+    if failed:
+        raise SystemExit(1)
+
+@app.cli.command("rebuild_spreads")
+@with_appcontext
+def rebuild_spreads_command():
+    print(f"wrote {rebuild_spreads()} daily spreads")
+
 @app.cli.command("remove_db")
 @with_appcontext
 def remove_db():
@@ -82,46 +221,47 @@ def get_realtime():
 
         timeframe = timeframes.get(timeframe)
 
-        query = db.session.query(BondYieldRealtime).join(Asset)
-
-        if countries != "All":
-            country_list = countries.split()
-            query = query.filter(Asset.name.in_(country_list))
+        cache_key = ("realtime", normalise_countries(countries), timeframe, max_rows)
 
-        query = query.filter(
-                BondYieldRealtime.timeframe == timeframe,
-            ).order_by(
-                desc(BondYieldRealtime.datetime)
-            ).limit(max_rows)
-            
-        bond_yield_records = query.all()
-
-        if len(bond_yield_records) == 0 and max_rows != 0:
-            return Response("Bad Request: Country does not exist in database or has discontinued real time data", status=400)
-
-        data = [
-            {
-                'DateTime': record.datetime,
-                'Country': record.asset.name,  # Assuming 'name' is an attribute of Country
-                'Period': f"{record.asset.period}Y",
-                'bond_yield': record.bond_yield,
-            }
-            for record in bond_yield_records
-        ]
-
-        df = pd.DataFrame(data)
-
-        df['bond_yield'] = pd.to_numeric(df['bond_yield'], errors='coerce')
+        # the buffers change with every tick the daemon pushes, their epoch and sequence version the response
+        latest = realtime_store.latest(realtime_asset_ids(countries), timeframe, max_rows)
+        if latest is not None:
+            version, datetimes, asset_ids, yields = latest
+            generation = f"store:{version}"
+        else:
+            # the realtime writer bumps this generation with every tick it commits
+            generation = CacheGeneration.current(REALTIME_CACHE_KEY)
+
+        entry = response_cache.get(cache_key, lambda entry: generation if entry.versions == generation else None)
+        if entry is not None:
+            return cached_response(entry)
+
+        if latest is not None:
+            labels = get_asset_labels(asset_ids)
+            html_table = realtime_table(
+                datetimes.astype('datetime64[us]').tolist(),
+                [labels[asset_id][0] for asset_id in asset_ids.tolist()],
+                [labels[asset_id][1] for asset_id in asset_ids.tolist()],
+                yields,
+            )
+        else:
+            query = realtime_query(countries, timeframe, max_rows)
 
-        pivot_df = df.pivot_table(index='DateTime', columns=['Country', 'Period'], values='bond_yield')
-        pivot_df.sort_values(by="DateTime", inplace=True)
+            bond_yield_records = query.all()
 
-        pivot_df.rename_axis(index=None, inplace=True)
+            if len(bond_yield_records) == 0 and max_rows != 0:
+                return Response("Bad Request: Country does not exist in database or has discontinued real time data", status=400)
 
-        logging.info(pivot_df.head())
+            html_table = realtime_table(
+                [record.datetime for record in bond_yield_records],
+                [record.asset.name for record in bond_yield_records],
+                [record.asset.period for record in bond_yield_records],
+                [record.bond_yield for record in bond_yield_records],
+            )
 
-        html_table = pivot_df.to_html()
-        return Response(html_table, mimetype='text/html')
+        entry = CachedResponse(html_table, 'text/html', generation)
+        response_cache.set(cache_key, entry)
+        return cached_response(entry)
 
 
     except Exception as e:
@@ -136,6 +276,9 @@ def get_historical():
         countries = request.args.get('countries') # this already splits on +
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
+        resolution = request.args.get('resolution', 'D')
+        stream = request.args.get('stream') == '1'
+        output_format = request.args.get('format', 'csv' if stream else 'html')
 
         if not countries:
             return Response("Bad Request: No parameter for 'countries'", status=400)
@@ -143,6 +286,14 @@ def get_historical():
             return Response("Bad Request: No parameter for 'start_date'", status=400)
         if not end_date:
             return Response("Bad Request: No parameter for 'end_date'", status=400)
+        if resolution not in resolutions:
+            return Response(f"Bad Request: Resolution must be one of the following values: {resolutions}", status=400)
+        if stream and output_format not in stream_formats:
+            return Response(f"Bad Request: Streamed format must be one of the following values: {list(stream_formats)}", status=400)
+        if not stream and output_format not in historical_formats:
+            return Response(f"Bad Request: Format must be one of the following values: {list(historical_formats)}", status=400)
+        if output_format in arrow_formats and pa is None:
+            return Response(f"Bad Request: Format '{output_format}' is not available on this server", status=400)
 
         try:
             start_date = datetime.strptime(start_date, "%d-%m-%Y").strftime("%Y-%m-%d")
@@ -150,49 +301,155 @@ def get_historical():
         except ValueError:
             return Response("Bad Request: Format for date is wrong", status=400)
 
-        query = db.session.query(BondYield).join(Asset)
         if countries != "All":
-            country_list = countries.split()
-            logging.info(country_list)
-            query = query.filter(Asset.name.in_(country_list))
+            logging.info(countries.split())
         if start_date != "All":
             logging.info(start_date)
             start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-            query = query.filter(BondYield.date >= start_date)
         if end_date != "All":
             logging.info(end_date)
             end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-            query = query.filter(BondYield.date <= end_date)
 
-        bond_yield_records = query.all()
+        if stream:
+            rows = stream_historical(countries, start_date, end_date, resolution, output_format)
+            return Response(stream_with_context(rows), mimetype=stream_formats[output_format])
 
-        data = [
-            {
-                'Date': record.date,
-                'Country': record.asset.name,  # Assuming 'name' is an attribute of Country
-                'Period': f"{record.asset.period}Y",
-                'bond_yield': record.bond_yield,
-            }
-            for record in bond_yield_records
-        ]
+        # ingest bumps a generation per asset, so appends after end_date leave the entry usable
+        cache_key = ("historical", normalise_countries(countries), start_date, end_date, resolution, output_format)
+        generations = {asset_id: (value or 0, changed_from) for asset_id, value, changed_from in asset_generations_query(countries)}
+        entry = response_cache.get(cache_key, lambda entry: historical_entry_valid(entry, generations, end_date, resolution))
+        if entry is not None:
+            return cached_response(entry)
+
+        if resolution == 'D' and historical_archive.covers(generations):
+            frame = pivot(*historical_archive.columns(generations, start_date, end_date))
+        else:
+            frame = load_frame(countries, start_date, end_date, resolution)
 
-        df = pd.DataFrame(data)
+        logging.info(f"{len(frame.dates)} dates x {len(frame.labels)} series")
 
-        df['bond_yield'] = pd.to_numeric(df['bond_yield'], errors='coerce')
+        versions = {asset_id: value for asset_id, (value, _) in generations.items()}
+        entry = CachedResponse(frame.render(output_format), historical_formats[output_format], versions)
+        response_cache.set(cache_key, entry)
+        return cached_response(entry)
+    except Exception as e:
+        logging.error(traceback.format_exc())
+        return Response("Internal Server Error", status=500, mimetype='text/html')
+    
+@app.route("/get_spread", methods=['GET'])
+def get_spread():
+    '''
+    5Y minus 2Y spread of every requested country. With a timeframe the newest max_rows realtime
+    bars, otherwise the daily spreads from start_date to end_date (both optional) with the fields
+    asked for out of spread, change and zscore.
+    '''
+    try:
+        countries = request.args.get('countries')
+        timeframe = request.args.get('timeframe')
+        output_format = request.args.get('format', 'html')
+        fields = tuple(request.args.get('fields', 'spread').split(','))
 
-        pivot_df = df.pivot_table(index='Date', columns=['Country', 'Period'], values='bond_yield')
-        pivot_df.sort_values(by="Date", inplace=True)
+        if not countries:
+            return Response("Bad Request: No parameter for 'countries'", status=400)
+        if output_format not in historical_formats:
+            return Response(f"Bad Request: Format must be one of the following values: {list(historical_formats)}", status=400)
+        if output_format in arrow_formats and pa is None:
+            return Response(f"Bad Request: Format '{output_format}' is not available on this server", status=400)
+        if any(field not in SPREAD_FIELDS for field in fields):
+            return Response(f"Bad Request: Fields must be among the following values: {list(SPREAD_FIELDS)}", status=400)
+
+        if timeframe:
+            try:
+                max_rows = int(request.args.get('max_rows', 500))
+            except ValueError:
+                return Response("Bad Request: Max rows must be a number", status=400)
+            if max_rows > 5000:
+                return Response("Bad Request: Largest value for 'max_rows' is 5000", status=400)
+            if not timeframes.get(timeframe):
+                return Response(f"Bad Request: Timeframe must be one of the following values: {list(timeframes)}", status=400)
+            if fields != ('spread',):
+                return Response("Bad Request: Realtime spreads only have the 'spread' field", status=400)
+
+            frame = load_realtime_spread_frame(countries, timeframes[timeframe], max_rows)
+            if frame is None:
+                return Response("Bad Request: Country does not exist in database or has discontinued real time data", status=400)
+        else:
+            dates = []
+            for name in ('start_date', 'end_date'):
+                value = request.args.get(name, 'All')
+                try:
+                    dates.append(value if value == 'All' else datetime.strptime(value, "%d-%m-%Y").date())
+                except ValueError:
+                    return Response("Bad Request: Format for date is wrong", status=400)
+            frame = load_spread_frame(countries, dates[0], dates[1], fields)
+
+        logging.info(f"{len(frame.dates)} dates x {len(frame.labels)} spread columns")
+        return Response(frame.render(output_format), mimetype=historical_formats[output_format])
+    except Exception as e:
+        logging.error(traceback.format_exc())
+        return Response("Internal Server Error", status=500, mimetype='text/html')
 
-        pivot_df.rename_axis(index=None, inplace=True)
+@app.route("/get_analytics", methods=['GET'])
+def get_analytics():
+    '''
+    Rolling mean, std or zscore of every requested series over `window` trading days, or their
+    correlation matrix (stat=corr) over the date range or its last `window` days. series is yield
+    or the 2Y-5Y spread, transform level or daily change.
+    '''
+    try:
+        countries = request.args.get('countries')
+        stat = request.args.get('stat')
+        series = request.args.get('series', 'yield')
+        transform = request.args.get('transform', 'change' if stat == 'corr' else 'level')
+        output_format = request.args.get('format', 'html')
 
-        logging.info(pivot_df.head())
+        if not countries:
+            return Response("Bad Request: No parameter for 'countries'", status=400)
+        if stat not in analytics_stats:
+            return Response(f"Bad Request: Stat must be one of the following values: {analytics_stats}", status=400)
+        if series not in analytics_series:
+            return Response(f"Bad Request: Series must be one of the following values: {analytics_series}", status=400)
+        if transform not in analytics_transforms:
+            return Response(f"Bad Request: Transform must be one of the following values: {analytics_transforms}", status=400)
+        correlation_formats = ['html', 'csv', 'json']
+        if output_format not in (correlation_formats if stat == 'corr' else historical_formats):
+            return Response(f"Bad Request: Format must be one of the following values: {correlation_formats if stat == 'corr' else list(historical_formats)}", status=400)
+        if output_format in arrow_formats and pa is None:
+            return Response(f"Bad Request: Format '{output_format}' is not available on this server", status=400)
 
-        html_table = pivot_df.to_html()
-        return Response(html_table, mimetype='text/html')
+        try:
+            window = int(request.args.get('window', 0 if stat == 'corr' else 20))
+        except ValueError:
+            return Response("Bad Request: Window must be a number", status=400)
+        min_window = 0 if stat == 'corr' else 2
+        if window < min_window or window > 5000:
+            return Response(f"Bad Request: Window must be between {min_window} and 5000", status=400)
+
+        dates = []
+        for name in ('start_date', 'end_date'):
+            value = request.args.get(name, 'All')
+            try:
+                dates.append(value if value == 'All' else datetime.strptime(value, "%d-%m-%Y").date())
+            except ValueError:
+                return Response("Bad Request: Format for date is wrong", status=400)
+
+        with yield_matrix.lock:
+            logging.info(f"yield matrix {yield_matrix.refresh()}")
+            if stat == 'corr':
+                body = render_correlation(correlation_frame(yield_matrix, countries, window, dates[0], dates[1], series, transform), output_format)
+            else:
+                body = rolling_frame(yield_matrix, countries, stat, window, dates[0], dates[1], series, transform).render(output_format)
+        return Response(body, mimetype=historical_formats[output_format])
     except Exception as e:
         logging.error(traceback.format_exc())
         return Response("Internal Server Error", status=500, mimetype='text/html')
-    
+
+@app.route("/metrics", methods=['GET'])
+def get_metrics():
+    snapshots = read_snapshots()
+    snapshots["response_cache"] = response_cache.stats()
+    return jsonify(snapshots)
+
 @app.route("/data", methods=['GET'])
 def get_data():
     return render_template("index.html")
@@ -0,0 +1,209 @@
+import json
+import logging
+import os
+import numpy as np
+
+from historical import fetch_rows
+from queries import asset_generations_query, archive_series_query, series_query
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+##############################
+# HISTORICAL ARCHIVE
+##############################
+
+# Every asset's daily series as one uncompressed Arrow IPC file, refreshed after the daily sync:
+#
+#   HISTORICAL_ARCHIVE_DIR/manifest.json     {"3": {"name": "spain", "period": 5, "generation": 41, "rows": 6512,
+#                                                   "first_date": "2000-01-03", "last_date": "2024-01-04"}, ...}
+#   HISTORICAL_ARCHIVE_DIR/asset_3.arrow     date date32, bond_yield float64, sorted by date
+#
+# Readers memory map the files, so a /get_historical hit on the archive reads no rows from
+# PostgreSQL. The country filter picks files and the date range is a binary search on the sorted
+# date column; the slices are views into the mapping until the pivot copies them into its matrix.
+# The generation of every file is the asset's cache generation at the time it was written, a file
+# whose asset has been written to since is not used.
+
+HISTORICAL_ARCHIVE_DIR = os.environ.get("HISTORICAL_ARCHIVE_DIR", "/home/app/data/archive")
+MANIFEST_NAME = "manifest.json"
+
+def asset_file(directory, asset_id):
+    return os.path.join(directory, f"asset_{int(asset_id)}.arrow")
+
+def write_atomic(path, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(directory, manifest):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as file:
+            json.dump(manifest, file)
+    write_atomic(os.path.join(directory, MANIFEST_NAME), write)
+
+def read_series(asset_id):
+    # (days since epoch int32, closes float64) of one asset from the database
+    rows = fetch_rows(archive_series_query(asset_id))
+    if not rows:
+        return np.array([], dtype=np.int32), np.array([], dtype=float)
+    days, yields = zip(*rows)
+    return np.array(days, dtype=np.int32), np.array(yields, dtype=float)
+
+def write_series_file(path, days, yields):
+    table = pa.table({'date': pa.array(days, type=pa.int32()).view(pa.date32()), 'bond_yield': pa.array(yields, type=pa.float64())})
+    def write(tmp_path):
+        # one record batch, so a reader gets each column as a single contiguous buffer
+        with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=max(len(days), 1))
+    write_atomic(path, write)
+
+def refresh_archive(directory=HISTORICAL_ARCHIVE_DIR, countries="All"):
+    '''
+    Rewrites the file of every asset whose cache generation moved since it was archived, needs an
+    app context. The generation is read before the rows, so a write racing the refresh can only
+    leave a file newer than its generation, which the next refresh rewrites. Returns the asset ids
+    that were written.
+    '''
+    if pa is None:
+        return []
+    os.makedirs(directory, exist_ok=True)
+    manifest = load_manifest(directory)
+    generations = {asset_id: value or 0 for asset_id, value, _ in asset_generations_query(countries)}
+    assets = {asset.id: asset for asset in series_query(countries)}
+
+    refreshed = []
+    for asset_id, generation in generations.items():
+        entry = manifest.get(str(asset_id))
+        if entry is not None and entry["generation"] == generation and os.path.exists(asset_file(directory, asset_id)):
+            continue
+        days, yields = read_series(asset_id)
+        write_series_file(asset_file(directory, asset_id), days, yields)
+        manifest[str(asset_id)] = {
+            "name": assets[asset_id].name,
+            "period": assets[asset_id].period,
+            "generation": generation,
+            "rows": len(days),
+            "first_date": str(days[0].astype('datetime64[D]')) if len(days) else None,
+            "last_date": str(days[-1].astype('datetime64[D]')) if len(days) else None,
+        }
+        refreshed.append(asset_id)
+
+    if refreshed:
+        save_manifest(directory, manifest)
+        logging.info(f"Archived {len(refreshed)} series to {directory}")
+    return refreshed
+
+def check_archive(directory=HISTORICAL_ARCHIVE_DIR):
+    '''
+    Compares every archived series with bond_yield, needs an app context. Returns
+    (asset_id, name, period, status) per archived asset; status is "ok", "stale" when the asset
+    was written to since it was archived, or what differs.
+    '''
+    archive = HistoricalArchive(directory)
+    generations = {asset_id: value or 0 for asset_id, value, _ in asset_generations_query("All")}
+    results = []
+    for key, entry in sorted(archive.manifest().items(), key=lambda item: int(item[0])):
+        asset_id = int(key)
+        if asset_id not in generations:
+            status = "asset no longer exists"
+        elif generations[asset_id] != entry["generation"]:
+            status = "stale"
+        else:
+            days, yields = read_series(asset_id)
+            archived_days, archived_yields = archive.series(asset_id, entry["generation"])
+            if len(days) != len(archived_days):
+                status = f"{len(archived_days)} rows archived, {len(days)} stored"
+            elif not np.array_equal(days, archived_days):
+                status = f"dates differ from {np.flatnonzero(days != archived_days)[0]}th row"
+            elif not np.array_equal(yields, archived_yields, equal_nan=True):
+                status = f"{int((yields != archived_yields).sum())} closes differ"
+            else:
+                status = "ok"
+        results.append((asset_id, entry["name"], entry["period"], status))
+    return results
+
+class HistoricalArchive():
+    '''
+    Read side of HISTORICAL_ARCHIVE_DIR for the app workers. The manifest is reloaded when the
+    refresh replaces it and mapped files are reopened when their generation moves.
+    '''
+
+    def __init__(self, directory=HISTORICAL_ARCHIVE_DIR):
+        self.directory = directory
+        self.manifest_mtime = None
+        self.entries = {}
+        self.mapped = {} # asset_id -> (generation, days, yields), views into the mapped file
+
+    def manifest(self):
+        try:
+            mtime = os.stat(os.path.join(self.directory, MANIFEST_NAME)).st_mtime_ns
+        except OSError:
+            self.entries, self.manifest_mtime = {}, None
+            return self.entries
+        if mtime != self.manifest_mtime:
+            self.entries, self.manifest_mtime = load_manifest(self.directory), mtime
+        return self.entries
+
+    def covers(self, generations):
+        # generations maps asset id -> (generation, changed_from) as it is now, see asset_generations_query
+        if pa is None or not generations:
+            return False
+        entries = self.manifest()
+        return all(
+            str(asset_id) in entries and entries[str(asset_id)]["generation"] == generation
+            for asset_id, (generation, _) in generations.items()
+        )
+
+    def series(self, asset_id, generation):
+        cached = self.mapped.get(asset_id)
+        if cached is None or cached[0] != generation:
+            # the table keeps the mapping alive, a refresh replacing the file does not disturb it
+            table = pa.ipc.open_file(pa.memory_map(asset_file(self.directory, asset_id), 'r')).read_all()
+            if table.column('date').num_chunks != 1:
+                # only a file written elsewhere has several batches, joining them copies
+                table = table.combine_chunks()
+            days = table.column('date').chunk(0).view(pa.int32()).to_numpy()
+            closes = table.column('bond_yield').chunk(0).to_numpy()
+            cached = self.mapped[asset_id] = (generation, days, closes)
+        return cached[1], cached[2]
+
+    def columns(self, asset_ids, start_date, end_date):
+        # the same (dates, asset_ids, names, periods, yields) as historical.load_columns, for resolution D
+        start = -np.inf if start_date == "All" else (np.datetime64(start_date, 'D') - np.datetime64(0, 'D')).astype(np.int64)
+        end = np.inf if end_date == "All" else (np.datetime64(end_date, 'D') - np.datetime64(0, 'D')).astype(np.int64)
+
+        entries = self.manifest()
+        day_slices, yield_slices, ids, names, periods = [], [], [], [], []
+        for asset_id in asset_ids:
+            entry = entries[str(asset_id)]
+            if not entry["rows"]:
+                continue
+            days, yields = self.series(asset_id, entry["generation"])
+            first, last = np.searchsorted(days, start, 'left'), np.searchsorted(days, end, 'right')
+            if first == last:
+                continue
+            day_slices.append(days[first:last])
+            yield_slices.append(yields[first:last])
+            ids.append(np.full(last - first, asset_id, dtype=np.int64))
+            names += [entry["name"]] * (last - first)
+            periods += [entry["period"]] * (last - first)
+
+        if not day_slices:
+            return np.array([], dtype='datetime64[D]'), np.array([], dtype=np.int64), (), (), np.array([], dtype=float)
+        return (
+            np.concatenate(day_slices).astype('datetime64[D]'),
+            np.concatenate(ids),
+            names,
+            periods,
+            np.concatenate(yield_slices),
+        )
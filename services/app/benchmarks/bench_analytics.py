@@ -0,0 +1,78 @@
+# Times /get_analytics' yield matrix and statistics against rebuilding with pandas per request
+# Usage: DATABASE_URL=postgresql://... python benchmarks/bench_analytics.py --assets 60 --days 6500
+# Without DATABASE_URL a throwaway SQLite file is used as the stand-in database (see common.py).
+# Benchmark assets are seeded, extended by one day and deleted again afterwards; the matrix also
+# holds whatever else bond_yield has. tests/test_analytics.py checks the numpy statistics against pandas.
+
+import argparse
+import time
+
+from common import best_of, bench_countries, seed_assets, clear_assets, FIRST_DATE
+
+import numpy as np
+import pandas as pd
+
+from app import app
+from extensions import db
+from ingest import write_series
+from historical import load_frame
+from analytics import YieldMatrix, rolling_stat, correlation, changes, ANALYTICS_MIN_FRACTION
+
+def min_periods(window):
+    return max(2, int(np.ceil(window * ANALYTICS_MIN_FRACTION)))
+
+def pandas_request(countries, window):
+    # what a request did without the cached matrix: load, pivot, roll, correlate
+    frame = load_frame(countries, "All", "All").to_frame()
+    frame.rolling(window, min_periods=min_periods(window)).std()
+    frame.apply(lambda column: column.dropna().diff()).corr()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--assets", type=int, default=20)
+    parser.add_argument("--days", type=int, default=6500)
+    parser.add_argument("--window", type=int, default=20)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        asset_ids = seed_assets(args.assets, args.days, random_walk=True)
+        last_day = FIRST_DATE + args.days - 1
+        countries = bench_countries(args.assets)
+        print(f"database: {db.engine.dialect.name}, rows: {args.assets * args.days}")
+
+        try:
+            matrix = YieldMatrix()
+            start = time.perf_counter()
+            matrix.refresh()
+            print(f"{'matrix build':22}: {time.perf_counter() - start:8.4f}s {matrix.values.shape}")
+
+            # one more day for every benchmark asset, one write each as the daily sync does
+            for asset_id in asset_ids:
+                write_series(asset_id, 0, {'date': np.array([last_day + 1]), 'bond_yield': np.array([3.0])})
+            start = time.perf_counter()
+            status = matrix.refresh()
+            print(f"{'matrix ' + status:22}: {time.perf_counter() - start:8.4f}s {matrix.values.shape}")
+
+            columns = matrix.columns(countries)
+            values = matrix.values[:, columns]
+            reference = pd.DataFrame(values)
+            numpy_std, _ = best_of(lambda: rolling_stat(values, 'std', args.window))
+            pandas_std, _ = best_of(lambda: reference.rolling(args.window, min_periods=min_periods(args.window)).std())
+            print(f"{'rolling std':22}: numpy {numpy_std:8.4f}s, pandas {pandas_std:8.4f}s")
+            numpy_correlation, _ = best_of(lambda: correlation(changes(values)))
+            pandas_correlation, _ = best_of(lambda: reference.apply(lambda column: column.dropna().diff()).corr())
+            print(f"{'correlation of changes':22}: numpy {numpy_correlation:8.4f}s, pandas {pandas_correlation:8.4f}s")
+
+            def cached_request():
+                matrix.refresh()
+                rolling_stat(matrix.values[:, columns], 'std', args.window)
+                correlation(changes(matrix.values[:, columns]))
+            cached, _ = best_of(cached_request)
+            rebuilt, _ = best_of(lambda: pandas_request(countries, args.window), 3)
+            print(f"{'request':22}: cached matrix {cached:8.4f}s, rebuilt with pandas {rebuilt:8.4f}s")
+        finally:
+            clear_assets(asset_ids)
+
+if __name__ == "__main__":
+    main()
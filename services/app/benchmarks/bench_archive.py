@@ -0,0 +1,57 @@
+# Times full history pulls from the Arrow archive against bond_yield
+# Usage: DATABASE_URL=postgresql://... python benchmarks/bench_archive.py --assets 60 --days 6500
+# Without DATABASE_URL a throwaway SQLite file is used as the stand-in database (see common.py).
+# Benchmark assets are seeded, archived under /tmp and deleted again afterwards.
+# tests/test_archive.py checks the archive frames against the database.
+
+import argparse
+import shutil
+import time
+
+from common import best_of, bench_countries, seed_assets, clear_assets
+
+from app import app
+from extensions import db
+from archive import HistoricalArchive, refresh_archive
+from historical import load_columns, load_frame, pivot
+from queries import asset_generations_query
+
+ARCHIVE_DIR = "/tmp/bench_archive"
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--assets", type=int, default=20)
+    parser.add_argument("--days", type=int, default=6500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        asset_ids = seed_assets(args.assets, args.days)
+        countries = bench_countries(args.assets)
+        print(f"database: {db.engine.dialect.name}, rows: {args.assets * args.days}")
+
+        try:
+            start = time.perf_counter()
+            refresh_archive(ARCHIVE_DIR, countries)
+            print(f"{'archive refresh':18}: {time.perf_counter() - start:8.3f}s")
+
+            archive = HistoricalArchive(ARCHIVE_DIR)
+            generations = {asset_id: (value or 0, changed_from) for asset_id, value, changed_from in asset_generations_query(countries)}
+            if not archive.covers(generations):
+                raise SystemExit("archive does not cover the benchmark assets")
+
+            for label, start_date, end_date in (("full history", "All", "All"), ("one year", "2010-01-01", "2010-12-31")):
+                database, _ = best_of(lambda: load_columns(countries, start_date, end_date), args.repeat)
+                mapped, _ = best_of(lambda: archive.columns(generations, start_date, end_date), args.repeat)
+                print(f"{label + ' rows':18}: database {database:8.4f}s, archive {mapped:8.4f}s")
+
+                database, _ = best_of(lambda: load_frame(countries, start_date, end_date).to_csv(), args.repeat)
+                pivoted, _ = best_of(lambda: pivot(*archive.columns(generations, start_date, end_date)).to_csv(), args.repeat)
+                print(f"{label + ' csv':18}: database {database:8.4f}s, archive {pivoted:8.4f}s")
+        finally:
+            clear_assets(asset_ids)
+            shutil.rmtree(ARCHIVE_DIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
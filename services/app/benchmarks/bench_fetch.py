@@ -0,0 +1,36 @@
+# Fetches saved payloads from the local stub with historical_api.HistoricalClient
+# Usage: python benchmarks/bench_fetch.py [payload ...] [--page-rows 1000]
+# Defaults to notebooks/23801_spain_5.txt; a small --page-rows forces several pages per instrument.
+# tests/test_historical_api.py checks the pages join into the payload.
+
+import argparse
+
+from common import best_of
+
+from historical_api import HistoricalClient, fetch_metrics
+from ingest import payload_columns
+from stub_upstream import serve, load_payloads, DEFAULT_PAYLOAD
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("payloads", nargs="*", default=[DEFAULT_PAYLOAD])
+    parser.add_argument("--page-rows", type=int, default=1000)
+    args = parser.parse_args()
+
+    server = serve(load_payloads(args.payloads), page_rows=args.page_rows)
+    base_url = f"http://127.0.0.1:{server.server_port}/api/financialdata/historical"
+    client = HistoricalClient(base_url=base_url, page_rows=args.page_rows)
+
+    for instrument_id in load_payloads(args.payloads):
+        fetch_seconds, rows = best_of(lambda: client.fetch(instrument_id, end_date="2099-12-31"), 1)
+        parse_seconds, columns = best_of(lambda: payload_columns(rows), 1)
+        print(f"{instrument_id}: {len(rows)} rows in {fetch_metrics.counters.get('pages', 0)} pages, "
+              f"fetch {fetch_seconds * 1000:.0f}ms, parse {parse_seconds * 1000:.0f}ms, "
+              f"{len(columns['date'])} dates from {columns['date'][0]} to {columns['date'][-1]}")
+        fetch_metrics.counters.clear()
+
+    client.session.close()
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
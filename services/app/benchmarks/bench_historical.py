@@ -0,0 +1,61 @@
+# Compares the old ORM + pivot_table /get_historical implementation against the columnar endpoint
+# Usage: DATABASE_URL=postgresql://... python benchmarks/bench_historical.py --assets 60 --days 5000
+# Without DATABASE_URL a throwaway SQLite file is used as the stand-in database (see common.py)
+
+import argparse
+
+from common import best_of, bench_countries, seed_assets, clear_assets
+
+import pandas as pd
+
+from app import app
+from extensions import db
+from models import Asset, BondYield
+
+def legacy_historical(countries):
+    # the endpoint as it was: ORM objects, lazy asset loads, list of dicts, pivot_table
+    records = db.session.query(BondYield).join(Asset).filter(Asset.name.in_(countries.split())).all()
+    data = [
+        {
+            'Date': record.date,
+            'Country': record.asset.name,
+            'Period': f"{record.asset.period}Y",
+            'bond_yield': record.bond_yield,
+        }
+        for record in records
+    ]
+    df = pd.DataFrame(data)
+    df['bond_yield'] = pd.to_numeric(df['bond_yield'], errors='coerce')
+    pivot_df = df.pivot_table(index='Date', columns=['Country', 'Period'], values='bond_yield')
+    pivot_df.sort_values(by="Date", inplace=True)
+    pivot_df.rename_axis(index=None, inplace=True)
+    return pivot_df.to_html()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--assets", type=int, default=20)
+    parser.add_argument("--days", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        asset_ids = seed_assets(args.assets, args.days)
+        countries = bench_countries(args.assets)
+        print(f"database: {db.engine.dialect.name}, rows: {args.assets * args.days}")
+
+        try:
+            elapsed, _ = best_of(lambda: legacy_historical(countries), args.repeat)
+            print(f"{'legacy html':14}: {elapsed:8.3f}s")
+
+            client = app.test_client()
+            for output_format in ['html', 'csv', 'json', 'parquet', 'arrow']:
+                url = f"/get_historical?countries={countries.replace(' ', '+')}&start_date=01-01-1990&end_date=01-01-2100&format={output_format}"
+                elapsed, response = best_of(lambda: client.get(url), args.repeat)
+                size = len(response.data)
+                print(f"{'columnar ' + output_format:14}: {elapsed:8.3f}s {size / 1e6:8.2f} MB")
+        finally:
+            clear_assets(asset_ids)
+
+if __name__ == "__main__":
+    main()
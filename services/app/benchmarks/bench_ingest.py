@@ -0,0 +1,73 @@
+# Compares the per-row ORM write path against ingest.write_series
+# Usage: DATABASE_URL=postgresql://... python benchmarks/bench_ingest.py --rows 5000
+# Without DATABASE_URL a throwaway SQLite file is used as the stand-in database (see common.py)
+
+import argparse
+import time
+
+from common import FIRST_DATE
+
+import numpy as np
+
+from app import app
+from extensions import db
+from models import Asset, BondYield
+from ingest import write_series
+
+BENCH_ASSET = "benchmark-country"
+
+def make_series(rows):
+    dates = FIRST_DATE + np.arange(rows)
+    yields = np.round(np.random.default_rng(0).normal(3, 0.5, rows), 3)
+    return dates, yields
+
+def clear(asset_id):
+    BondYield.query.filter_by(asset_id=asset_id).delete()
+    db.session.commit()
+
+def bench_per_row(asset_id, dates, yields):
+    start = time.perf_counter()
+    # one transaction per row, the way the sync used to write
+    for date, bond_yield in zip(dates.tolist(), yields.tolist()):
+        db.session.add(BondYield(date=date, asset_id=asset_id, bond_yield=bond_yield, ref_id=0))
+        db.session.commit()
+    return time.perf_counter() - start
+
+def bench_bulk(asset_id, dates, yields, chunk_size):
+    start = time.perf_counter()
+    write_series(asset_id, 0, {'date': dates, 'bond_yield': yields}, chunk_size=chunk_size)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--skip-per-row", action="store_true")
+    args = parser.parse_args()
+
+    dates, yields = make_series(args.rows)
+
+    with app.app_context():
+        db.create_all()
+        asset_id = Asset.get_or_create(name=BENCH_ASSET, period=2).id
+        db.session.commit()
+        print(f"database: {db.engine.dialect.name}, rows: {args.rows}")
+
+        try:
+            if not args.skip_per_row:
+                clear(asset_id)
+                elapsed = bench_per_row(asset_id, dates, yields)
+                print(f"per-row commit : {elapsed:8.3f}s {args.rows / elapsed:12.0f} rows/sec")
+
+            clear(asset_id)
+            elapsed = bench_bulk(asset_id, dates, yields, args.chunk_size)
+            print(f"bulk insert    : {elapsed:8.3f}s {args.rows / elapsed:12.0f} rows/sec")
+
+            # second pass hits ON CONFLICT for every row
+            elapsed = bench_bulk(asset_id, dates, yields, args.chunk_size)
+            print(f"bulk upsert    : {elapsed:8.3f}s {args.rows / elapsed:12.0f} rows/sec")
+        finally:
+            clear(asset_id)
+
+if __name__ == "__main__":
+    main()
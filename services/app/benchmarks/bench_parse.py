@@ -0,0 +1,102 @@
+# Compares the per-cell WebDriver walk of the realtime bond table with parsers.parse_realtime_rows
+# Usage: python benchmarks/bench_parse.py [page.html ...] [--browser]
+# Without pages the saved fixture in benchmarks/fixtures is used, and it is regenerated if missing.
+# --browser also loads each page into headless Firefox over file:// and times the WebDriver walk,
+# which needs geckodriver; otherwise only the number of WebDriver calls it would make is reported.
+# tests/test_parsers.py checks both extractors agree on the fixture.
+
+import argparse
+import os
+
+from common import best_of
+
+import numpy as np
+from lxml import html
+
+from parsers import parse_realtime_rows, ROW_XPATH, PERIOD_XPATH
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "world_government_bonds.html")
+FIXTURE_COUNTRIES = [
+    "Australia", "Austria", "Belgium", "Brazil", "Canada", "China", "Czech Republic", "Denmark", "Finland",
+    "France", "Germany", "Greece", "Hong Kong", "Hungary", "India", "Indonesia", "Ireland", "Italy", "Japan",
+    "Malaysia", "Netherlands", "New Zealand", "Norway", "Philippines", "Poland", "Portugal", "Singapore",
+    "South Africa", "South Korea", "Spain", "Sweden", "Switzerland", "Thailand", "U.K.", "U.S.",
+]
+FIXTURE_TENORS = ["1Y", "2Y", "3Y", "5Y", "7Y", "10Y", "15Y", "20Y", "30Y"]
+
+def write_fixture(path):
+    # same shape as the live table: one pair_ row per tenor, the last yield in the third cell
+    # and a red clock icon on closed markets
+    rng = np.random.default_rng(0)
+    rows = []
+    pair_id = 23700
+    for country in FIXTURE_COUNTRIES:
+        closed = rng.random() < 0.4
+        for tenor in FIXTURE_TENORS:
+            pair_id += 1
+            last, high, low = np.round(rng.normal(3, 1, 3), 3)
+            clock = "redClockIcon" if closed else "greenClockIcon"
+            rows.append(
+                f'<tr id="pair_{pair_id}"><td class="flag"><span title="{country}" class="ceFlags">&nbsp;</span></td>'
+                f'<td class="bold left noWrap elp plusIconTd"><a href="/rates-bonds/{country.lower()}-{tenor}" title="{country} {tenor}">{country} {tenor}</a></td>'
+                f'<td class="pid-{pair_id}-last">{last:.3f}</td><td class="pid-{pair_id}-high">{high:.3f}</td>'
+                f'<td class="pid-{pair_id}-low">{low:.3f}</td><td class="bold pid-{pair_id}-pc">+0.01</td>'
+                f'<td class="pid-{pair_id}-time">10:15:00</td><td class="icon"><span class="{clock} isOpenPair-{pair_id}">&nbsp;</span></td></tr>'
+            )
+    page = (
+        '<html><head><title>World Government Bonds</title></head><body>'
+        '<table id="rates_bonds_table_99" class="genTbl closedTbl crossRatesTbl"><thead><tr><th>Name</th><th>Yield</th></tr></thead><tbody>'
+        + "\n".join(rows) +
+        '</tbody></table></body></html>'
+    )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write(page)
+
+def webdriver_calls(page_source):
+    # find_elements for the rows, then per row the period lookup and, for 2Y/5Y rows, the last
+    # cell, its text, the clock icon lookup and the period text
+    tree = html.fromstring(page_source)
+    calls = 1
+    for row in tree.xpath(ROW_XPATH):
+        calls += 5 if row.xpath(PERIOD_XPATH) else 1
+    return calls
+
+def bench_browser(path):
+    from bonds_sync_daily import BondSync
+    from selenium import webdriver
+    from selenium.webdriver.firefox.options import Options as FirefoxOptions
+
+    options = FirefoxOptions()
+    options.add_argument("--headless")
+    with webdriver.Firefox(options=options) as driver:
+        driver.get(f"file://{os.path.abspath(path)}")
+        webdriver_seconds, _ = best_of(lambda: BondSync.extract_rows_webdriver(driver), 1)
+        page_source_seconds, _ = best_of(lambda: parse_realtime_rows(driver.page_source), 3)
+    print(f"  webdriver walk: {webdriver_seconds * 1000:.1f}ms")
+    print(f"  page_source + lxml: {page_source_seconds * 1000:.1f}ms")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pages", nargs="*")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--browser", action="store_true")
+    args = parser.parse_args()
+
+    pages = args.pages
+    if not pages:
+        if not os.path.exists(FIXTURE_PATH):
+            write_fixture(FIXTURE_PATH)
+        pages = [FIXTURE_PATH]
+
+    for path in pages:
+        with open(path, 'r', encoding='utf-8') as file:
+            page_source = file.read()
+        seconds, rows = best_of(lambda: parse_realtime_rows(page_source), args.repeat)
+        print(f"{os.path.basename(path)}: {len(rows)} rows")
+        print(f"  lxml parse: {seconds * 1000:.2f}ms, replaces {webdriver_calls(page_source)} WebDriver calls")
+        if args.browser:
+            bench_browser(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# Times ingest.parse_payload on a saved 5000 row historical response against the DataFrame parse it replaced
+# Usage: python benchmarks/bench_payload.py [payload] [--repeat 20]
+# Defaults to notebooks/23801_spain_5.txt. The dedupe step is timed against a stored series
+# holding every other day of the payload. tests/test_ingest.py checks both parsers agree.
+
+import argparse
+import json
+
+from common import best_of
+
+import numpy as np
+import pandas as pd
+
+from ingest import parse_payload, PAYLOAD_FIELDS
+from parsers import loads
+from stub_upstream import DEFAULT_PAYLOAD
+
+def dataframe_parse(body):
+    # the parse as it was: stdlib json, one DataFrame, string dates through pd.to_datetime
+    items = json.loads(body)["data"]
+    df = pd.DataFrame({
+        'date': [item["rowDateTimestamp"].split('T')[0] for item in items],
+        **{name: [item.get(field) for item in items] for name, field in PAYLOAD_FIELDS.items()},
+    })
+    df['date'] = pd.to_datetime(df['date'])
+    for name in PAYLOAD_FIELDS:
+        df[name] = pd.to_numeric(df[name], errors='coerce')
+    df.dropna(subset=['date', 'bond_yield'], inplace=True)
+    return {name: df[name].values for name in df.columns}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("payload", nargs="?", default=DEFAULT_PAYLOAD)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.payload, 'rb') as file:
+        content = file.read()
+    body = content[content.index(b'{'):]
+
+    before, _ = best_of(lambda: dataframe_parse(body), args.repeat)
+    after, columns = best_of(lambda: parse_payload(body), args.repeat)
+
+    decode, _ = best_of(lambda: loads(body), args.repeat)
+    stored = columns['date'].astype(np.int64)[::2]
+    dedupe, kept = best_of(lambda: np.isin(columns['date'].astype(np.int64), stored, invert=True), args.repeat)
+
+    print(f"{len(columns['date'])} rows: DataFrame parse {before * 1000:.1f}ms, parse_payload {after * 1000:.1f}ms "
+          f"(decode {decode * 1000:.1f}ms with {loads.__module__}), dedupe against {len(stored)} stored dates "
+          f"{dedupe * 1000:.2f}ms keeping {int(kept.sum())}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Runs a daily sync's worth of API jobs through sync_pipeline.SyncPipeline against the local stub
+# and compares it with the old model of MAX_THREADS threads fetching one job at a time
+# Usage: python benchmarks/bench_pipeline.py --jobs 40 --latency 0.2 --rate 20 [--error-rate 0.05]
+# Rows are parsed but not written, so no database is needed
+
+import argparse
+import asyncio
+import threading
+from queue import Queue, Empty
+
+from common import best_of
+
+from historical_api import HistoricalClient
+from ingest import payload_columns
+from stub_upstream import serve, load_payload, DEFAULT_PAYLOAD
+from sync_pipeline import SyncPipeline
+
+class BenchJob():
+    # stands in for CountryYearData: every job has a known id and nothing is written
+
+    def __init__(self, instrument_id):
+        self.country = f"bench-{instrument_id}"
+        self.year = "5"
+        self.new_from_date = None
+        self.new_to_date = None
+        self.backfill = False
+        self.instrument_id = instrument_id
+
+    def known_instrument_id(self):
+        return self.instrument_id
+
+    def write_payload(self, items):
+        payload_columns(items)
+
+    def run_main_thread(self, browser_pool):
+        raise RuntimeError("bench jobs never use the browser")
+
+class NoBrowsers():
+    size = 1
+
+def threaded(base_url, job_ids, threads, page_rows):
+    client = HistoricalClient(base_url=base_url, pool_size=threads, page_rows=page_rows)
+    jobs = Queue()
+    for instrument_id in job_ids:
+        jobs.put(instrument_id)
+
+    def worker():
+        while True:
+            try:
+                instrument_id = jobs.get_nowait()
+            except Empty:
+                return
+            payload_columns(client.fetch(instrument_id, end_date="2099-12-31"))
+
+    def run():
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    return best_of(run, 1)[0]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payload", default=DEFAULT_PAYLOAD)
+    parser.add_argument("--jobs", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--page-rows", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--host-concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=20)
+    parser.add_argument("--burst", type=int, default=8)
+    args = parser.parse_args()
+
+    payload = load_payload(args.payload)
+    job_ids = [str(30000 + i) for i in range(args.jobs)]
+    server = serve({instrument_id: payload for instrument_id in job_ids}, page_rows=args.page_rows,
+                   latency=args.latency, error_rate=args.error_rate)
+    base_url = f"http://127.0.0.1:{server.server_port}/api/financialdata/historical"
+
+    if not args.error_rate:
+        print(f"{args.threads} threads: {threaded(base_url, job_ids, args.threads, args.page_rows):.2f}s")
+
+    client = HistoricalClient(base_url=base_url, pool_size=args.host_concurrency, page_rows=args.page_rows, retries=0)
+    pipeline = SyncPipeline(client, NoBrowsers(), concurrency=args.concurrency, rate=args.rate, burst=args.burst,
+                            host_concurrency=args.host_concurrency, backoff=0.1)
+    report = asyncio.run(pipeline.run([BenchJob(instrument_id) for instrument_id in job_ids]))
+    print(f"pipeline: {report.summary()}")
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Times /get_realtime's row fetch from the realtime ring buffers against realtime_query
+# Usage: DATABASE_URL=postgresql://... python benchmarks/bench_realtime.py --minutes 600 --assets 70
+# Without DATABASE_URL a throwaway SQLite file is used (see common.py). Synthetic 1 minute bars (and the coarser
+# bars they roll into) are written to bond_yield_realtime for benchmark assets, pushed to a store
+# under /tmp and deleted again afterwards.
+
+import argparse
+import os
+from datetime import datetime, timedelta
+
+from common import best_of
+
+import numpy as np
+
+from app import app
+from extensions import db
+from models import Asset, BondYieldRealtime
+from queries import realtime_query
+from realtime_store import RealtimeStore, table_timezone
+from utilities import timeframes, bar_start
+
+STORE_PATH = "/tmp/bench_realtime_store"
+
+def write_bars(asset_ids, minutes, store):
+    rng = np.random.default_rng(0)
+    first = datetime(2024, 1, 2, 8, 0)
+    for minute in range(minutes):
+        tick = first + timedelta(minutes=minute)
+        rows = [
+            {'datetime': bar_start(tick, timeframe), 'asset_id': asset_id, 'timeframe': timeframe, 'open': value,
+             'high': value, 'low': value, 'bond_yield': value, 'is_open': 0, 'is_close': 0}
+            for asset_id, value in zip(asset_ids, np.round(rng.normal(3, 0.1, len(asset_ids)), 3).tolist())
+            for timeframe in timeframes.values()
+        ]
+        BondYieldRealtime.upsert_bars(rows)
+        db.session.commit()
+        store.push(rows)
+
+def clear(asset_ids):
+    BondYieldRealtime.query.filter(BondYieldRealtime.asset_id.in_(asset_ids)).delete()
+    db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=int, default=600)
+    parser.add_argument("--assets", type=int, default=70)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        asset_ids = [Asset.get_or_create(name=f"bench-{index // 2}", period=2 if index % 2 == 0 else 5).id for index in range(args.assets)]
+        db.session.commit()
+        clear(asset_ids)
+
+        try:
+            store = RealtimeStore(STORE_PATH).create()
+            store.zone = table_timezone()
+            store.warm()
+            elapsed, _ = best_of(lambda: write_bars(asset_ids, args.minutes, store), 1)
+            print(f"database: {db.engine.dialect.name}, {args.minutes} minutes x {len(asset_ids)} assets written in {elapsed:.1f}s")
+
+            # the store also holds whatever else the table has, "All" is compared over every asset
+            reader = RealtimeStore(STORE_PATH)
+            for countries, timeframe, max_rows in (("All", 1, 500), ("All", 5, 5000), ("bench-1 bench-2", 15, 100)):
+                ids = None if countries == "All" else asset_ids[2:6]
+                sql, _ = best_of(lambda: realtime_query(countries, timeframe, max_rows).all(), 20)
+                memory, latest = best_of(lambda: reader.latest(ids, timeframe, max_rows), 20)
+                served = "buffers" if latest is not None else "falls back to SQL"
+                print(f"{countries} {timeframe}M max_rows={max_rows}: SQL {sql * 1000:.2f}ms, ring buffers {memory * 1000:.3f}ms ({served})")
+        finally:
+            clear(asset_ids)
+
+    os.remove(STORE_PATH)
+
+if __name__ == "__main__":
+    main()
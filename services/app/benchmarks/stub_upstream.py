@@ -0,0 +1,98 @@
+# Local stand-in for the historical API, replaying saved responses such as notebooks/23801_spain_5.txt
+# Usage: python benchmarks/stub_upstream.py [payload ...] [--port 8765] [--page-rows 5000] [--latency 0.2] [--error-rate 0.1]
+# Each payload file is served as /api/financialdata/historical/<id>, the id being the leading number
+# of its file name. Requests are filtered by start-date/end-date and capped at --page-rows rows
+# from the start of the range, the way the real endpoint pages. --latency delays every response
+# and --error-rate answers that share of requests with a 503.
+
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+DEFAULT_PAYLOAD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "notebooks", "23801_spain_5.txt")
+PATH_PATTERN = re.compile(r'^/api/financialdata/historical/(\d+)$')
+
+def load_payload(path):
+    # saved as "Response Code: 200\nResponse Body: {...}", or as the bare JSON body
+    with open(path, 'r') as file:
+        content = file.read()
+    body = json.loads(content[content.index('{'):])
+    rows = sorted(body["data"] or [], key=lambda row: row["rowDateTimestamp"], reverse=True)
+    return {**body, "data": rows}
+
+def load_payloads(paths):
+    payloads = {}
+    for path in paths:
+        instrument_id = re.match(r'(\d+)', os.path.basename(path)).group(1)
+        payloads[instrument_id] = load_payload(path)
+    return payloads
+
+def make_handler(payloads, page_rows, latency=0, error_rate=0):
+
+    class StubHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            time.sleep(latency)
+            if random.random() < error_rate:
+                self.send_error(503)
+                return
+            url = urlparse(self.path)
+            match = PATH_PATTERN.match(url.path)
+            if not match or match.group(1) not in payloads:
+                self.send_error(404)
+                return
+
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            start, end = query.get("start-date", "0000-00-00"), query.get("end-date", "9999-99-99")
+            payload = payloads[match.group(1)]
+            rows = [row for row in payload["data"] if start <= row["rowDateTimestamp"][:10] <= end]
+            if not rows:
+                self.send_response(204)
+                self.end_headers()
+                return
+
+            # still newest first, but a capped page holds the oldest rows of the range so callers
+            # page forward from its newest date
+            rows = rows[-page_rows:]
+            body = json.dumps({**payload, "data": rows}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+def serve(payloads, port=0, page_rows=5000, latency=0, error_rate=0):
+    '''
+    Starts the stub for {instrument id: payload} on a daemon thread and returns the server,
+    server.server_port is the bound port
+    '''
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(payloads, page_rows, latency, error_rate))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("payloads", nargs="*", default=[DEFAULT_PAYLOAD])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--page-rows", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(load_payloads(args.payloads), args.page_rows, args.latency, args.error_rate))
+    print(f"serving {len(args.payloads)} payloads on http://127.0.0.1:{args.port}/api/financialdata/historical")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -23,17 +23,27 @@ import re
 import socket
 import subprocess
 import threading
+import asyncio
 import sys
-from queue import Queue
 
 
 import logging
 import traceback
 
 from extensions import db
-from models import BondYield, Asset
+from models import BondYield, Asset, unit_of_work
 from app import app
+from ingest import write_series, payload_columns, drop_stored_dates
+from sync_planner import series_watermarks, plan_jobs, save_watermarks
+from gap_scan import scan_gaps, plan_backfill, save_coverage, mark_checked
+from archive import refresh_archive
 from logging_config import write_to_logfile, OK, NO_CONTENT
+from browser_pool import BrowserPool
+from parsers import parse_realtime_rows
+from historical_api import HistoricalClient
+from sync_pipeline import SyncPipeline, SYNC_HOST_CONCURRENCY
+from handoff import HandoffServer, HandoffTimeout
+from spool import read_spool, spool_id, leftover_spools, pending_path, complete_path, is_stale, SPOOL_STALE_SECONDS
 
 # count = 1
 
@@ -46,12 +56,19 @@ load_dotenv(".env")
 
 write_lock = threading.Lock()
 
-MAX_THREADS = 2
+# lxml parses one page_source snapshot of the realtime table, selenium walks it cell by cell
+REALTIME_PARSER = os.environ.get("REALTIME_PARSER", "lxml")
+# api calls the historical endpoint directly for instruments url_list.log already knows, browser
+# always goes through the historical-data page and the proxy files
+HISTORICAL_FETCH_MODE = os.environ.get("HISTORICAL_FETCH_MODE", "api")
+# 1 scans every series for holes before the catch-up jobs and backfills them through the API
+GAP_SCAN = os.environ.get("GAP_SCAN", "1") == "1"
 
 class BondSync():
 
     def __init__(self):
-        self.jobs = Queue()
+        self.jobs = []
+        self.handoff = None
         self.realtime_url = 'https://www.investing.com/rates-bonds/world-government-bonds?maturity_from=10&maturity_to=310'
 
         self.headers = {
@@ -68,6 +85,7 @@ class BondSync():
         options.add_argument('--disable-gpu')
         
         self.options = options
+        self.browser_pool = BrowserPool(self.new_driver)
 
     #############################
     # SETUP (RUN IN INIT)
@@ -119,11 +137,47 @@ class BondSync():
         geckodriver_path = '/usr/local/bin/geckodriver'  # Replace with your geckodriver path
         return Service(geckodriver_path)
 
+    def new_driver(self):
+        driver = webdriver.Firefox(options=self.options, service=self.get_service())
+        driver.set_page_load_timeout(5)
+        return driver
+
+    @staticmethod
+    def extract_rows_webdriver(driver):
+        # Initialize a list to store the data
+        data = []
+
+        # Find all the rows in the table
+        rows = driver.find_elements(By.XPATH, '//tr[contains(@id, "pair_")]')
+
+        for row in rows:
+            try:
+                # Check if the row contains "2Y" or "5Y"
+                period = row.find_element(By.XPATH, './/td/a[contains(text(), " 2Y") or contains(text(), " 5Y")]')
+                if period:
+                    # Extract the last value
+                    last = row.find_element(By.XPATH, './/td[3]').text
+                    # Check for the clock icon status
+                    status = 'closed' if row.find_elements(By.XPATH, './/span[contains(@class, "redClockIcon")]') else 'open'
+                    # Append the extracted data to the list
+                    data.append((period.text, last, status))
+
+            except NoSuchElementException as e:
+                continue
+
+        return data
+
+    @staticmethod
+    def extract_rows(driver):
+        # one page_source round trip parsed locally, or one WebDriver call per cell
+        if REALTIME_PARSER == "lxml":
+            return parse_realtime_rows(driver.page_source)
+        return BondSync.extract_rows_webdriver(driver)
+
     def get_new_data(self, retries):
 
-        with webdriver.Firefox(options=self.options, service=self.get_service()) as driver:
+        with self.browser_pool.lease() as driver:
             try:
-                driver.set_page_load_timeout(5)
                 driver.get(self.realtime_url)
             except TimeoutException:
                 pass
@@ -135,38 +189,14 @@ class BondSync():
                 for _ in range(retries):
                     try:
                         WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'rates_bonds_table_99')))
-                        # Initialize a list to store the data
-                        data = []
-
-                        # Find all the rows in the table
-                        rows = driver.find_elements(By.XPATH, '//tr[contains(@id, "pair_")]')
-
-                        for row in rows:
-                            try:
-                                # Check if the row contains "2Y" or "5Y"
-                                period = row.find_element(By.XPATH, './/td/a[contains(text(), " 2Y") or contains(text(), " 5Y")]')
-                                if period:
-                                    # Extract the last value
-                                    last = row.find_element(By.XPATH, './/td[3]').text
-                                    # Check for the clock icon status
-                                    status = 'closed' if row.find_elements(By.XPATH, './/span[contains(@class, "redClockIcon")]') else 'open'
-                                    # Append the extracted data to the list
-                                    data.append((period.text, last, status))
-
-                            except NoSuchElementException as e:
-                                continue
-
-                        # Close the WebDriver
-                        driver.quit()
-
-                        # Return the data
-                        return data
+
+                        # Return the data, the browser goes back to the pool
+                        return self.extract_rows(driver)
                     except TimeoutException:
                         pass
                     except Exception as e:
                         logging.error(traceback.format_exc())
 
-                driver.quit()
                 return None
 
 
@@ -233,6 +263,10 @@ class BondSync():
                 logging.error("Proxy or database not started!")
                 exit(1)
 
+            # the proxy streams captured pages here while the jobs run
+            self.handoff = HandoffServer().start()
+            self.recover_spools()
+
             data = self.get_new_data(retries=2)
             df = self.convert_realtime_to_df(data)
             countries_list = self.get_countries(df)
@@ -249,80 +283,95 @@ class BondSync():
             # }
             # webdriver.DesiredCapabilities.FIREFOX['marionette'] = True
             
-            for country in countries_list:
-                for year in ('2', '5'):
-                    latest_date = self.get_latest_date(country, int(year))
-                    if not latest_date or latest_date + timedelta(days=1) < datetime.now().date():
-                        
-                        new_from_date = latest_date + timedelta(days=1) if latest_date else None
-                        # if not latest_date:
-                        #     print(f"Getting data for {country} {year}Y as no latest date")
-                        # else:
-                        #     print(f"Getting data for {country} {year}Y as latest date was {datetime.strftime(latest_date, "%Y/%m/%d")}")
-                        self.jobs.put((country, year, new_from_date))
-
-            for _ in range(MAX_THREADS):
-                worker = threading.Thread(target=CountryYearData.extract_data_into_database, args=(self.jobs, self.options))
-                worker.start()
+            # one query for every series' watermark, also handed to the proxy through the watermarks file
+            with app.app_context():
+                watermarks = series_watermarks()
+                coverage = scan_gaps(watermarks) if GAP_SCAN and HISTORICAL_FETCH_MODE == "api" else []
+            save_watermarks(watermarks)
+            plan = plan_jobs(countries_list, watermarks)
+            if coverage:
+                save_coverage(coverage)
+                plan += plan_backfill(coverage)
+            logging.info(f"Planned {len(plan)} jobs: {[planned.to_dict() for planned in plan]}")
+            for planned in plan:
+                job = CountryYearData(planned.country, planned.year, planned.from_date, self.handoff, planned.to_date)
+                job.backfill = planned.backfill
+                self.jobs.append(job)
+
+            # the pipeline owns retries, so the client itself does not retry
+            historical_client = HistoricalClient(pool_size=SYNC_HOST_CONCURRENCY, retries=0) if HISTORICAL_FETCH_MODE == "api" else None
+
+            # the browser that fetched the countries list is already warm for the first browser job
+            pipeline = SyncPipeline(historical_client, self.browser_pool)
+            report = asyncio.run(pipeline.run(self.jobs))
+            if historical_client:
+                historical_client.close()
+
+            logging.info(f"Daily sync finished: {report.summary()}")
+            for result in report.results:
+                if result.mode == "failed":
+                    write_to_logfile("failed_ids", f"{result.to_dict()}")
+
+            # a fetched window that still has holes is closed days, the next scan leaves it alone
+            mark_checked([
+                (planned.asset_id, planned.from_date, planned.to_date)
+                for planned, result in zip(plan, report.results) if planned.backfill and result.mode == "api"
+            ])
+
+            # rewrites the archived series this run changed, /get_historical reads them from the database until then
+            with app.app_context():
+                refresh_archive(app.config["HISTORICAL_ARCHIVE_DIR"])
         except Exception as e:
             logging.error(traceback.format_exc())
+        finally:
+            self.browser_pool.close()
+            if self.handoff:
+                self.handoff.close()
 
     @staticmethod
-    def get_latest_date(country, year):
-        with app.app_context():
-            latest_bond_yield = (BondYield.query
-                            .join(Asset)  # Assuming 'country' is the relationship attribute in BondYield
-                            .filter(
-                                Asset.name == country,
-                                Asset.period == year
-                            )
-                            .order_by(BondYield.date.desc())
-                            .first())
-        if not latest_bond_yield:
-            # logging.info(f"no latest date for {country} {year}Y")
-            return None
-        
-        return latest_bond_yield.date
+    def recover_spools(min_age=SPOOL_STALE_SECONDS):
+        # spools an earlier run never consumed, before their series are planned again
+        try:
+            with open(CountryYearData.url_list_path, 'r') as file:
+                content = file.read().strip()
+            known_ids = {entry.get("id"): key for key, entry in json.loads(content).items()} if content else {}
+        except (OSError, json.JSONDecodeError):
+            known_ids = {}
+
+        for path in leftover_spools():
+            if not is_stale(path, min_age):
+                continue
+            key = known_ids.get(spool_id(path))
+            if key is None:
+                write_to_logfile("failed_ids", f"Leftover spool {path} has no known series")
+                continue
+            country, year = key.rsplit("_", 1)
+            job = CountryYearData(country, year, None)
+            job._id = spool_id(path)
+            job.write_to_database(path)
 
 class CountryYearData():
 
     url_list_path = "/var/log/url_list.log"
 
-    def __init__(self, country, year, new_date):
+    def __init__(self, country, year, new_date, handoff=None, new_to_date=None):
         self.cloud = 1 if os.environ.get("CLOUD") == "1" else 0
         self.country = country
         self._id = None
         self.year = year
         self.data_directory = Path("/home/app/data")
         self.new_from_date = new_date
+        self.new_to_date = new_to_date
+        self.backfill = False # a window inside the series, only the API path can fetch it
+        self.handoff = handoff
     
     @property
     def pending_file(self):
-        return self.data_directory / f"{self._id}_PENDING.txt"
+        return Path(pending_path(self._id, self.data_directory))
         
     @property
     def complete_file(self):
-        return self.data_directory / f"{self._id}_COMPLETE.txt"
-
-    ###########################################
-    # RUN THREAD FOR EACH COUNTRY AND CALLBACK
-    ###########################################
-        
-    @classmethod
-    def extract_data_into_database(cls, jobs, options):
-        while not jobs.empty():
-            args = jobs.get()
-            country = args[0]
-            year = args[1]
-            from_date = args[2]
-
-            try:
-                new_country_year = cls(country, year, from_date)
-                new_country_year.run_main_thread(options)
-            except Exception as e:
-                logging.error(traceback.format_exc())
-            finally:
-                jobs.task_done()
+        return Path(complete_path(self._id, self.data_directory))
 
     ###########################################
     # DETERMINE POSSIBLE URLS FOR SELENIUM
@@ -372,6 +421,16 @@ class CountryYearData():
             logging.error(traceback.format_exc())
         return None
 
+    def known_instrument_id(self):
+        try:
+            with open(self.url_list_path, 'r') as file:
+                content = file.read().strip()
+            if content:
+                return json.loads(content).get(f"{self.country}_{self.year}", {}).get("id")
+        except (OSError, json.JSONDecodeError):
+            pass
+        return None
+
     def update_url_list_file(self, historical_data_url):
         with write_lock:
             try:
@@ -504,19 +563,14 @@ class CountryYearData():
 
             write_to_logfile(self._id, df.info())
             df['date'] = pd.to_datetime(df['date'])
-            df.sort_values(by='date', ascending=False, inplace=True)
+            df['yield'] = pd.to_numeric(df['yield'], errors='coerce')
+            df.dropna(inplace=True)
 
-            with app.app_context():
-                asset = db.session.query(Asset).filter_by(name=self.country, period=int(self.year)).first()
-                if not asset:
-                    asset = Asset(name=self.country, period=self.year)
-
-                # Iterate over the DataFrame and insert bond yields
-                for _, row in df.iterrows():
-                    BondYield(date=row['date'], asset_id=asset.id, bond_yield=row['yield'], ref_id = self._id)
+            with app.app_context(), unit_of_work():
+                asset = Asset.get_or_create(name=self.country, period=self.year)
+                rows = write_series(asset.id, self._id, {'date': df['date'].values, 'bond_yield': df['yield'].values})
+                write_to_logfile(self._id, f"{rows} rows written")
 
-            
-        
         except Exception as e:
             write_to_logfile(self._id, traceback.format_exc())
 
@@ -532,15 +586,26 @@ class CountryYearData():
             else:
                 break
 
-        if self.complete_file.exists():
-            with open(self.complete_file, 'r+') as file:
-                content = file.read().strip()
-                file.seek(0)
-                if not content:
-                    return NO_CONTENT
-                else:
-                    return OK
-        return 0
+        return OK if self.complete_file.exists() else 0
+
+    def receive_pages(self):
+        # pages come over the handoff channel when the proxy could reach it, files otherwise
+        if self.handoff is None:
+            return self.update_file()
+
+        pages = 0
+        try:
+            for page in self.handoff.pages(self._id):
+                if page.get('data'):
+                    self.write_payload(page['data'])
+                pages += 1
+        except HandoffTimeout:
+            if self.complete_file.exists() or self.pending_file.exists():
+                return self.update_file()
+            write_to_logfile(self._id, "NO PAGES FROM PROXY")
+            return
+
+        write_to_logfile(self._id, f"{pages} PAGES ADDED TO DATABASE" if pages else "NO NEW DATA FROM PROXY")
 
     def update_file(self):
 
@@ -553,65 +618,47 @@ class CountryYearData():
 
             status = self.wait_for_file_complete()
             if not status:
-                write_to_logfile(self._id, "COMPLETE FILE NOT FOUND")
+                # the proxy may still be paging into it, only a spool it abandoned is taken now,
+                # a recent one is left for recover_spools on the next run
+                if not is_stale(self.pending_file):
+                    write_to_logfile(self._id, "PENDING FILE STILL BEING WRITTEN, LEFT FOR THE NEXT RUN")
+                    return
+                write_to_logfile(self._id, "PENDING FILE NOT COMPLETED, RECOVERING IT")
+                self.write_to_database(self.pending_file)
                 return
-            
-        if status == NO_CONTENT:
-            write_to_logfile(self._id, f"COMPLETE FILE EMPTY")
-            os.remove(self.complete_file)
-            return
-
-        self.write_to_database()
-        write_to_logfile(self._id, "FILE ADDED TO DATABASE")
 
+        self.write_to_database(self.complete_file)
 
-    def write_to_database(self):
 
-        with open(self.complete_file, 'r') as f:
-            content = f.read()
+    def write_payload(self, items):
+        with app.app_context(), unit_of_work():
+            asset = Asset.get_or_create(name=self.country, period=self.year)
+            rows = write_series(asset.id, self._id, drop_stored_dates(asset.id, payload_columns(items)))
+            write_to_logfile(self._id, f"{rows} rows written")
 
+    def write_to_database(self, spool_file):
+        # streamed a batch at a time, a spool is never loaded whole. It is only removed once every
+        # batch is written, a failed one stays for recover_spools (the upserts make a retry safe)
+        rows = 0
         try:
-            data = json.loads(content)
-        except json.JSONDecodeError:
-            write_to_logfile(self._id, traceback.format_exc())
-        except Exception as e:
-            logging.error(traceback.format_exc())
-        
-        try:
-            extracted_data = [
-                {"yield": item["last_close"], "date": item["rowDateTimestamp"]}
-                for item in data['data']
-            ]
-
-            # Create a DataFrame from the extracted data
-            df = pd.DataFrame(extracted_data)
-            df['date'] = df.date.apply(lambda x: x.split('T')[0])
-            df['date'] = pd.to_datetime(df['date'])
-            df.sort_values(by='date', ascending=False, inplace=True)
-
-            with app.app_context():
-                asset = db.session.query(Asset).filter_by(name=self.country, period=int(self.year)).first()
-                if not asset:
-                    asset = Asset(name=self.country, period=self.year)
-
-                # Iterate over the DataFrame and insert bond yields
-                for _, row in df.iterrows():
-                    BondYield(date=row['date'], asset_id=asset.id, bond_yield=row['yield'], ref_id = self._id)
-        
+            for batch in read_spool(spool_file):
+                self.write_payload(batch)
+                rows += len(batch)
         except Exception as e:
             write_to_logfile(self._id, traceback.format_exc())
-        finally:
-            os.remove(self.complete_file)
+            write_to_logfile(self._id, f"SPOOL {spool_file} KEPT FOR RECOVERY")
+            return False
+        write_to_logfile(self._id, f"FILE ADDED TO DATABASE, {rows} rows" if rows else "COMPLETE FILE EMPTY")
+        os.remove(spool_file)
+        return True
 
     ###########################################
     # RUN MAIN FOR EACH COUNTRY AND CALLBACK
     ###########################################
 
-    def run_main_thread(self, options):
-        with webdriver.Firefox(options=options, service=BondSync.get_service()) as driver:
+    def run_main_thread(self, browser_pool):
+        with browser_pool.lease() as driver:
             try:
-                driver.set_page_load_timeout(5)  # Set timeout to 10 seconds
-
                 self.url_list = self.get_possible_urls()
                 # print(self.url_list)
             
@@ -639,7 +686,7 @@ class CountryYearData():
 
                         # CLOUD WILL HAVE LATEST DATE
                         if not self.cloud:
-                            self.update_file() # ADD TO DATABASE
+                            self.receive_pages() # ADD TO DATABASE
                         else:
                             self.cloud_write_to_database()
 
@@ -658,8 +705,6 @@ class CountryYearData():
             
             except Exception as e:
                 logging.error(traceback.format_exc())
-            finally:
-                driver.quit()
 
 if __name__ == "__main__":
     try:
@@ -1,11 +1,22 @@
 from bonds_sync_daily import BondSync
-from utilities import current_sg_time
+from utilities import current_sg_time, bar_start, timeframes
 from extensions import db
 from datetime import datetime, timedelta
-from models import BondYieldRealtime, Asset
+from models import BondYieldRealtime, BondSpreadRealtime, Asset, CacheGeneration, unit_of_work
+from cache import REALTIME_CACHE_KEY
 from app import app
 import logging
 from logging_config import write_to_logfile
+from metrics import get_registry
+from realtime_store import RealtimeStore, table_timezone
+from partitions import run_maintenance
+from spreads import spread_bar_rows
+import fcntl
+import os
+import signal
+import sys
+import threading
+import time
 import traceback
 
 # def get_latest_value(country, year):
@@ -25,63 +36,211 @@ import traceback
 
 
 
-def write_to_database(df):
+realtime_metrics = get_registry("realtime")
+
+# the ring buffers /get_realtime reads, this process is their only writer (see acquire_lock)
+realtime_store = None
+
+def get_realtime_store(rebuild=False):
+    # reuses the buffers a previous run left in /dev/shm, otherwise builds them from the table
+    global realtime_store
+    if realtime_store is None or rebuild:
+        store = RealtimeStore(app.config["REALTIME_STORE_PATH"])
+        try:
+            # an odd sequence is a write that never finished
+            reused = not rebuild and os.path.exists(store.path) and store.map('r+') and store.version % 2 == 0
+        except (OSError, ValueError):
+            reused = False
+        with app.app_context():
+            store.zone = table_timezone()
+            if not reused:
+                store.create()
+                store.warm()
+        realtime_store = store
+    return realtime_store
+
+# (country, period) -> asset id, assets are never renamed so this only grows
+asset_ids = {}
+
+def get_asset_ids(keys):
+    if any(key not in asset_ids for key in keys):
+        asset_ids.update(Asset.id_map())
+
+    missing = [key for key in keys if key not in asset_ids]
+    if missing:
+        Asset.bulk_create([{'name': name, 'period': period} for name, period in missing])
+        asset_ids.update(Asset.id_map())
+        write_to_logfile("realtime_data", f"assets added: {missing}")
+
+    return asset_ids
+
+def build_tick_rows(df, ids, latest_entries, rounded_datetime):
+    # every open quote becomes a 1 minute bar plus an update to each coarser bar it falls in
+    bar_rows = []
+    close_keys = []
+    for (country_name, period), row in df.iterrows():
+        asset_id = ids[(country_name, int(period))]
+        latest_entry = latest_entries.get(asset_id)
+
+        if row['Status'] == "open":
+            bond_yield = float(row['Yield'])
+            is_open = 1 if latest_entry and latest_entry.is_close == 1 else 0
+            for timeframe in timeframes.values():
+                bar_rows.append({
+                    'datetime': bar_start(rounded_datetime, timeframe),
+                    'asset_id': asset_id,
+                    'timeframe': timeframe,
+                    'open': bond_yield,
+                    'high': bond_yield,
+                    'low': bond_yield,
+                    'bond_yield': bond_yield,
+                    'is_open': is_open,
+                    'is_close': 0,
+                })
+        elif latest_entry and not latest_entry.is_close == 1:
+            close_keys.extend(
+                (bar_start(latest_entry.datetime, timeframe), asset_id, timeframe)
+                for timeframe in timeframes.values()
+            )
+    return bar_rows, close_keys
+
+def write_to_database(df, tick_time=None):
 
     # write_to_logfile("realtime_data", "writing to database")
 
     try:
-        datetime_now = current_sg_time()
+        # the daemon passes its scheduled minute so a slow scrape cannot shift the bar
+        datetime_now = tick_time or current_sg_time()
         rounded_datetime = datetime_now - timedelta(seconds=datetime_now.second, microseconds=datetime_now.microsecond)
-        total_min = rounded_datetime.hour * 60 + rounded_datetime.minute
 
-        # write_to_logfile("realtime_data", f"{rounded_datetime}")
+        # one query for asset ids (skipped once cached), one for the latest rows and one upsert for the tick
+        with realtime_metrics.timer("tick_db_seconds"), app.app_context(), unit_of_work():
+            keys = [(country_name, int(period)) for country_name, period in df.index]
+            ids = get_asset_ids(keys)
+            latest_entries = BondYieldRealtime.latest_entries([ids[key] for key in keys])
 
-        for timeframe in [240, 120, 60, 30, 15, 5, 1]:
-            if total_min % timeframe == 0:
-                highest_timeframe = timeframe
-                break
+            bar_rows, close_keys = build_tick_rows(df, ids, latest_entries, rounded_datetime)
+            BondYieldRealtime.upsert_bars(bar_rows)
+            BondYieldRealtime.mark_closed(close_keys)
+            BondSpreadRealtime.upsert_many(spread_bar_rows(bar_rows, {asset_id: key for key, asset_id in ids.items()}))
+            CacheGeneration.bump(REALTIME_CACHE_KEY)
 
-        # write_to_logfile("realtime_data", datetime_now)
+        realtime_metrics.increment("ticks_written")
+        realtime_metrics.increment("rows_written", len(bar_rows))
 
-        with app.app_context():
-
-            for (country_name, period), row in df.iterrows():
-
-                # Assuming you have a function get_country_id to map country names to IDs
-                asset = db.session.query(Asset).filter_by(name=country_name, period=int(period)).first()
-                if not asset:
-                    asset = Asset(name=country_name, period=period)
-                    write_to_logfile("realtime_data", "asset added!")
-
-                latest_entry = BondYieldRealtime.latest_entry(asset.id)
-
-                # Create a new instance of the model
-                if row['Status'] == "open":
-                    BondYieldRealtime(
-                        datetime=rounded_datetime,
-                        asset_id=asset.id,
-                        bond_yield=row['Yield'],
-                        is_open=1 if latest_entry and latest_entry.is_close == 1 else 0,
-                        timeframe=highest_timeframe
-                    )
-                    
-                elif latest_entry and not latest_entry.is_close == 1:
-                    latest_entry.is_close == 1
-                    db.session.commit()
+        # only once committed, so the buffers never hold a bar the table does not
+        with realtime_metrics.timer("tick_store_seconds"):
+            get_realtime_store().push(bar_rows)
 
     except Exception as e:
+        realtime_metrics.increment("tick_errors")
         write_to_logfile("realtime_data", traceback.format_exc())
+    finally:
+        realtime_metrics.flush()
+
+##############################
+# SCHEDULING
+##############################
+
+TICK_SECONDS = 60
+# a tick that starts later than this after its minute is dropped in favour of the next one
+TICK_GRACE_SECONDS = 20
+LOCK_PATH = "/tmp/bonds_sync_realtime.lock"
+
+def acquire_lock():
+    # held for the life of the process so a cron run and the daemon never scrape at the same time
+    lock_file = open(LOCK_PATH, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def run_tick(bond_sync_controller, tick_time=None):
+    with realtime_metrics.timer("scrape_seconds"):
+        new_data = bond_sync_controller.get_new_data(retries=3)
+    if new_data == None:
+        realtime_metrics.increment("scrape_errors")
+        write_to_logfile("realtime_data", f"failed to get data for {datetime.strftime(tick_time or current_sg_time(), '%Y-%m-%d %H:%M')}")
+        realtime_metrics.flush()
+        return
+    with realtime_metrics.timer("parse_seconds"):
+        new_data_df = bond_sync_controller.convert_realtime_to_df(new_data)
+    write_to_database(new_data_df, tick_time)
+
+def maintain_table():
+    # partitions ahead and retention of bond_yield_realtime, a failure is retried on the next tick
+    try:
+        with app.app_context():
+            run_maintenance(app.config)
+        return True
+    except Exception:
+        realtime_metrics.increment("maintenance_errors")
+        write_to_logfile("realtime_data", traceback.format_exc())
+        return False
+
+def run_daemon():
+    '''
+    Scrape once per wall clock minute for the life of the process, keeping the browser, the DB
+    engine and the asset id cache warm between ticks. Ticks are scheduled from minute boundaries
+    rather than from the previous tick, so they do not drift; when a tick overruns, the minutes it
+    covered are counted as skipped and the loop waits for the next boundary.
+    '''
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    signal.signal(signal.SIGINT, lambda *args: stop.set())
+
+    bond_sync_controller = BondSync()
+    # rebuilt from the table at start, in case ticks were written while no daemon kept them
+    get_realtime_store(rebuild=True)
+    next_tick = (time.time() // TICK_SECONDS + 1) * TICK_SECONDS
+    maintained_on = None
+    try:
+        while not stop.wait(max(0, next_tick - time.time())):
+            lateness = time.time() - next_tick
+            if lateness > TICK_GRACE_SECONDS:
+                realtime_metrics.increment("ticks_skipped")
+            else:
+                realtime_metrics.observe("tick_lateness_seconds", lateness)
+                tick_time = datetime.fromtimestamp(next_tick, current_sg_time().tzinfo)
+                with realtime_metrics.timer("tick_seconds"):
+                    try:
+                        run_tick(bond_sync_controller, tick_time)
+                    except Exception:
+                        realtime_metrics.increment("tick_errors")
+                        write_to_logfile("realtime_data", traceback.format_exc())
+
+            # once a day, after the tick so it does not delay it
+            if maintained_on != datetime.now().date() and maintain_table():
+                maintained_on = datetime.now().date()
+
+            # coalesce every boundary that passed while the tick ran into the next one
+            now = time.time()
+            missed = int((now - next_tick) // TICK_SECONDS)
+            if missed > 0:
+                realtime_metrics.increment("ticks_skipped", missed)
+            next_tick += (missed + 1) * TICK_SECONDS
+            realtime_metrics.flush()
+    finally:
+        bond_sync_controller.browser_pool.close()
 
 def main():
     # write_to_logfile("realtime_data", "entry")
     bond_sync_controller = BondSync()
     # print(bond_sync_controller.cert_path)
-    new_data = bond_sync_controller.get_new_data(retries=3)
-    if new_data == None:
-        write_to_logfile("realtime_data", f"failed to get data for {datetime.strftime(current_sg_time(), '%Y-%m-%d %H:%M')}")
-    else:
-        new_data_df = bond_sync_controller.convert_realtime_to_df(new_data)
-        write_to_database(new_data_df)
+    try:
+        run_tick(bond_sync_controller)
+    finally:
+        bond_sync_controller.browser_pool.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    lock_file = acquire_lock()
+    if lock_file is None:
+        realtime_metrics.increment("ticks_overlapped")
+        realtime_metrics.flush()
+        write_to_logfile("realtime_data", "another realtime sync is running, skipping")
+    elif len(sys.argv) > 1 and sys.argv[1] == "daemon":
+        run_daemon()
+    else:
+        main()
@@ -0,0 +1,104 @@
+from selenium.common.exceptions import WebDriverException
+
+from contextlib import contextmanager
+import logging
+import os
+import threading
+import time
+import traceback
+
+from metrics import get_registry
+
+BROWSER_POOL_SIZE = int(os.environ.get("BROWSER_POOL_SIZE", 2))
+# recycle a browser after this many leases, long lived Firefox sessions grow without bound
+BROWSER_MAX_USES = int(os.environ.get("BROWSER_MAX_USES", 50))
+BROWSER_LEASE_TIMEOUT = 300
+
+class PooledBrowser():
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+        self.created = time.time()
+
+class BrowserPool():
+    '''
+    Long lived Firefox sessions shared by the sync threads. A lease hands out an idle browser,
+    starting one only when fewer than `size` exist, and checks it still answers before use.
+    Browsers are recycled after max_uses leases or when a check fails.
+    '''
+
+    def __init__(self, factory, size=BROWSER_POOL_SIZE, max_uses=BROWSER_MAX_USES, metrics=None):
+        self.factory = factory
+        self.size = size
+        self.max_uses = max_uses
+        self.metrics = metrics or get_registry("browser_pool")
+        self.idle = []
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.closed = False
+
+    @staticmethod
+    def is_healthy(browser):
+        try:
+            browser.driver.current_url
+            return True
+        except WebDriverException:
+            return False
+
+    def start(self):
+        with self.metrics.timer("browser_start_seconds"):
+            browser = PooledBrowser(self.factory())
+        self.metrics.increment("browsers_started")
+        return browser
+
+    def retire(self, browser):
+        try:
+            browser.driver.quit()
+        except Exception:
+            logging.error(traceback.format_exc())
+        self.metrics.increment("browsers_retired")
+
+    def acquire(self):
+        with self.lock:
+            browser = self.idle.pop() if self.idle else None
+        if browser is not None and (browser.uses >= self.max_uses or not self.is_healthy(browser)):
+            self.retire(browser)
+            browser = None
+        if browser is None:
+            browser = self.start()
+        else:
+            self.metrics.increment("browsers_reused")
+        browser.uses += 1
+        return browser
+
+    @contextmanager
+    def lease(self, timeout=BROWSER_LEASE_TIMEOUT):
+        with self.metrics.timer("lease_wait_seconds"):
+            if not self.slots.acquire(timeout=timeout):
+                raise TimeoutError(f"No browser free after {timeout}s")
+        browser = None
+        healthy = True
+        try:
+            browser = self.acquire()
+            yield browser.driver
+        except WebDriverException:
+            healthy = False
+            raise
+        finally:
+            if browser is not None:
+                with self.lock:
+                    keep = healthy and not self.closed
+                    if keep:
+                        self.idle.append(browser)
+                if not keep:
+                    self.retire(browser)
+            self.slots.release()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for browser in idle:
+            self.retire(browser)
+        self.metrics.flush()
@@ -0,0 +1,282 @@
+from collections import OrderedDict
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+REALTIME_CACHE_KEY = "realtime"
+STATS = ("hits", "misses", "stale", "evictions")
+
+##############################
+# BACKENDS
+##############################
+
+# Backends speak the small part of the redis-py client API the cache needs (get, set, delete, incr)
+# so a redis server, or anything that serves that protocol locally, can hold entries for every
+# gunicorn worker at once. The memory backend is per process and exists for tests and single-worker
+# runs; the file backend is the default and keeps entries in a directory all workers share, /dev/shm
+# by default so it stays in RAM.
+
+class MemoryBackend():
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.counters = {}
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[key] = value
+            self.size += len(value)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.counters["stats:evictions"] = self.counters.get("stats:evictions", 0) + 1
+
+    def delete(self, key):
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is not None:
+                self.size -= len(value)
+
+    def incr(self, key, amount=1):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+            return self.counters[key]
+
+    def counter(self, key):
+        return self.counters.get(key, 0)
+
+class FileBackend():
+    '''
+    One file per entry, written with os.replace so readers never see a partial body. Recency is the
+    file mtime, touched on every hit, and whichever worker writes past the limits evicts the oldest.
+    '''
+
+    def __init__(self, directory, max_entries, max_bytes):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entry_directory = os.path.join(directory, "entries")
+        self.counter_directory = os.path.join(directory, "counters")
+        os.makedirs(self.entry_directory, exist_ok=True)
+        os.makedirs(self.counter_directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.entry_directory, hashlib.md5(key.encode()).hexdigest())
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as file:
+                value = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return value
+
+    def set(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.entry_directory, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as file:
+            file.write(value)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        entries = []
+        with os.scandir(self.entry_directory) as scan:
+            for item in scan:
+                if item.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = item.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, item.path))
+
+        size = sum(entry[1] for entry in entries)
+        entries.sort()
+        evicted = 0
+        while entries and (len(entries) > self.max_entries or size > self.max_bytes):
+            _, entry_size, path = entries.pop(0)
+            size -= entry_size
+            try:
+                os.remove(path)
+                evicted += 1
+            except FileNotFoundError:
+                pass
+        if evicted:
+            self.incr("stats:evictions", evicted)
+
+    def incr(self, key, amount=1):
+        # counters are 8 byte files updated under an exclusive lock so concurrent workers add up
+        path = os.path.join(self.counter_directory, key.replace(":", "_"))
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            value = int.from_bytes(os.pread(fd, 8, 0) or b"\0", "little") + amount
+            os.pwrite(fd, value.to_bytes(8, "little"), 0)
+            return value
+        finally:
+            os.close(fd)
+
+    def counter(self, key):
+        path = os.path.join(self.counter_directory, key.replace(":", "_"))
+        try:
+            with open(path, 'rb') as file:
+                return int.from_bytes(file.read(8) or b"\0", "little")
+        except FileNotFoundError:
+            return 0
+
+class RedisBackend():
+    # eviction is left to the server (maxmemory-policy allkeys-lru), evictions come from INFO
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url)
+        self.get = self.client.get
+        self.set = self.client.set
+        self.delete = self.client.delete
+        self.incr = self.client.incr
+
+    def counter(self, key):
+        if key == "stats:evictions":
+            return self.client.info("stats").get("evicted_keys", 0)
+        return int(self.client.get(key) or 0)
+
+def create_backend(name, url, max_entries, max_bytes):
+    if name == "memory":
+        return MemoryBackend(max_entries, max_bytes)
+    if name == "file":
+        return FileBackend(url, max_entries, max_bytes)
+    if name == "redis":
+        if redis is None:
+            raise RuntimeError("RESPONSE_CACHE_BACKEND=redis needs the redis package")
+        return RedisBackend(url)
+    raise ValueError(f"Unknown response cache backend: {name}")
+
+##############################
+# RESPONSES
+##############################
+
+class CachedResponse():
+
+    def __init__(self, body, mimetype, versions, etag=None):
+        self.body = body if isinstance(body, bytes) else body.encode()
+        self.mimetype = mimetype
+        # the writer generations the body was built from, compared on every hit
+        self.versions = versions
+        self.etag = etag or hashlib.md5(self.body).hexdigest()
+
+    def dump(self):
+        versions = list(self.versions.items()) if isinstance(self.versions, dict) else self.versions
+        header = json.dumps({"mimetype": self.mimetype, "etag": self.etag, "versions": versions})
+        return header.encode() + b"\n" + self.body
+
+    @classmethod
+    def load(cls, value):
+        header, body = value.split(b"\n", 1)
+        header = json.loads(header)
+        versions = header["versions"]
+        if isinstance(versions, list):
+            versions = {asset_id: generation for asset_id, generation in versions}
+        return cls(body, header["mimetype"], versions, header["etag"])
+
+class ResponseCache():
+    '''
+    Rendered responses kept in a backend shared by the workers. Freshness is not decided here:
+    callers compare the stored versions with the current writer generations.
+    '''
+
+    def __init__(self, backend, max_bytes):
+        self.backend = backend
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def backend_key(key):
+        return "response:" + hashlib.md5(repr(key).encode()).hexdigest()
+
+    def get(self, key, validate):
+        '''
+        validate(entry) returns the versions the entry is current for, or None once a writer has
+        invalidated it
+        '''
+        value = self.backend.get(self.backend_key(key))
+        if value is None:
+            self.backend.incr("stats:misses")
+            return None
+        entry = CachedResponse.load(value)
+        versions = validate(entry)
+        if versions is None:
+            self.backend.incr("stats:stale")
+            return None
+        if versions != entry.versions:
+            entry.versions = versions
+            self.backend.set(self.backend_key(key), entry.dump())
+        self.backend.incr("stats:hits")
+        return entry
+
+    def set(self, key, entry):
+        if len(entry.body) > self.max_bytes:
+            return
+        self.backend.set(self.backend_key(key), entry.dump())
+
+    def stats(self):
+        return {name: self.backend.counter(f"stats:{name}") for name in STATS}
+
+def normalise_countries(countries):
+    return countries if countries == "All" else " ".join(sorted(set(countries.split())))
+
+def historical_entry_valid(entry, generations, end_date, resolution):
+    '''
+    generations maps asset id -> (generation, changed_from) as it is now. A single write per asset
+    since the entry was built is tolerated when it only touched dates after the requested range,
+    which is what a daily append looks like. Returns the versions to keep, or None when stale.
+    '''
+    if set(entry.versions) != set(generations):
+        return None
+
+    for asset_id, (generation, changed_from) in generations.items():
+        cached_generation = entry.versions[asset_id]
+        if generation == cached_generation:
+            continue
+        if generation != cached_generation + 1 or changed_from is None or end_date == "All":
+            return None
+        first_touched = np.datetime64(changed_from, 'D')
+        if resolution == 'W':
+            days = first_touched.astype('int64')
+            first_touched = np.datetime64(int(days - (days + 3) % 7), 'D')
+        elif resolution == 'M':
+            first_touched = first_touched.astype('datetime64[M]').astype('datetime64[D]')
+        # weekly/monthly bars start before the day that changed them
+        if first_touched <= np.datetime64(end_date, 'D'):
+            return None
+
+    return {asset_id: generation for asset_id, (generation, _) in generations.items()}
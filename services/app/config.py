@@ -11,3 +11,22 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # response cache for /get_realtime and /get_historical, shared by the gunicorn workers.
+    # RESPONSE_CACHE_BACKEND is one of memory, file (RESPONSE_CACHE_URL is a directory) or redis
+    RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "file")
+    RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "/dev/shm/bond_yields_cache")
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 256))
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+    # ring buffers of the newest realtime bars, written by the realtime daemon
+    REALTIME_STORE_PATH = os.getenv("REALTIME_STORE_PATH", "/dev/shm/bond_yields_realtime")
+
+    # Arrow archive of the daily series, refreshed after every daily sync
+    HISTORICAL_ARCHIVE_DIR = os.getenv("HISTORICAL_ARCHIVE_DIR", "/home/app/data/archive")
+
+    # bond_yield_realtime housekeeping, run by create_db and daily by the realtime daemon.
+    # 1 minute bars older than REALTIME_MINUTE_RETENTION_DAYS are deleted once the coarser bars hold
+    # them, monthly partitions older than REALTIME_RETENTION_MONTHS are dropped; 0 keeps them forever
+    REALTIME_PARTITIONS_AHEAD = int(os.getenv("REALTIME_PARTITIONS_AHEAD", 3))
+    REALTIME_MINUTE_RETENTION_DAYS = int(os.getenv("REALTIME_MINUTE_RETENTION_DAYS", 30))
+    REALTIME_RETENTION_MONTHS = int(os.getenv("REALTIME_RETENTION_MONTHS", 0))
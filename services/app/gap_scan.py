@@ -0,0 +1,162 @@
+from datetime import datetime, date
+import json
+import os
+import numpy as np
+
+from historical import fetch_rows
+from queries import stored_days_query
+from sync_planner import PlannedJob
+
+##############################
+# GAP SCAN AND BACKFILL
+##############################
+
+# The daily jobs only ever fetch from the watermark onward, so a hole in the middle of a series
+# (a failed page in a replay chain, a spool lost to a crash) stays a hole. The scan compares the
+# stored dates of every asset against the business days between its first and last row and turns
+# the missing runs into range fetches for just those windows.
+#
+# Holidays look like holes too. A window that was fetched and still has missing days is recorded
+# in GAP_STATE_PATH and its days are treated as closed from then on, so every window is asked
+# for once:
+#
+#   {"3": [["2020-12-24", "2020-12-28"], ...]}
+
+GAP_STATE_PATH = "/home/app/data/gap_checked.json"
+COVERAGE_PATH = "/home/app/data/coverage.json"
+GAP_MIN_DAYS = int(os.environ.get("GAP_MIN_DAYS", 3)) # shorter runs are almost always market holidays
+GAP_MERGE_DAYS = int(os.environ.get("GAP_MERGE_DAYS", 31)) # windows this close share one range fetch
+GAP_MAX_JOBS = int(os.environ.get("GAP_MAX_JOBS", 20)) # backfill jobs added to one daily sync
+
+def to_date(day):
+    return date.fromordinal(date(1970, 1, 1).toordinal() + int(day))
+
+def to_day(value):
+    return (date.fromisoformat(value) - date(1970, 1, 1)).days
+
+def load_stored_days():
+    # {asset_id: sorted int64 array of days since epoch}, needs an app context
+    rows = fetch_rows(stored_days_query())
+    if not rows:
+        return {}
+    asset_ids, days = (np.array(column, dtype=np.int64) for column in zip(*rows))
+    order = np.lexsort((days, asset_ids))
+    asset_ids, days = asset_ids[order], days[order]
+    boundaries = np.flatnonzero(np.diff(asset_ids)) + 1
+    return {int(group[0]): series for group, series in zip(np.split(asset_ids, boundaries), np.split(days, boundaries))}
+
+def business_days(first, last):
+    span = np.arange(first, last + 1, dtype=np.int64)
+    return span[np.is_busday(span.astype('datetime64[D]'))]
+
+def window_days(windows):
+    # every day inside a list of [from, to] ISO date pairs
+    if not windows:
+        return np.array([], dtype=np.int64)
+    return np.concatenate([np.arange(to_day(start), to_day(end) + 1, dtype=np.int64) for start, end in windows])
+
+def missing_runs(days, closed_days=None):
+    '''
+    (calendar, starts, ends, lengths): the business days between the first and last of `days`,
+    and the runs of consecutive business days missing from it. Days in closed_days are not
+    counted as missing.
+    '''
+    calendar = business_days(days[0], days[-1])
+    missing = calendar[~np.isin(calendar, days, assume_unique=True)]
+    if closed_days is not None and len(closed_days):
+        missing = missing[~np.isin(missing, closed_days)]
+    if not len(missing):
+        empty = np.array([], dtype=np.int64)
+        return calendar, empty, empty, empty
+
+    # missing days next to each other in the calendar belong to the same run
+    position = np.searchsorted(calendar, missing)
+    breaks = np.flatnonzero(np.diff(position) != 1) + 1
+    starts = missing[np.concatenate(([0], breaks))]
+    ends = missing[np.concatenate((breaks - 1, [len(missing) - 1]))]
+    lengths = np.diff(np.concatenate(([0], breaks, [len(missing)])))
+    return calendar, starts, ends, lengths
+
+def merge_windows(starts, ends, lengths, min_days=GAP_MIN_DAYS, merge_days=GAP_MERGE_DAYS):
+    # one request returns up to 5000 rows, so neighbouring holes are cheaper fetched together
+    keep = lengths >= min_days
+    starts, ends = starts[keep], ends[keep]
+    if not len(starts):
+        return []
+    breaks = np.flatnonzero(starts[1:] - ends[:-1] > merge_days) + 1
+    first = starts[np.concatenate(([0], breaks))]
+    last = ends[np.concatenate((breaks - 1, [len(ends) - 1]))]
+    return list(zip(first.tolist(), last.tolist()))
+
+def load_checked(path=GAP_STATE_PATH):
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def mark_checked(windows, path=GAP_STATE_PATH):
+    # windows is a list of (asset_id, from_date, to_date) that were fetched successfully
+    if not windows:
+        return
+    checked = load_checked(path)
+    for asset_id, start, end in windows:
+        checked.setdefault(str(asset_id), []).append([start.isoformat(), end.isoformat()])
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(checked, file)
+    os.replace(tmp_path, path)
+
+def scan_gaps(watermarks, stored_days=None, checked=None):
+    '''
+    Coverage of every asset in watermarks, with the windows a backfill should fetch. Each entry:
+    {asset_id, name, period, first_date, last_date, business_days, missing, closed, coverage, windows}
+    where windows are (from_date, to_date) pairs. Needs an app context unless stored_days is given.
+    '''
+    stored_days = load_stored_days() if stored_days is None else stored_days
+    checked = load_checked() if checked is None else checked
+
+    report = []
+    for entry in watermarks.values():
+        days = stored_days.get(entry["asset_id"])
+        if days is None or not len(days):
+            continue
+        closed_days = window_days(checked.get(str(entry["asset_id"])))
+        calendar, starts, ends, lengths = missing_runs(days, closed_days)
+        missing = int(lengths.sum())
+        # closed days are explained holes, they count as covered
+        closed = int(np.sum(np.isin(calendar, closed_days) & ~np.isin(calendar, days))) if len(closed_days) else 0
+        report.append({
+            "asset_id": entry["asset_id"],
+            "name": entry["name"],
+            "period": entry["period"],
+            "first_date": to_date(days[0]),
+            "last_date": to_date(days[-1]),
+            "business_days": len(calendar),
+            "missing": missing,
+            "closed": closed,
+            "coverage": round(1 - missing / len(calendar), 4) if len(calendar) else 1.0,
+            "windows": [(to_date(start), to_date(end)) for start, end in merge_windows(starts, ends, lengths)],
+        })
+    return report
+
+def plan_backfill(report, max_jobs=GAP_MAX_JOBS):
+    # the worst covered assets first, so a long outage is repaired before stray holes
+    jobs = []
+    for entry in sorted(report, key=lambda entry: entry["coverage"]):
+        for start, end in entry["windows"]:
+            if len(jobs) == max_jobs:
+                return jobs
+            jobs.append(PlannedJob(entry["name"], str(entry["period"]), start, end, kind="backfill", asset_id=entry["asset_id"]))
+    return jobs
+
+def save_coverage(report, path=COVERAGE_PATH):
+    assets = [
+        dict(entry, first_date=entry["first_date"].isoformat(), last_date=entry["last_date"].isoformat(),
+             windows=[[start.isoformat(), end.isoformat()] for start, end in entry["windows"]])
+        for entry in report
+    ]
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump({"generated": datetime.now().isoformat(timespec='seconds'), "assets": assets}, file)
+    os.replace(tmp_path, path)
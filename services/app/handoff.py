@@ -0,0 +1,146 @@
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import traceback
+
+from logging_config import write_to_logfile
+from parsers import loads
+
+##############################
+# PROXY -> SYNC HANDOFF
+##############################
+
+# The proxy addon streams every historical page it captures over a unix socket to the daily sync,
+# which writes each page as soon as it arrives. A frame is a length prefixed JSON header
+# {"id", "kind"} followed by a length prefixed body; kind is "page" (body is the raw API response),
+# "done" once the last page was sent, or "error". When nothing listens on the socket the proxy
+# falls back to the PENDING/COMPLETE files.
+
+HANDOFF_SOCKET = os.environ.get("HANDOFF_SOCKET", "/tmp/bond_yields_handoff.sock")
+HANDOFF_TIMEOUT = 60 # seconds without a frame before a worker gives up on the channel
+LENGTH = struct.Struct("!I")
+
+class HandoffTimeout(Exception):
+    pass
+
+def read_exactly(connection, size):
+    chunks = []
+    while size:
+        chunk = connection.recv(min(size, 1 << 20))
+        if not chunk:
+            raise EOFError
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def read_frame(connection):
+    header = json.loads(read_exactly(connection, LENGTH.unpack(read_exactly(connection, LENGTH.size))[0]))
+    body = read_exactly(connection, LENGTH.unpack(read_exactly(connection, LENGTH.size))[0])
+    return header, body
+
+def encode_frame(_id, kind, body=b""):
+    header = json.dumps({"id": str(_id), "kind": kind}).encode()
+    return LENGTH.pack(len(header)) + header + LENGTH.pack(len(body)) + body
+
+class HandoffServer():
+    '''
+    Sync side of the channel. Frames are queued per instrument id, so pages that arrive before
+    the worker asks for them are kept until it does.
+    '''
+
+    def __init__(self, path=HANDOFF_SOCKET):
+        self.path = path
+        self.queues = {}
+        self.lock = threading.Lock()
+        self.socket = None
+
+    def queue_for(self, _id):
+        with self.lock:
+            return self.queues.setdefault(str(_id), queue.Queue())
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(self.path)
+        self.socket.listen()
+        threading.Thread(target=self.accept, daemon=True).start()
+        return self
+
+    def accept(self):
+        while True:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.receive, args=(connection,), daemon=True).start()
+
+    def receive(self, connection):
+        with connection:
+            while True:
+                try:
+                    header, body = read_frame(connection)
+                except (EOFError, OSError):
+                    return
+                except Exception:
+                    write_to_logfile("handoff", traceback.format_exc())
+                    return
+                self.queue_for(header["id"]).put((header["kind"], body))
+
+    def pages(self, _id, timeout=HANDOFF_TIMEOUT):
+        '''
+        Yields the parsed API responses for _id until the proxy says it is done. Raises
+        HandoffTimeout when the proxy goes quiet for `timeout` seconds.
+        '''
+        frames = self.queue_for(_id)
+        while True:
+            try:
+                kind, body = frames.get(timeout=timeout)
+            except queue.Empty:
+                raise HandoffTimeout(f"nothing from the proxy for {_id} in {timeout}s")
+            if kind == "page":
+                yield loads(body)
+            elif kind == "error":
+                write_to_logfile(_id, f"(HANDOFF) proxy reported an error: {body.decode(errors='replace')}")
+                return
+            else:
+                return
+
+    def close(self):
+        if self.socket:
+            self.socket.close()
+            self.socket = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class HandoffClient():
+    # proxy side, one connection reused for every frame and reopened once if the sync restarted
+
+    def __init__(self, path=HANDOFF_SOCKET):
+        self.path = path
+        self.socket = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(self.path)
+        return connection
+
+    def send(self, _id, kind, body=b""):
+        # returns False when no sync is listening, the caller then falls back to files
+        frame = encode_frame(_id, kind, body)
+        with self.lock:
+            for _ in range(2):
+                try:
+                    if self.socket is None:
+                        self.socket = self.connect()
+                    self.socket.sendall(frame)
+                    return True
+                except OSError:
+                    if self.socket is not None:
+                        self.socket.close()
+                    self.socket = None
+            return False
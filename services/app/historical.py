@@ -0,0 +1,200 @@
+from extensions import db
+from queries import historical_columns_query, series_query
+
+import datetime
+import io
+import json
+import logging
+import traceback
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# format -> mimetype for /get_historical
+historical_formats = {
+    'html': 'text/html',
+    'csv': 'text/csv',
+    'json': 'application/json',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+arrow_formats = ['parquet', 'arrow']
+
+# format -> mimetype for /get_historical?stream=1
+stream_formats = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+STREAM_BATCH_SIZE = 2000 # rows per server side cursor fetch
+STREAM_FLUSH_BYTES = 16384
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+class HistoricalFrame():
+    '''
+    Dense date x series matrix. dates is a sorted datetime64[D] array, labels the
+    (country, "5Y") pair of every column and values a float matrix with NaN for missing days.
+    '''
+
+    def __init__(self, dates, labels, values):
+        self.dates = dates
+        self.labels = labels
+        self.values = values
+
+    @property
+    def flat_labels(self):
+        return [f"{country} {period}" for country, period in self.labels]
+
+    def to_frame(self):
+        columns = pd.MultiIndex.from_tuples(self.labels, names=['Country', 'Period'])
+        return pd.DataFrame(self.values, index=pd.DatetimeIndex(self.dates), columns=columns)
+
+    def to_html(self):
+        return self.to_frame().to_html()
+
+    def to_csv(self):
+        frame = pd.DataFrame(self.values, index=pd.DatetimeIndex(self.dates, name='date'), columns=self.flat_labels)
+        # intraday frames (realtime spreads) keep their time of day
+        return frame.to_csv(date_format='%Y-%m-%d' if self.dates.dtype == 'datetime64[D]' else None)
+
+    def to_json(self):
+        # columnar: {"date": [...], "spain 5Y": [...], ...}, missing days are null
+        payload = {'date': np.datetime_as_string(self.dates, unit='D' if self.dates.dtype == 'datetime64[D]' else 's').tolist()}
+        for index, label in enumerate(self.flat_labels):
+            column = self.values[:, index]
+            payload[label] = np.where(np.isnan(column), None, column).tolist()
+        return json.dumps(payload)
+
+    def to_arrow(self):
+        columns = {'date': pa.array(self.dates)}
+        for index, label in enumerate(self.flat_labels):
+            columns[label] = pa.array(self.values[:, index], from_pandas=True)
+        return pa.table(columns)
+
+    def to_parquet(self):
+        buffer = io.BytesIO()
+        pq.write_table(self.to_arrow(), buffer)
+        return buffer.getvalue()
+
+    def to_arrow_stream(self):
+        table = self.to_arrow()
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    def render(self, output_format):
+        if output_format == 'html':
+            return self.to_html()
+        if output_format == 'csv':
+            return self.to_csv()
+        if output_format == 'json':
+            return self.to_json()
+        if output_format == 'parquet':
+            return self.to_parquet()
+        if output_format == 'arrow':
+            return self.to_arrow_stream()
+        raise ValueError(f"Unknown format {output_format}")
+
+def fetch_rows(statement):
+    # on PostgreSQL the DBAPI cursor skips building a Row object per result row
+    if db.engine.dialect.name != "postgresql":
+        return db.session.execute(statement).all()
+
+    compiled = statement.compile(dialect=db.engine.dialect, compile_kwargs={"render_postcompile": True})
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.execute(str(compiled), compiled.params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+def load_columns(countries, start_date, end_date, resolution='D'):
+    # (dates, asset_ids, names, periods, yields) straight from the cursor
+    rows = fetch_rows(historical_columns_query(countries, start_date, end_date, resolution))
+    if not rows:
+        return np.array([], dtype='datetime64[D]'), np.array([], dtype=np.int64), (), (), np.array([], dtype=float)
+
+    days, asset_ids, names, periods, yields = zip(*rows)
+    return (
+        np.array(days, dtype=np.int64).astype('datetime64[D]'),
+        np.array(asset_ids, dtype=np.int64),
+        names,
+        periods,
+        np.array(yields, dtype=float),
+    )
+
+def pivot(dates, asset_ids, names, periods, yields):
+    unique_dates, row = np.unique(dates, return_inverse=True)
+    _, first, column = np.unique(asset_ids, return_index=True, return_inverse=True)
+
+    # same column order as DataFrame.pivot_table: country, then period label
+    labels = [(names[i], f"{periods[i]}Y") for i in first]
+    order = sorted(range(len(labels)), key=labels.__getitem__)
+    position = np.empty(len(order), dtype=np.intp)
+    position[order] = np.arange(len(order))
+
+    values = np.full((len(unique_dates), len(labels)), np.nan)
+    values[row, position[column]] = yields
+    return HistoricalFrame(unique_dates, [labels[i] for i in order], values)
+
+def load_frame(countries, start_date, end_date, resolution='D'):
+    return pivot(*load_columns(countries, start_date, end_date, resolution))
+
+
+def stream_historical(countries, start_date, end_date, resolution='D', output_format='csv'):
+    '''
+    Yields the pivoted table one date at a time. Rows come off a server side cursor ordered
+    by date, so memory stays flat whatever the range and the header goes out immediately.
+    '''
+    assets = sorted(series_query(countries).all(), key=lambda asset: (asset.name, f"{asset.period}Y"))
+    labels = [f"{asset.name} {asset.period}Y" for asset in assets]
+    position = {asset.id: index for index, asset in enumerate(assets)}
+
+    def format_line(day, values):
+        date = datetime.date.fromordinal(EPOCH_ORDINAL + day).isoformat()
+        if output_format == 'ndjson':
+            return json.dumps(dict(zip(['date'] + labels, [date] + values))) + "\n"
+        return ",".join([date] + ['' if value is None else repr(value) for value in values]) + "\n"
+
+    if output_format == 'csv':
+        yield ",".join(['date'] + labels) + "\n"
+
+    statement = historical_columns_query(countries, start_date, end_date, resolution, ordered=True)
+    try:
+        result = db.session.execute(statement.execution_options(yield_per=STREAM_BATCH_SIZE))
+
+        buffer = []
+        buffered = 0
+        current_day = None
+        values = None
+        for day, asset_id, _, _, bond_yield in result:
+            if day != current_day:
+                if current_day is not None:
+                    line = format_line(current_day, values)
+                    buffer.append(line)
+                    buffered += len(line)
+                    if buffered >= STREAM_FLUSH_BYTES:
+                        yield "".join(buffer)
+                        buffer = []
+                        buffered = 0
+                current_day = day
+                values = [None] * len(labels)
+            # an asset created since the header went out has no column, its rows are left out
+            index = position.get(asset_id)
+            if index is not None:
+                values[index] = bond_yield
+
+        if current_day is not None:
+            buffer.append(format_line(current_day, values))
+        if buffer:
+            yield "".join(buffer)
+    except Exception:
+        # the response has already started, all that is left is to log and cut the stream short
+        logging.error(traceback.format_exc())
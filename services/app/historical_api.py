@@ -0,0 +1,124 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from datetime import datetime, timedelta
+import json
+import os
+
+from metrics import get_registry
+from parsers import loads
+
+##############################
+# DIRECT HISTORICAL API CLIENT
+##############################
+
+# The historical-data pages only exist to make the browser call this endpoint. Once url_list.log
+# knows an instrument id the sync calls it directly instead of loading the page through mitmproxy.
+
+HISTORICAL_API_URL = os.environ.get("HISTORICAL_API_URL", "https://api.investing.com/api/financialdata/historical")
+CAPTURED_HEADERS_PATH = "/home/app/data/api_headers.json"
+PAGE_ROWS = 5000 # the endpoint returns at most this many rows, newest first
+FIRST_DATE = "2000-01-01"
+
+DEFAULT_HEADERS = {
+    'Accept': 'application/json, text/plain, */*',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Domain-Id': 'www',
+    'Origin': 'https://www.investing.com',
+    'Referer': 'https://www.investing.com/',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+}
+# hop-by-hop and per-request headers that must not be replayed from a captured request
+SKIPPED_HEADERS = {'host', 'content-length', 'connection', 'accept-encoding'}
+
+fetch_metrics = get_registry("historical_api")
+
+def save_captured_headers(headers, path=CAPTURED_HEADERS_PATH):
+    # called by the proxy with the headers of a browser made request to the endpoint
+    headers = {name: value for name, value in headers.items() if name.lower() not in SKIPPED_HEADERS}
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(headers, file)
+    os.replace(tmp_path, path)
+
+def load_captured_headers(path=CAPTURED_HEADERS_PATH):
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+class HistoricalApiError(Exception):
+    pass
+
+class HistoricalClient():
+    '''
+    Pooled, retrying HTTP session for the historical endpoint, shared by the sync threads.
+    fetch() walks the 5000 row pages itself and returns the rows oldest first.
+    '''
+
+    def __init__(self, base_url=HISTORICAL_API_URL, pool_size=4, page_rows=PAGE_ROWS, timeout=15, retries=3):
+        self.base_url = base_url.rstrip('/')
+        self.page_rows = page_rows
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET",))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(DEFAULT_HEADERS)
+        self.session.headers.update(load_captured_headers())
+
+    def fetch_page(self, instrument_id, start_date, end_date):
+        params = {
+            "start-date": start_date,
+            "end-date": end_date,
+            "time-frame": "Daily",
+            "add-missing-rows": "false",
+        }
+        with fetch_metrics.timer("page_seconds"):
+            response = self.session.get(f"{self.base_url}/{instrument_id}", params=params, timeout=self.timeout)
+        fetch_metrics.increment("pages")
+        if response.status_code == 204:
+            return []
+        if response.status_code != 200:
+            fetch_metrics.increment("errors")
+            raise HistoricalApiError(f"{instrument_id}: status code {response.status_code}")
+        return loads(response.content).get("data") or []
+
+    @staticmethod
+    def date_range(start_date=None, end_date=None):
+        return start_date or FIRST_DATE, end_date or datetime.now().strftime('%Y-%m-%d')
+
+    def next_start(self, page, end_date):
+        # a full page may have been cut short, carry on from the day after its newest row
+        if len(page) < self.page_rows:
+            return None
+        newest = datetime.strptime(page[0]["rowDateTimestamp"], "%Y-%m-%dT%H:%M:%SZ")
+        start_date = (newest + timedelta(days=1)).strftime('%Y-%m-%d')
+        return start_date if start_date <= end_date else None
+
+    @staticmethod
+    def assemble(pages):
+        rows = [row for page in pages for row in reversed(page)]
+        fetch_metrics.increment("rows", len(rows))
+        return rows
+
+    def fetch(self, instrument_id, start_date=None, end_date=None):
+        start_date, end_date = self.date_range(start_date, end_date)
+
+        pages = []
+        while start_date:
+            page = self.fetch_page(instrument_id, start_date, end_date)
+            if not page:
+                break
+            pages.append(page)
+            start_date = self.next_start(page, end_date)
+
+        return self.assemble(pages)
+
+    def close(self):
+        self.session.close()
+        fetch_metrics.flush()
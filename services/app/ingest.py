@@ -0,0 +1,213 @@
+from extensions import db
+from models import BondYield, BondYieldRollup, CacheGeneration, unit_of_work
+from queries import stored_dates_query, period_rows_query
+from historical import fetch_rows
+from parsers import loads
+from spreads import refresh_spreads
+
+import csv
+import io
+import numpy as np
+import pandas as pd
+
+CHUNK_SIZE = 1000
+COPY_MIN_ROWS = 500 # below this a multi-row INSERT is cheaper than staging a COPY
+ROLLUP_RESOLUTIONS = ('W', 'M')
+
+# write_series column -> field of a row from the historical API
+PAYLOAD_FIELDS = {
+    'bond_yield': 'last_close',
+    'open': 'last_open',
+    'high': 'last_max',
+    'low': 'last_min',
+    'change_percent': 'change_precentRaw',
+}
+
+def payload_columns(items):
+    '''
+    write_series columns from the "data" rows of a historical API response. Every field is pulled
+    out once and converted as a whole array: the timestamps are cut to their date by a U10 cast
+    and read as datetime64[D], the numbers are read straight into float64.
+    '''
+    if not items:
+        return {'date': np.array([], dtype='datetime64[D]'), **{name: np.array([], dtype=float) for name in PAYLOAD_FIELDS}}
+
+    columns = {'date': np.array([item["rowDateTimestamp"] for item in items], dtype='U10').astype('datetime64[D]')}
+    for name, field in PAYLOAD_FIELDS.items():
+        columns[name] = float_column([item.get(field) for item in items])
+
+    keep = ~np.isnan(columns['bond_yield'])
+    if keep.all():
+        return columns
+    return {name: column[keep] for name, column in columns.items()}
+
+def float_column(values):
+    # None becomes NaN; only a malformed value such as "-" or "" takes the slower coercing path
+    try:
+        return np.array(values, dtype=float)
+    except (TypeError, ValueError):
+        return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=float)
+
+def parse_payload(body):
+    # raw historical API response bytes -> write_series columns
+    return payload_columns(loads(body).get("data") or [])
+
+def drop_stored_dates(asset_id, columns):
+    '''
+    Removes the rows whose date asset_id already has, so a page that overlaps the stored
+    series only writes what is new. Needs an app context.
+    '''
+    dates = columns['date']
+    if not len(dates):
+        return columns
+    stored = np.array(db.session.execute(stored_dates_query(asset_id, dates.min().tolist(), dates.max().tolist())).scalars().all(), dtype=np.int64)
+    if not len(stored):
+        return columns
+    keep = ~np.isin(dates.astype(np.int64), stored)
+    return {name: column[keep] for name, column in columns.items()}
+
+def normalise_series(columns):
+    # sorts by date and keeps the last occurrence of a repeated date, an upsert cannot touch the same row twice
+    dates = np.asarray(columns['date'], dtype='datetime64[D]')
+    _, reversed_index = np.unique(dates[::-1], return_index=True)
+    order = len(dates) - 1 - reversed_index
+
+    normalised = {'date': dates[order]}
+    for name, values in columns.items():
+        if name != 'date':
+            normalised[name] = np.asarray(values)[order]
+    return normalised
+
+def write_series(asset_id, ref_id, columns, chunk_size=CHUNK_SIZE):
+    '''
+    Upserts one series into bond_yield. columns maps column names to equal length arrays
+    and must contain at least "date" and "bond_yield". Every chunk is its own transaction
+    unless the caller holds an outer unit_of_work. Returns the number of rows written.
+    '''
+
+    series = normalise_series(columns)
+    total = len(series['date'])
+    if total == 0:
+        return 0
+
+    names = ['date', 'asset_id', 'ref_id'] + [name for name in series if name != 'date']
+    # NaN becomes NULL, optional columns such as open/high/low are not always known
+    values = {name: [None if value != value else value for value in column.tolist()] for name, column in series.items()}
+    values['asset_id'] = [int(asset_id)] * total
+    values['ref_id'] = [int(ref_id)] * total
+
+    use_copy = db.engine.dialect.name == "postgresql"
+
+    for start in range(0, total, chunk_size):
+        stop = min(start + chunk_size, total)
+        rows = [tuple(values[name][i] for name in names) for i in range(start, stop)]
+        with unit_of_work():
+            if use_copy and len(rows) >= COPY_MIN_ROWS:
+                copy_chunk(names, rows)
+            else:
+                BondYield.upsert_many([dict(zip(names, row)) for row in rows])
+
+            chunk = {name: column[start:stop] for name, column in series.items()}
+            rebuild_rollups(asset_id, chunk['date'][0], chunk['date'][-1])
+
+            CacheGeneration.bump(CacheGeneration.asset_key(asset_id), changed_from=chunk['date'][0].tolist())
+
+    # the country's 2Y-5Y spreads from the first date written on
+    refresh_spreads(asset_id, series['date'][0].tolist())
+    return total
+
+def period_starts(dates, resolution):
+    if resolution == 'M':
+        return dates.astype('datetime64[M]').astype('datetime64[D]')
+    # weeks start on Monday, 1970-01-01 was a Thursday
+    days = dates.astype('int64')
+    return (days - (days + 3) % 7).astype('datetime64[D]')
+
+def period_ends(starts, resolution):
+    # first day after each period
+    if resolution == 'M':
+        return (starts.astype('datetime64[M]') + 1).astype('datetime64[D]')
+    return starts + 7
+
+def rebuild_rollups(asset_id, first_date, last_date):
+    '''
+    Recomputes the weekly and monthly bars of every period from first_date to last_date out of
+    the rows bond_yield now holds, so a corrected day narrows a bar as well as widens it. Reads
+    whole periods only, at most a month either side of the range. The caller owns the transaction.
+    '''
+    bounds = {}
+    for resolution in ROLLUP_RESOLUTIONS:
+        starts = period_starts(np.array([first_date, last_date], dtype='datetime64[D]'), resolution)
+        bounds[resolution] = (starts[0], period_ends(starts[1:], resolution)[0])
+    start = min(first for first, _ in bounds.values())
+    end = max(last for _, last in bounds.values())
+
+    rows = fetch_rows(period_rows_query(int(asset_id), start.tolist(), end.tolist()))
+    if not rows:
+        return
+    days, opens, highs, lows, closes = zip(*rows)
+    stored = {
+        'date': np.array(days, dtype=np.int64).astype('datetime64[D]'),
+        'open': np.array(opens, dtype=float),
+        'high': np.array(highs, dtype=float),
+        'low': np.array(lows, dtype=float),
+        'bond_yield': np.array(closes, dtype=float),
+    }
+    for resolution, (first, last) in bounds.items():
+        keep = (stored['date'] >= first) & (stored['date'] < last)
+        BondYieldRollup.upsert_many(rollup_rows(asset_id, {name: column[keep] for name, column in stored.items()}, resolution))
+
+def rollup_rows(asset_id, series, resolution):
+    '''
+    Aggregates date sorted rows into one OHLC row per week/month. Every period is expected to be
+    complete, see rebuild_rollups.
+    '''
+    dates = series['date']
+    close = series['bond_yield'].astype(float)
+
+    def column_or_close(name):
+        if name not in series:
+            return close
+        column = series[name].astype(float)
+        return np.where(np.isnan(column), close, column)
+
+    starts = period_starts(dates, resolution)
+    first = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+    last = np.r_[first[1:] - 1, len(dates) - 1]
+
+    aggregates = {
+        'date': starts[first].tolist(),
+        'open': column_or_close('open')[first].tolist(),
+        'high': np.maximum.reduceat(column_or_close('high'), first).tolist(),
+        'low': np.minimum.reduceat(column_or_close('low'), first).tolist(),
+        'bond_yield': close[last].tolist(),
+        'first_date': dates[first].tolist(),
+        'last_date': dates[last].tolist(),
+    }
+    return [
+        dict({name: column[i] for name, column in aggregates.items()}, asset_id=int(asset_id), resolution=resolution)
+        for i in range(len(first))
+    ]
+
+def copy_chunk(names, rows):
+    # COPY into a temporary staging table, then a single INSERT ... ON CONFLICT into bond_yield
+    column_list = ", ".join(names)
+    updates = ", ".join(f"{name} = EXCLUDED.{name}" for name in names if name not in ('date', 'asset_id'))
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.execute(f"CREATE TEMP TABLE bond_yield_stage (LIKE {BondYield.__tablename__} INCLUDING DEFAULTS) ON COMMIT DROP")
+        cursor.copy_expert(f"COPY bond_yield_stage ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(
+            f"INSERT INTO {BondYield.__tablename__} ({column_list}) "
+            f"SELECT {column_list} FROM bond_yield_stage "
+            f"ON CONFLICT (date, asset_id) DO UPDATE SET {updates}"
+        )
+        # dropped straight away as several chunks can share one transaction
+        cursor.execute("DROP TABLE bond_yield_stage")
+    finally:
+        cursor.close()
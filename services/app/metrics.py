@@ -0,0 +1,78 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_DIRECTORY = "/var/log/metrics/"
+
+class MetricsRegistry():
+    '''
+    Timings and counters for one process. The cron/daemon processes flush a JSON snapshot
+    to METRICS_DIRECTORY so the web app can serve every process's numbers from /metrics.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.counters = {}
+
+    def observe(self, key, seconds):
+        with self.lock:
+            timing = self.timings.setdefault(key, {"count": 0, "total": 0.0, "last": 0.0, "max": 0.0})
+            timing["count"] += 1
+            timing["total"] += seconds
+            timing["last"] = seconds
+            timing["max"] = max(timing["max"], seconds)
+
+    def increment(self, key, amount=1):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, key):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(key, time.perf_counter() - start)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "updated": time.time(),
+                "timings": {key: dict(value) for key, value in self.timings.items()},
+                "counters": dict(self.counters),
+            }
+
+    def flush(self):
+        os.makedirs(METRICS_DIRECTORY, exist_ok=True)
+        path = os.path.join(METRICS_DIRECTORY, f"{self.name}.json")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(tmp_path, path)
+
+registries = {}
+
+def get_registry(name):
+    if name not in registries:
+        registries[name] = MetricsRegistry(name)
+    return registries[name]
+
+def read_snapshots():
+    snapshots = {}
+    if os.path.isdir(METRICS_DIRECTORY):
+        for filename in sorted(os.listdir(METRICS_DIRECTORY)):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(METRICS_DIRECTORY, filename), 'r') as file:
+                    snapshots[filename[:-len(".json")]] = json.load(file)
+            except (OSError, json.JSONDecodeError):
+                continue
+    # live numbers win over whatever this process flushed earlier
+    for name, registry in registries.items():
+        snapshots[name] = registry.snapshot()
+    return snapshots
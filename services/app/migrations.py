@@ -0,0 +1,216 @@
+from extensions import db
+from models import BondYieldRealtime, BondYieldRollup, BondSpread, BondSpreadRealtime, CacheGeneration, SchemaMigration, unit_of_work
+from queries import realtime_query, historical_columns_query, watermarks_query, latest_date_by_ref_id_query, spread_query, realtime_spread_query
+from partitions import ensure_partitions, rollup_minute_bars
+from spreads import rebuild_spreads, SPREAD_PERIODS, SPREAD_DECIMALS
+from sqlalchemy import text
+from utilities import timeframes
+
+import datetime
+import logging
+
+##############################
+# MIGRATIONS
+##############################
+
+# Migrations are append only and run in order, each in its own transaction.
+# They target PostgreSQL; a fresh database already gets the final schema from
+# create_all, so create_db only stamps it.
+
+def merge_duplicate_assets(connection):
+    # concurrent jobs could create the same (name, period) twice before the unique constraint existed
+    connection.execute(text("""
+        CREATE TEMP TABLE asset_duplicate ON COMMIT DROP AS
+        SELECT asset.id AS duplicate_id, keep.keep_id
+        FROM asset
+        JOIN (SELECT name, period, min(id) AS keep_id FROM asset GROUP BY name, period HAVING count(*) > 1) keep
+          ON asset.name = keep.name AND asset.period = keep.period AND asset.id <> keep.keep_id
+    """))
+    connection.execute(text("""
+        DELETE FROM bond_yield b USING asset_duplicate d
+        WHERE b.asset_id = d.duplicate_id
+          AND EXISTS (SELECT 1 FROM bond_yield k WHERE k.asset_id = d.keep_id AND k.date = b.date)
+    """))
+    connection.execute(text("UPDATE bond_yield b SET asset_id = d.keep_id FROM asset_duplicate d WHERE b.asset_id = d.duplicate_id"))
+    connection.execute(text("""
+        DELETE FROM bond_yield_realtime b USING asset_duplicate d
+        WHERE b.asset_id = d.duplicate_id
+          AND EXISTS (SELECT 1 FROM bond_yield_realtime k WHERE k.asset_id = d.keep_id AND k.datetime = b.datetime)
+    """))
+    connection.execute(text("UPDATE bond_yield_realtime b SET asset_id = d.keep_id FROM asset_duplicate d WHERE b.asset_id = d.duplicate_id"))
+    connection.execute(text("DELETE FROM asset a USING asset_duplicate d WHERE a.id = d.duplicate_id"))
+
+def add_query_indexes(connection):
+    merge_duplicate_assets(connection)
+    for statement in [
+        "CREATE INDEX IF NOT EXISTS ix_bond_yield_realtime_timeframe_datetime ON bond_yield_realtime (timeframe, datetime DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_bond_yield_realtime_asset_id_datetime ON bond_yield_realtime (asset_id, datetime DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_bond_yield_asset_id_date ON bond_yield (asset_id, date DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_bond_yield_ref_id_date ON bond_yield (ref_id, date DESC)",
+        "ALTER TABLE asset ADD CONSTRAINT uq_asset_name_period UNIQUE (name, period)",
+    ]:
+        connection.execute(text(statement))
+
+def realtime_ohlc_bars(connection):
+    # rows used to be single ticks tagged with the largest timeframe dividing their minute,
+    # they all become 1 minute bars and the coarser bars are rebuilt from them
+    for statement in [
+        "ALTER TABLE bond_yield_realtime ADD COLUMN open DOUBLE PRECISION, ADD COLUMN high DOUBLE PRECISION, ADD COLUMN low DOUBLE PRECISION",
+        "UPDATE bond_yield_realtime SET open = bond_yield, high = bond_yield, low = bond_yield, timeframe = 1",
+        "ALTER TABLE bond_yield_realtime ALTER COLUMN open SET NOT NULL, ALTER COLUMN high SET NOT NULL, ALTER COLUMN low SET NOT NULL",
+        "ALTER TABLE bond_yield_realtime DROP CONSTRAINT bond_yield_realtime_pkey",
+        "ALTER TABLE bond_yield_realtime ADD PRIMARY KEY (datetime, asset_id, timeframe)",
+        # latest tick lookups now filter on timeframe 1
+        "DROP INDEX IF EXISTS ix_bond_yield_realtime_asset_id_datetime",
+        "CREATE INDEX IF NOT EXISTS ix_bond_yield_realtime_asset_id_timeframe_datetime ON bond_yield_realtime (asset_id, timeframe, datetime DESC)",
+    ]:
+        connection.execute(text(statement))
+
+    for timeframe in timeframes.values():
+        if timeframe != 1:
+            rollup_minute_bars(connection, timeframe)
+
+def daily_ohlc_and_rollups(connection):
+    connection.execute(text(
+        "ALTER TABLE bond_yield ADD COLUMN open DOUBLE PRECISION, ADD COLUMN high DOUBLE PRECISION, "
+        "ADD COLUMN low DOUBLE PRECISION, ADD COLUMN change_percent DOUBLE PRECISION"
+    ))
+    BondYieldRollup.__table__.create(connection, checkfirst=True)
+
+    # seeded once from the stored closes, ingest keeps them current from here on
+    for resolution, unit in (('W', 'week'), ('M', 'month')):
+        connection.execute(text("""
+            INSERT INTO bond_yield_rollup (date, asset_id, resolution, open, high, low, bond_yield, first_date, last_date)
+            SELECT date_trunc(:unit, date)::date, asset_id, :resolution,
+                   (array_agg(coalesce(open, bond_yield) ORDER BY date))[1],
+                   max(coalesce(high, bond_yield)),
+                   min(coalesce(low, bond_yield)),
+                   (array_agg(bond_yield ORDER BY date DESC))[1],
+                   min(date),
+                   max(date)
+            FROM bond_yield
+            GROUP BY 1, asset_id
+        """), {"unit": unit, "resolution": resolution})
+
+def cache_generations(connection):
+    CacheGeneration.__table__.create(connection, checkfirst=True)
+
+def partition_realtime(connection):
+    # bond_yield_realtime becomes a monthly partitioned table (see partitions.py), a table can not be
+    # partitioned in place so the rows are copied into a new one
+    for statement in [
+        "ALTER TABLE bond_yield_realtime RENAME TO bond_yield_realtime_unpartitioned",
+        "ALTER TABLE bond_yield_realtime_unpartitioned RENAME CONSTRAINT bond_yield_realtime_pkey TO bond_yield_realtime_unpartitioned_pkey",
+        "DROP INDEX IF EXISTS ix_bond_yield_realtime_timeframe_datetime",
+        "DROP INDEX IF EXISTS ix_bond_yield_realtime_asset_id_timeframe_datetime",
+    ]:
+        connection.execute(text(statement))
+    BondYieldRealtime.__table__.create(connection)
+
+    # months up to the current one, create_db and the realtime daemon add the ones ahead
+    first = connection.execute(text("SELECT min(datetime) FROM bond_yield_realtime_unpartitioned")).scalar()
+    ensure_partitions(connection, first or datetime.datetime.now(), 0)
+    columns = ", ".join(column.name for column in BondYieldRealtime.__table__.columns)
+    connection.execute(text(f"INSERT INTO bond_yield_realtime ({columns}) SELECT {columns} FROM bond_yield_realtime_unpartitioned"))
+    connection.execute(text("DROP TABLE bond_yield_realtime_unpartitioned"))
+
+def bond_spreads(connection):
+    BondSpread.__table__.create(connection, checkfirst=True)
+    BondSpreadRealtime.__table__.create(connection, checkfirst=True)
+    # seeded once from the stored yields, ingest and the realtime writer keep them current from here on
+    rebuild_spreads()
+    connection.execute(text("""
+        INSERT INTO bond_spread_realtime (datetime, name, timeframe, spread)
+        SELECT long_bar.datetime, long_asset.name, long_bar.timeframe, round((long_bar.bond_yield - short_bar.bond_yield)::numeric, :decimals)::float
+        FROM bond_yield_realtime long_bar
+        JOIN asset long_asset ON long_asset.id = long_bar.asset_id AND long_asset.period = :long
+        JOIN asset short_asset ON short_asset.name = long_asset.name AND short_asset.period = :short
+        JOIN bond_yield_realtime short_bar ON short_bar.asset_id = short_asset.id
+          AND short_bar.datetime = long_bar.datetime AND short_bar.timeframe = long_bar.timeframe
+    """), {"short": SPREAD_PERIODS[0], "long": SPREAD_PERIODS[1], "decimals": SPREAD_DECIMALS})
+
+MIGRATIONS = [
+    ("0001_query_indexes", add_query_indexes),
+    ("0002_realtime_ohlc_bars", realtime_ohlc_bars),
+    ("0003_daily_ohlc_and_rollups", daily_ohlc_and_rollups),
+    ("0004_cache_generations", cache_generations),
+    ("0005_partition_realtime", partition_realtime),
+    ("0006_bond_spreads", bond_spreads),
+]
+
+def applied_migrations():
+    return {migration.name for migration in SchemaMigration.query.all()}
+
+def stamp_migrations():
+    applied = applied_migrations()
+    with unit_of_work():
+        for name, _ in MIGRATIONS:
+            if name not in applied:
+                db.session.add(SchemaMigration(name))
+
+def run_migrations():
+    applied = applied_migrations()
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        logging.info(f"Applying migration {name}")
+        with unit_of_work():
+            migration(db.session.connection())
+            db.session.add(SchemaMigration(name))
+
+##############################
+# QUERY PLAN CHECKS
+##############################
+
+def explain_targets():
+    # (description, query, indexes the plan may use on the queried table)
+    day = datetime.date(2020, 1, 2)
+    return [
+        ("/get_realtime", realtime_query("All", 5, 500), ("ix_bond_yield_realtime_timeframe_datetime",)),
+        ("/get_realtime countries", realtime_query("spain italy", 5, 500), ("ix_bond_yield_realtime_timeframe_datetime", "ix_bond_yield_realtime_asset_id_timeframe_datetime")),
+        ("BondYieldRealtime.latest_entries", BondYieldRealtime.latest_entries_query([1, 2]), ("ix_bond_yield_realtime_asset_id_timeframe_datetime", "ix_bond_yield_realtime_timeframe_datetime")),
+        ("sync_planner.series_watermarks", watermarks_query(), ("ix_bond_yield_asset_id_date",)),
+        ("proxy get_latest_date_by_ref_id", latest_date_by_ref_id_query(23801), ("ix_bond_yield_ref_id_date",)),
+        ("/get_spread", spread_query("spain italy", day, day + datetime.timedelta(days=365)), ("ix_bond_spread_name_date", "bond_spread_pkey")),
+        ("/get_spread realtime", realtime_spread_query("All", 5, 500), ("ix_bond_spread_realtime_timeframe_datetime",)),
+        ("/get_historical", historical_columns_query("spain", day, day + datetime.timedelta(days=365)), ("ix_bond_yield_asset_id_date", "bond_yield_pkey")),
+    ]
+
+def plan_indexes(plan):
+    # every (node type, index name) pair in an EXPLAIN (FORMAT JSON) tree
+    found = []
+    nodes = [plan]
+    while nodes:
+        node = nodes.pop()
+        if node.get("Index Name"):
+            found.append((node["Node Type"], node["Index Name"]))
+        nodes.extend(node.get("Plans", []))
+    return found
+
+def parent_indexes(connection):
+    # index of a partition -> the index declared on its partitioned table
+    return dict(connection.execute(text("""
+        SELECT child.relname, parent.relname FROM pg_inherits i
+        JOIN pg_class child ON child.oid = i.inhrelid
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        WHERE child.relkind = 'i'
+    """)).all())
+
+def explain_endpoint_queries():
+    '''
+    Runs EXPLAIN on every endpoint query shape and reports whether one of the expected indexes is used.
+    Sequential scans are disabled for the check, otherwise the planner picks them for small tables
+    and the result would depend on how much data happens to be loaded.
+    '''
+    results = []
+    connection = db.session.connection()
+    connection.execute(text("SET LOCAL enable_seqscan = off"))
+    parents = parent_indexes(connection)
+    for description, query, index_names in explain_targets():
+        statement = getattr(query, "statement", query).compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True})
+        plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {statement}")).scalar()[0]["Plan"]
+        # a partitioned table is scanned once per partition, reported under the parent's index
+        used = list(dict.fromkeys((node_type, parents.get(name, name)) for node_type, name in plan_indexes(plan)))
+        results.append((description, index_names, any(name in index_names for _, name in used), used))
+    db.session.rollback()
+    return results
@@ -1 +1,4 @@
-from .bond import BondYield, Asset, BondYieldRealtime
\ No newline at end of file
+from .bond import BondYield, Asset, BondYieldRealtime, BondYieldRollup, BondSpread, BondSpreadRealtime
+from .cache import CacheGeneration
+from .schema import SchemaMigration
+from .mixins import unit_of_work
\ No newline at end of file
@@ -1,11 +1,15 @@
 from extensions import db
-from sqlalchemy import Column, ForeignKey, Integer, String, desc
+from models.mixins import BulkWriteMixin, dialect_insert, greatest, least
+from sqlalchemy import Column, ForeignKey, Integer, String, desc, func, and_, tuple_, event, DDL
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 import datetime
 
-class Asset(db.Model):
+class Asset(BulkWriteMixin, db.Model):
     __tablename__ = "asset"
+    __table_args__ = (
+        db.UniqueConstraint('name', 'period', name='uq_asset_name_period'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True, nullable=False)
     name = db.Column(db.String(80), nullable=False)
     period = db.Column(db.Integer, nullable=False)
@@ -16,35 +20,84 @@ class Asset(db.Model):
     def __init__(self, name, period):
         self.name = name
         self.period = int(period)
-        db.session.add(self)
-        db.session.commit()
 
-class BondYield(db.Model):
+    @classmethod
+    def get_or_create(cls, name, period):
+        asset = cls.query.filter_by(name=name, period=int(period)).first()
+        if not asset:
+            asset = cls(name=name, period=period)
+            db.session.add(asset)
+            db.session.flush() # assigns the id without ending the caller's transaction
+        return asset
+
+    @classmethod
+    def id_map(cls):
+        return {(name, period): _id for _id, name, period in db.session.query(cls.id, cls.name, cls.period)}
+
+class BondYield(BulkWriteMixin, db.Model):
     __tablename__ = "bond_yield"
+    __table_args__ = (
+        db.Index('ix_bond_yield_asset_id_date', 'asset_id', desc('date')),
+        db.Index('ix_bond_yield_ref_id_date', 'ref_id', desc('date')),
+    )
     # id = db.Column(db.String(50), primary_key=True, nullable=False)
     date = db.Column(db.Date, primary_key=True, nullable=False)
     asset_id = db.Column(db.Integer, db.ForeignKey('asset.id'), primary_key=True, nullable=False)
-    bond_yield = db.Column(db.Float, nullable=False)
+    bond_yield = db.Column(db.Float, nullable=False) # daily close
+    # open/high/low/change are only known for rows that came through the investing.com API
+    open = db.Column(db.Float, nullable=True)
+    high = db.Column(db.Float, nullable=True)
+    low = db.Column(db.Float, nullable=True)
+    change_percent = db.Column(db.Float, nullable=True)
     ref_id = db.Column(db.Integer, nullable=False)
     # Relationship to Country
     asset = relationship('Asset')
 
-    def __init__(self, date, asset_id, bond_yield, ref_id):
+    def __init__(self, date, asset_id, bond_yield, ref_id, open=None, high=None, low=None, change_percent=None):
         # self.id = f"{datetime.datetime.strftime(date, "%Y-%m-%d")}_{country_name}_{period}"
         self.date = date
         self.asset_id = int(asset_id)
         self.bond_yield = float(bond_yield)
         self.ref_id = int(ref_id)
-        db.session.add(self)
-        db.session.commit()
+        self.open = open
+        self.high = high
+        self.low = low
+        self.change_percent = change_percent
 
-class BondYieldRealtime(db.Model):
+class BondYieldRollup(BulkWriteMixin, db.Model):
+    __tablename__ = "bond_yield_rollup"
+    # Weekly ('W', weeks start on Monday) and monthly ('M') OHLC bars built from bond_yield.
+    # date is the first day of the period, first_date/last_date its first and last stored trading day.
+    # ingest recomputes every period a write touches from bond_yield (see ingest.rebuild_rollups)
+    date = db.Column(db.Date, primary_key=True, nullable=False)
+    asset_id = db.Column(db.Integer, db.ForeignKey('asset.id'), primary_key=True, nullable=False)
+    resolution = db.Column(db.String(1), primary_key=True, nullable=False)
+    open = db.Column(db.Float, nullable=False)
+    high = db.Column(db.Float, nullable=False)
+    low = db.Column(db.Float, nullable=False)
+    bond_yield = db.Column(db.Float, nullable=False) # close
+    first_date = db.Column(db.Date, nullable=False)
+    last_date = db.Column(db.Date, nullable=False)
+    # Relationship to Country
+    asset = relationship('Asset')
+
+class BondYieldRealtime(BulkWriteMixin, db.Model):
     __tablename__ = "bond_yield_realtime"
-    # id = db.Column(db.String(50), primary_key=True, nullable=False)
+    __table_args__ = (
+        db.Index('ix_bond_yield_realtime_timeframe_datetime', 'timeframe', desc('datetime')),
+        db.Index('ix_bond_yield_realtime_asset_id_timeframe_datetime', 'asset_id', 'timeframe', desc('datetime')),
+        # monthly partitions on PostgreSQL, see partitions.py
+        {'postgresql_partition_by': 'RANGE (datetime)'},
+    )
+    # One OHLC bar per (datetime, asset, timeframe). 1 minute rows are the raw ticks and
+    # coarser bars are rolled up from them as they arrive. bond_yield is the close
     datetime = db.Column(db.DateTime, primary_key=True, nullable=False)
     asset_id = db.Column(db.Integer, db.ForeignKey('asset.id'), primary_key=True, nullable=False)
+    timeframe = db.Column(db.Integer, primary_key=True, nullable=False)
+    open = db.Column(db.Float, nullable=False)
+    high = db.Column(db.Float, nullable=False)
+    low = db.Column(db.Float, nullable=False)
     bond_yield = db.Column(db.Float, nullable=False)
-    timeframe = db.Column(db.Integer, nullable=False)
     is_open = db.Column(db.Integer, nullable=False)
     is_close = db.Column(db.Integer, nullable=False)
     # Relationship to Country
@@ -55,12 +108,93 @@ class BondYieldRealtime(db.Model):
         self.datetime = datetime
         self.asset_id = int(asset_id)
         self.bond_yield = float(bond_yield)
+        self.open = self.high = self.low = self.bond_yield
         self.is_open = is_open
         self.is_close = 0
         self.timeframe = timeframe
-        db.session.add(self)
-        db.session.commit()
 
     @classmethod
     def latest_entry(cls, asset_id):
-        return cls.query.filter(cls.asset_id == asset_id).order_by(cls.datetime.desc()).first()
\ No newline at end of file
+        return cls.query.filter(cls.asset_id == asset_id, cls.timeframe == 1).order_by(cls.datetime.desc()).first()
+
+    @classmethod
+    def latest_entries_query(cls, asset_ids=None):
+        # latest 1 minute row per asset
+        if db.engine.dialect.name == "postgresql":
+            query = cls.query.filter(cls.timeframe == 1).distinct(cls.asset_id).order_by(cls.asset_id, cls.datetime.desc())
+        else:
+            ranked = db.session.query(
+                cls.asset_id,
+                func.max(cls.datetime).label('datetime')
+            ).filter(cls.timeframe == 1).group_by(cls.asset_id).subquery()
+            query = cls.query.join(ranked, and_(cls.asset_id == ranked.c.asset_id, cls.datetime == ranked.c.datetime)).filter(cls.timeframe == 1)
+
+        if asset_ids is not None:
+            query = query.filter(cls.asset_id.in_(asset_ids))
+        return query
+
+    @classmethod
+    def latest_entries(cls, asset_ids=None):
+        # latest row of every asset in one query, keyed by asset id
+        return {entry.asset_id: entry for entry in cls.latest_entries_query(asset_ids).all()}
+
+    @classmethod
+    def upsert_bars(cls, rows):
+        # merges ticks into existing bars: open is kept, high/low widen, the close and is_close move to the
+        # newest tick and a bar stays marked as a reopening once any of its ticks was one
+        if not rows:
+            return
+        stmt = dialect_insert(cls.__table__).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=cls.primary_key_names(),
+            set_={
+                'high': greatest(cls.__table__.c.high, stmt.excluded.high),
+                'low': least(cls.__table__.c.low, stmt.excluded.low),
+                'bond_yield': stmt.excluded.bond_yield,
+                'is_open': greatest(cls.__table__.c.is_open, stmt.excluded.is_open),
+                'is_close': stmt.excluded.is_close,
+            }
+        )
+        db.session.execute(stmt)
+
+    @classmethod
+    def mark_closed(cls, keys):
+        # keys are (datetime, asset_id, timeframe) tuples of the bars that were live when the market closed
+        if keys:
+            db.session.execute(
+                cls.__table__.update()
+                .where(tuple_(cls.datetime, cls.asset_id, cls.timeframe).in_(keys))
+                .values(is_close=1)
+            )
+
+class BondSpread(BulkWriteMixin, db.Model):
+    __tablename__ = "bond_spread"
+    __table_args__ = (
+        db.Index('ix_bond_spread_name_date', 'name', desc('date')),
+    )
+    # 5Y minus 2Y close of a country on every day both are stored, kept current by ingest (see spreads.py).
+    # change is against the previous spread, zscore against the trailing SPREAD_ZSCORE_DAYS spreads
+    date = db.Column(db.Date, primary_key=True, nullable=False)
+    name = db.Column(db.String(80), primary_key=True, nullable=False)
+    spread = db.Column(db.Float, nullable=False)
+    change = db.Column(db.Float, nullable=True)
+    zscore = db.Column(db.Float, nullable=True)
+
+class BondSpreadRealtime(BulkWriteMixin, db.Model):
+    __tablename__ = "bond_spread_realtime"
+    __table_args__ = (
+        db.Index('ix_bond_spread_realtime_timeframe_datetime', 'timeframe', desc('datetime')),
+    )
+    # 5Y minus 2Y close of the bars of bond_yield_realtime, for the minutes both were quoted
+    datetime = db.Column(db.DateTime, primary_key=True, nullable=False)
+    name = db.Column(db.String(80), primary_key=True, nullable=False)
+    timeframe = db.Column(db.Integer, primary_key=True, nullable=False)
+    spread = db.Column(db.Float, nullable=False)
+
+# a row no month partition covers yet lands here instead of failing, partitions.ensure_partitions
+# moves it out once its month is created
+event.listen(
+    BondYieldRealtime.__table__,
+    "after_create",
+    DDL("CREATE TABLE bond_yield_realtime_default PARTITION OF bond_yield_realtime DEFAULT").execute_if(dialect="postgresql"),
+)
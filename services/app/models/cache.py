@@ -0,0 +1,30 @@
+from extensions import db
+from models.mixins import BulkWriteMixin, dialect_insert
+
+class CacheGeneration(BulkWriteMixin, db.Model):
+    __tablename__ = "cache_generation"
+    # Bumped by the writers in the same transaction as their data so cached responses in
+    # other processes can tell they are stale. Keys are "realtime" and "asset:<id>";
+    # changed_from is the earliest date touched by the most recent bump.
+    key = db.Column(db.String(40), primary_key=True, nullable=False)
+    value = db.Column(db.BigInteger, nullable=False)
+    changed_from = db.Column(db.Date, nullable=True)
+
+    @staticmethod
+    def asset_key(asset_id):
+        return f"asset:{int(asset_id)}"
+
+    @classmethod
+    def bump(cls, key, changed_from=None):
+        table = cls.__table__
+        stmt = dialect_insert(table).values(key=key, value=1, changed_from=changed_from)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['key'],
+            set_={'value': table.c.value + 1, 'changed_from': stmt.excluded.changed_from}
+        )
+        db.session.execute(stmt)
+
+    @classmethod
+    def current(cls, key):
+        value = db.session.query(cls.value).filter(cls.key == key).scalar()
+        return value or 0
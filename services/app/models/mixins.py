@@ -0,0 +1,83 @@
+from extensions import db
+from sqlalchemy import insert, func, cast, literal, Date, Integer
+from sqlalchemy.dialects import postgresql, sqlite
+from contextlib import contextmanager
+
+
+def dialect_insert(table):
+    # ON CONFLICT support lives in the dialect specific insert constructs
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table)
+    if dialect == "sqlite":
+        return sqlite.insert(table)
+    raise NotImplementedError(f"Upserts are not supported for dialect {dialect}")
+
+
+def greatest(*args):
+    # scalar max/min are spelt greatest/least on PostgreSQL
+    return func.greatest(*args) if db.engine.dialect.name == "postgresql" else func.max(*args)
+
+
+def least(*args):
+    return func.least(*args) if db.engine.dialect.name == "postgresql" else func.min(*args)
+
+
+def epoch_days(column):
+    # date column as whole days since 1970-01-01, which NumPy reads without building date objects
+    if db.engine.dialect.name == "postgresql":
+        return column - cast(literal('1970-01-01'), Date)
+    return cast(func.julianday(column) - 2440587.5, Integer)
+
+
+def upsert_statement(table, rows, index_elements, update_columns):
+    stmt = dialect_insert(table).values(rows)
+    if not update_columns:
+        return stmt.on_conflict_do_nothing(index_elements=index_elements)
+    return stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={column: stmt.excluded[column] for column in update_columns}
+    )
+
+
+@contextmanager
+def unit_of_work():
+    '''
+    Groups every write made inside the block into one transaction. Nested blocks
+    defer to the outermost one, so helpers that commit on their own can be batched by the caller.
+    '''
+    depth = db.session.info.get("unit_of_work_depth", 0)
+    db.session.info["unit_of_work_depth"] = depth + 1
+    try:
+        yield db.session
+        if depth == 0:
+            db.session.commit()
+    except Exception:
+        if depth == 0:
+            db.session.rollback()
+        raise
+    finally:
+        db.session.info["unit_of_work_depth"] = depth
+
+
+class BulkWriteMixin:
+
+    @classmethod
+    def primary_key_names(cls):
+        return [column.name for column in cls.__table__.primary_key.columns]
+
+    @classmethod
+    def bulk_create(cls, rows):
+        # plain multi-row INSERT, rows are dicts keyed by column name. Nothing is committed here
+        if rows:
+            db.session.execute(insert(cls.__table__), rows)
+
+    @classmethod
+    def upsert_many(cls, rows, update_columns=None):
+        # INSERT ... ON CONFLICT on the primary key, by default every non key column is overwritten
+        if not rows:
+            return
+        keys = cls.primary_key_names()
+        if update_columns is None:
+            update_columns = [column for column in rows[0] if column not in keys]
+        db.session.execute(upsert_statement(cls.__table__, rows, keys, update_columns))
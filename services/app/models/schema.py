@@ -0,0 +1,11 @@
+from extensions import db
+import datetime
+
+class SchemaMigration(db.Model):
+    __tablename__ = "schema_migration"
+    name = db.Column(db.String(120), primary_key=True, nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, name):
+        self.name = name
+        self.applied_at = datetime.datetime.utcnow()
@@ -0,0 +1,198 @@
+from extensions import db
+from models import unit_of_work
+from sqlalchemy import text
+from utilities import timeframes
+
+import datetime
+import logging
+
+##############################
+# REALTIME PARTITIONS
+##############################
+
+# On PostgreSQL bond_yield_realtime is range partitioned by month on datetime:
+#
+#   bond_yield_realtime            partitioned parent, indexes are declared here
+#   bond_yield_realtime_p2024_01   [2024-01-01, 2024-02-01)
+#   bond_yield_realtime_default    anything no month partition covers yet
+#
+# The realtime daemon keeps months up to REALTIME_PARTITIONS_AHEAD ahead created, so the default
+# partition only fills if it has not run for that long. A month created later takes over its rows
+# from the default partition, and maintenance creates the past months it still holds rows for.
+# Other dialects keep a plain table and everything here is a no-op.
+
+TABLE = "bond_yield_realtime"
+DEFAULT_PARTITION = f"{TABLE}_default"
+MINUTE_TIMEFRAME = 1
+
+def month_start(value):
+    return datetime.datetime(value.year, value.month, 1)
+
+def next_month(value):
+    return datetime.datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+def partition_name(month):
+    return f"{TABLE}_p{month.year:04d}_{month.month:02d}"
+
+def is_partitioned(connection):
+    if connection.dialect.name != "postgresql":
+        return False
+    return connection.execute(text("""
+        SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :table
+    """), {"table": TABLE}).first() is not None
+
+def partitions(connection):
+    # names of the partitions attached to bond_yield_realtime
+    return {row[0] for row in connection.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :table
+    """), {"table": TABLE})}
+
+def create_partition(connection, month, attached=None):
+    name = partition_name(month)
+    if name in (attached if attached is not None else partitions(connection)):
+        return False
+    start, end = month, next_month(month)
+    # built detached and filled from the default partition first, attaching a range the default
+    # partition still holds rows for would fail
+    connection.execute(text(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    if DEFAULT_PARTITION in (attached if attached is not None else partitions(connection)):
+        connection.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION} WHERE datetime >= :start AND datetime < :end RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """), {"start": start, "end": end})
+    connection.execute(text(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"))
+    if attached is not None:
+        attached.add(name)
+    logging.info(f"Created partition {name}")
+    return True
+
+def ensure_partitions(connection, first_month, months_ahead, today=None):
+    # every month from first_month up to months_ahead after today, plus the default partition and
+    # the months of any older rows it holds
+    if not is_partitioned(connection):
+        return []
+    attached = partitions(connection)
+    if DEFAULT_PARTITION not in attached:
+        connection.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT"))
+        attached.add(DEFAULT_PARTITION)
+
+    created = []
+    # rows that came in while no month partition covered them, e.g. after the daemon was down
+    held = connection.execute(text(f"SELECT DISTINCT date_trunc('month', datetime) FROM {DEFAULT_PARTITION}")).scalars().all()
+    for month in sorted(month_start(value) for value in held):
+        if create_partition(connection, month, attached):
+            created.append(partition_name(month))
+
+    month = month_start(first_month)
+    last = month_start(today or datetime.datetime.now())
+    for _ in range(months_ahead):
+        last = next_month(last)
+    while month <= last:
+        if create_partition(connection, month, attached):
+            created.append(partition_name(month))
+        month = next_month(month)
+    return created
+
+##############################
+# RETENTION
+##############################
+
+# 1 minute bars are kept for REALTIME_MINUTE_RETENTION_DAYS. The writer rolls every tick into the
+# coarser bars as it goes, so removing the minute rows loses no history; any coarse bar that is
+# missing is rebuilt from them first. Whole months older than REALTIME_RETENTION_MONTHS are
+# dropped with their partition, 0 keeps everything. bond_spread_realtime is not partitioned, its rows
+# before the same month are deleted.
+
+def bucket_sql(timeframe):
+    # start of the timeframe bar a 1 minute row falls in, bars are aligned to midnight
+    return (f"date_trunc('day', datetime) + floor(extract(epoch FROM datetime - date_trunc('day', datetime)) / 60 / {int(timeframe)})"
+            f" * {int(timeframe)} * interval '1 minute'")
+
+def rollup_minute_bars(connection, timeframe, before=None, on_conflict=""):
+    # coarse OHLC bars from the 1 minute rows, only those older than `before` when given
+    condition = "AND datetime < :before" if before else ""
+    connection.execute(text(f"""
+        INSERT INTO {TABLE} (datetime, asset_id, timeframe, open, high, low, bond_yield, is_open, is_close)
+        SELECT bucket, asset_id, :timeframe,
+               (array_agg(open ORDER BY datetime))[1],
+               max(high),
+               min(low),
+               (array_agg(bond_yield ORDER BY datetime DESC))[1],
+               max(is_open),
+               (array_agg(is_close ORDER BY datetime DESC))[1]
+        FROM (
+            SELECT *, {bucket_sql(timeframe)} AS bucket
+            FROM {TABLE}
+            WHERE timeframe = {MINUTE_TIMEFRAME} {condition}
+        ) ticks
+        GROUP BY bucket, asset_id
+        {on_conflict}
+    """), {"timeframe": timeframe, "before": before})
+
+def expire_minute_bars(connection, retention_days, now=None):
+    if connection.dialect.name != "postgresql" or retention_days <= 0:
+        return 0
+    # cut at midnight so no coarse bar is left with only part of its minutes behind it
+    cutoff = (now or datetime.datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=retention_days)
+    for timeframe in timeframes.values():
+        if timeframe != MINUTE_TIMEFRAME:
+            rollup_minute_bars(connection, timeframe, before=cutoff, on_conflict="ON CONFLICT DO NOTHING")
+    # the spread bars are written per timeframe with the yields, the coarse ones are already there
+    connection.execute(text(f"DELETE FROM bond_spread_realtime WHERE timeframe = {MINUTE_TIMEFRAME} AND datetime < :cutoff"), {"cutoff": cutoff})
+    return connection.execute(text(f"DELETE FROM {TABLE} WHERE timeframe = {MINUTE_TIMEFRAME} AND datetime < :cutoff"), {"cutoff": cutoff}).rowcount
+
+def oldest_kept_month(retention_months, today=None):
+    oldest_kept = month_start(today or datetime.datetime.now())
+    for _ in range(retention_months):
+        oldest_kept = datetime.datetime(oldest_kept.year - (oldest_kept.month == 1), (oldest_kept.month - 2) % 12 + 1, 1)
+    return oldest_kept
+
+def drop_expired_partitions(connection, retention_months, today=None):
+    if not is_partitioned(connection) or retention_months <= 0:
+        return []
+    oldest_kept = oldest_kept_month(retention_months, today)
+    dropped = []
+    for name in sorted(partitions(connection)):
+        if name != DEFAULT_PARTITION and name < partition_name(oldest_kept):
+            connection.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+    if dropped:
+        logging.info(f"Dropped partitions {dropped}")
+    return dropped
+
+def expire_spread_bars(connection, retention_months, today=None):
+    if connection.dialect.name != "postgresql" or retention_months <= 0:
+        return 0
+    return connection.execute(text("DELETE FROM bond_spread_realtime WHERE datetime < :cutoff"),
+                              {"cutoff": oldest_kept_month(retention_months, today)}).rowcount
+
+def maintain_realtime(connection, months_ahead, minute_retention_days, retention_months, now=None):
+    '''
+    Daily housekeeping of bond_yield_realtime and bond_spread_realtime: future partitions, 1 minute
+    retention, expired months.
+    Returns a summary for the logs.
+    '''
+    now = now or datetime.datetime.now()
+    return {
+        "created": ensure_partitions(connection, now, months_ahead, now),
+        "minute_rows_expired": expire_minute_bars(connection, minute_retention_days, now),
+        "dropped": drop_expired_partitions(connection, retention_months, now),
+        "spread_rows_expired": expire_spread_bars(connection, retention_months, now),
+    }
+
+def run_maintenance(config):
+    # maintain_realtime in its own transaction with the REALTIME_* settings of config
+    with unit_of_work():
+        summary = maintain_realtime(
+            db.session.connection(),
+            config["REALTIME_PARTITIONS_AHEAD"],
+            config["REALTIME_MINUTE_RETENTION_DAYS"],
+            config["REALTIME_RETENTION_MONTHS"],
+        )
+    logging.info(f"Realtime maintenance: {summary}")
+    return summary
@@ -4,13 +4,25 @@ import re
 import os
 import json
 from models import BondYield
+from queries import latest_date_by_ref_id_query
 from app import app
+from historical_api import save_captured_headers
+from handoff import HandoffClient
+from spool import start_spool, append_page, finish_spool, pending_path, SPOOL_DIRECTORY
+from sync_planner import WatermarkCache
 
 import traceback
 
 from logging_config import write_to_logfile, OK, NO_CONTENT
 
 class CaptureAuthHeader:
+
+    def __init__(self):
+        self.handoff = HandoffClient()
+        self.watermarks = WatermarkCache()
+        self.spool_directory = SPOOL_DIRECTORY
+        self.spool_counts = {} # pending spool path -> [pages, rows] appended by this process
+
     def request(self, flow: http.HTTPFlow) -> None:
 
         print(f"CLOUD: {os.environ.get('CLOUD')}")
@@ -24,6 +36,8 @@ class CaptureAuthHeader:
                 _id = self.get_req_id(flow.request.pretty_url)
                 sending = True
                 if not flow.is_replay:
+                    # lets the sync call the endpoint itself next time
+                    save_captured_headers(dict(flow.request.headers))
                     latest_date = self.get_latest_date_by_ref_id(_id)
                     if not latest_date:
                         flow.request.query["start-date"] = "2000-01-01"
@@ -36,8 +50,7 @@ class CaptureAuthHeader:
                         else:
                             sending = False
                             write_to_logfile(_id, f"Status code 204")
-                            complete_file = f"/home/app/data/{_id}_COMPLETE.txt"
-                            open(complete_file, 'w').close()
+                            # the response hook tells the sync there is nothing to add
                             flow.response = http.Response.make(
                                 status_code=NO_CONTENT,
                                 content=b"Database is up to date",
@@ -59,7 +72,7 @@ class CaptureAuthHeader:
                     # flow.request.headers["Sec-Fetch-Mode"] = "cors"
                     # flow.request.headers["Sec-Fetch-Site"] = "same-site"
 
-                    write_to_logfile(_id, f"(PROXY) Getting data from {flow.request.query["start-date"]} to {flow.request.query["end-date"]}")
+                    write_to_logfile(_id, f"(PROXY) Getting data from {flow.request.query['start-date']} to {flow.request.query['end-date']}")
             except Exception as e:
                 write_to_logfile(_id, traceback.format_exc())
 
@@ -73,37 +86,45 @@ class CaptureAuthHeader:
            flow.request.pretty_url.endswith("add-missing-rows=false"):
             _id = self.get_req_id(flow.request.pretty_url)
             if _id:
-                complete_file = f"/home/app/data/{_id}_COMPLETE.txt"
                 if flow.response.status_code != OK and flow.response.status_code != NO_CONTENT:
                     write_to_logfile(_id, f"status code: {flow.response.status_code}")
+                    self.handoff.send(_id, "error", f"status code: {flow.response.status_code}".encode())
+                    return
+
+                if flow.response.status_code == NO_CONTENT:
+                    if not self.handoff.send(_id, "done"):
+                        finish_spool(start_spool(_id, self.spool_directory), 0, 0)
                     return
-                
+
                 data = json.loads(flow.response.get_text())
-                
-                if data['data'] == None or flow.response.status_code == NO_CONTENT:
-                    open(complete_file, 'w').close()
+
+                if data['data'] == None:
+                    if not self.handoff.send(_id, "done"):
+                        finish_spool(start_spool(_id, self.spool_directory), 0, 0)
                     return
-                
-                # block_file = f"/home/app/data/{_id}_BLOCK.txt"
-                # print(json.dumps(data, indent=4))
-                if flow.is_replay:
-                    append = True
-                else:
-                    append = False
+
+                full_page = len(data["data"]) > 4999 # investing.com returns max 5000 rows
                 try:
+                    # each page goes to the sync as it arrives, the files are only used when it is not listening
+                    if self.handoff.send(_id, "page", flow.response.get_content()):
+                        if not full_page:
+                            self.handoff.send(_id, "done")
+                        else:
+                            self.replay_next_page(flow, data)
+                        return
+
+                    # block_file = f"/home/app/data/{_id}_BLOCK.txt"
+                    # print(json.dumps(data, indent=4))
+                    if flow.is_replay:
+                        append = True
+                    else:
+                        append = False
                     pending_file = self.write_to_file(_id, flow.response.status_code, data, append)
                     if pending_file:
-                        if len(data["data"]) > 4999: # investing.com returns max 5000 rows
-                            # print(f"NEW START DATE: {flow.request.query["start-date"]}")
-                            resend_flow = flow.copy()
-                            latest_resp_date = self.get_latest_resp_date(data)
-                            # print(f"LATEST RESP DATE {latest_resp_date}")
-                            resend_flow.request.query["start-date"] = latest_resp_date
-                            resend_flow.request.query["end-date"] = datetime.now().strftime('%Y-%m-%d')
-                            ctx.master.commands.call("replay.client", [resend_flow])
-                            # print(f"REPLAY FLOW SENT")
+                        if full_page:
+                            self.replay_next_page(flow, data)
                             return
-                        os.rename(pending_file, pending_file.replace("_PENDING", "_COMPLETE"))
+                        finish_spool(pending_file, *self.spool_counts.pop(pending_file, (None, None)))
                     else:
                         write_to_logfile(_id, f"Something went wrong when appending data for ID {_id}")
                 except IOError as e:
@@ -112,6 +133,16 @@ class CaptureAuthHeader:
                 except Exception as e:
                     write_to_logfile(_id, traceback.format_exc())
 
+    def replay_next_page(self, flow, data):
+        # print(f"NEW START DATE: {flow.request.query["start-date"]}")
+        resend_flow = flow.copy()
+        latest_resp_date = self.get_latest_resp_date(data)
+        # print(f"LATEST RESP DATE {latest_resp_date}")
+        resend_flow.request.query["start-date"] = latest_resp_date
+        resend_flow.request.query["end-date"] = datetime.now().strftime('%Y-%m-%d')
+        ctx.master.commands.call("replay.client", [resend_flow])
+        # print(f"REPLAY FLOW SENT")
+
     def get_latest_resp_date(self, body):
         datetime_str = body["data"][0]["rowDateTimestamp"]
         date_object = datetime.strptime(datetime_str, "%Y-%m-%dT%H:%M:%SZ") + timedelta(days=1)
@@ -119,22 +150,20 @@ class CaptureAuthHeader:
         return formatted_date
 
     def write_to_file(self, _id, status_code, response_data, append):
-        filename = f"/home/app/data/{_id}_PENDING.txt"
+        # one append per page to the spool, however many pages came before
+        filename = pending_path(_id, self.spool_directory)
         try:
-            with open(filename, 'a+') as file:  # 'a+' mode for appending and reading
-                if append:
-                    file.seek(0)  # Go to the start of the file to read existing data
-                    current_data = json.load(file)
-                    current_data["data"] = response_data["data"] + current_data["data"]
-                    write_to_logfile(_id, f"Appended data for {filename}")
-                    # except json.JSONDecodeError:
-                else:
-                    current_data = dict(zip(["status_code", "data"], [status_code, response_data["data"]]))
-                    write_to_logfile(_id, f"Added data for {filename}")
-                
-                file.seek(0)  # Go to the start of the file before writing
-                file.truncate()  # Clear the file content before writing new data
-                json.dump(current_data, file)  # Write the updated data
+            if not append or not os.path.exists(filename):
+                start_spool(_id, self.spool_directory)
+                self.spool_counts[filename] = [0, 0]
+                write_to_logfile(_id, f"Added data for {filename}")
+            else:
+                write_to_logfile(_id, f"Appended data for {filename}")
+            append_page(filename, response_data["data"])
+            # a spool this process did not start has no counts, finish_spool reads them back
+            if filename in self.spool_counts:
+                self.spool_counts[filename][0] += 1
+                self.spool_counts[filename][1] += len(response_data["data"])
         except IOError as e:
             # Handle error, e.g., logging or retrying
             write_to_logfile(_id, traceback.format_exc())
@@ -152,9 +181,16 @@ class CaptureAuthHeader:
         return _id
 
     def get_latest_date_by_ref_id(self, _id):
+        # the daily sync writes every watermark before its jobs start, the database is only asked
+        # when the proxy runs without one
+        try:
+            return self.watermarks.latest_date(_id)
+        except LookupError:
+            pass
+
         latest_bond_yield = None
         with app.app_context():
-            latest_bond_yield = BondYield.query.filter_by(ref_id=_id).order_by(BondYield.date.desc()).first()
+            latest_bond_yield = latest_date_by_ref_id_query(_id).first()
             write_to_logfile(_id, f"(PROXY) latest bond yield for {_id}: {latest_bond_yield.date if latest_bond_yield else None}")
         if not latest_bond_yield:
             return None
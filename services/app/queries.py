@@ -0,0 +1,116 @@
+from extensions import db
+from models import BondYield, Asset, BondYieldRealtime, BondYieldRollup, CacheGeneration, BondSpread, BondSpreadRealtime
+from models.mixins import epoch_days
+from sqlalchemy import desc, select, cast, func, String
+
+# Query shapes shared by the endpoints, the sync jobs and `flask explain_queries`
+
+def realtime_query(countries, timeframe, max_rows):
+    query = db.session.query(BondYieldRealtime).join(Asset)
+
+    if countries != "All":
+        country_list = countries.split()
+        query = query.filter(Asset.name.in_(country_list))
+
+    return query.filter(
+            BondYieldRealtime.timeframe == timeframe,
+        ).order_by(
+            desc(BondYieldRealtime.datetime)
+        ).limit(max_rows)
+
+def historical_columns_query(countries, start_date, end_date, resolution='D', ordered=False):
+    # narrow projection for the columnar /get_historical path, no ORM objects and no lazy asset loads
+    model = BondYield if resolution == 'D' else BondYieldRollup
+    query = select(epoch_days(model.date), model.asset_id, Asset.name, Asset.period, model.bond_yield).join(Asset, model.asset_id == Asset.id)
+    if resolution != 'D':
+        query = query.where(model.resolution == resolution)
+    if countries != "All":
+        query = query.where(Asset.name.in_(countries.split()))
+    if start_date != "All":
+        query = query.where((model.last_date if resolution != 'D' else model.date) >= start_date)
+    if end_date != "All":
+        query = query.where(model.date <= end_date)
+    if ordered:
+        query = query.order_by(model.date, model.asset_id)
+    return query
+
+def series_query(countries):
+    query = db.session.query(Asset)
+    if countries != "All":
+        query = query.filter(Asset.name.in_(countries.split()))
+    return query
+
+def asset_generations_query(countries):
+    # (asset_id, generation, changed_from) for every asset a /get_historical request covers
+    query = db.session.query(Asset.id, CacheGeneration.value, CacheGeneration.changed_from).outerjoin(
+        CacheGeneration, CacheGeneration.key == "asset:" + cast(Asset.id, String)
+    )
+    if countries != "All":
+        query = query.filter(Asset.name.in_(countries.split()))
+    return query
+
+def watermarks_query():
+    # (asset_id, name, period, latest_date, ref_id) for every asset in one statement, the correlated
+    # subqueries are one backward probe of ix_bond_yield_asset_id_date per asset instead of a scan
+    latest_date = select(func.max(BondYield.date)).where(BondYield.asset_id == Asset.id).correlate(Asset).scalar_subquery()
+    ref_id = (select(BondYield.ref_id).where(BondYield.asset_id == Asset.id)
+              .order_by(BondYield.date.desc()).limit(1).correlate(Asset).scalar_subquery())
+    return db.session.query(Asset.id, Asset.name, Asset.period, latest_date.label("latest_date"), ref_id.label("ref_id"))
+
+def latest_date_by_ref_id_query(_id):
+    return BondYield.query.filter_by(ref_id=_id).order_by(BondYield.date.desc()).limit(1)
+
+def stored_days_query():
+    # (asset_id, days since epoch) of every stored daily row, the gap scan's only read of bond_yield
+    return select(BondYield.asset_id, epoch_days(BondYield.date))
+
+def stored_dates_query(asset_id, start_date, end_date):
+    # days since epoch already stored for one asset in a date range, read off ix_bond_yield_asset_id_date
+    return select(epoch_days(BondYield.date)).where(
+        BondYield.asset_id == asset_id,
+        BondYield.date >= start_date,
+        BondYield.date <= end_date,
+    )
+
+def period_rows_query(asset_id, start_date, end_date):
+    # (days since epoch, open, high, low, close) of one asset in [start_date, end_date) in date order, for the rollups
+    return select(epoch_days(BondYield.date), BondYield.open, BondYield.high, BondYield.low, BondYield.bond_yield).where(
+        BondYield.asset_id == asset_id,
+        BondYield.date >= start_date,
+        BondYield.date < end_date,
+    ).order_by(BondYield.date)
+
+def archive_series_query(asset_id):
+    # (days since epoch, close) of one asset's whole daily series in date order, for the Arrow archive
+    return select(epoch_days(BondYield.date), BondYield.bond_yield).where(BondYield.asset_id == asset_id).order_by(BondYield.date)
+
+def spread_legs_query(name, periods, start_date=None):
+    # (days since epoch, period, close) of both legs of a country's spread, from start_date on
+    query = select(epoch_days(BondYield.date), Asset.period, BondYield.bond_yield).join(Asset, BondYield.asset_id == Asset.id).where(
+        Asset.name == name,
+        Asset.period.in_(periods),
+    )
+    if start_date is not None:
+        query = query.where(BondYield.date >= start_date)
+    return query
+
+def previous_spreads_query(name, before, rows):
+    # the `rows` stored spreads before a date, newest first, the history a rolling window needs
+    return select(BondSpread.spread).where(BondSpread.name == name, BondSpread.date < before).order_by(BondSpread.date.desc()).limit(rows)
+
+def spread_query(countries, start_date, end_date):
+    # (days since epoch, name, spread, change, zscore), read off ix_bond_spread_name_date
+    query = select(epoch_days(BondSpread.date), BondSpread.name, BondSpread.spread, BondSpread.change, BondSpread.zscore)
+    if countries != "All":
+        query = query.where(BondSpread.name.in_(countries.split()))
+    if start_date != "All":
+        query = query.where(BondSpread.date >= start_date)
+    if end_date != "All":
+        query = query.where(BondSpread.date <= end_date)
+    return query
+
+def realtime_spread_query(countries, timeframe, max_rows):
+    query = select(BondSpreadRealtime.datetime, BondSpreadRealtime.name, BondSpreadRealtime.spread).where(BondSpreadRealtime.timeframe == timeframe)
+    if countries != "All":
+        query = query.where(BondSpreadRealtime.name.in_(countries.split()))
+    return query.order_by(BondSpreadRealtime.datetime.desc()).limit(max_rows)
@@ -0,0 +1,281 @@
+import os
+import numpy as np
+import pytz
+from sqlalchemy import select, func, text
+
+from extensions import db
+from models import BondYieldRealtime
+from utilities import timeframes
+
+##############################
+# SHARED REALTIME RING BUFFERS
+##############################
+
+# The newest bars of every asset and timeframe, kept in one memory mapped file (under /dev/shm, so
+# it never touches disk) that the realtime daemon writes and every gunicorn worker reads:
+#
+#   header   int64[8]          magic, assets, timeframes, rows, sequence, ready, epoch, overflow
+#   assets   int64[A]          asset id of each slot, 0 for a free slot
+#   counts   int64[A, T]       bars ever written to each ring, the newest is at (count - 1) % rows
+#   times    int64[A, T, rows] bar start, seconds since epoch in the wall clock time of the table
+#   closes   float64[A, T, rows]
+#
+# There is one writer. It makes the sequence odd while it writes and even again once done, and a
+# reader retries a copy that overlapped a write (a seqlock), so readers never take a lock. The
+# sequence restarts with every file, the random epoch create() writes tells two files apart. Once
+# more assets were seen than there are slots the overflow flag is set and readers fall back to SQL.
+
+REALTIME_STORE_PATH = os.environ.get("REALTIME_STORE_PATH", "/dev/shm/bond_yields_realtime")
+REALTIME_STORE_ROWS = int(os.environ.get("REALTIME_STORE_ROWS", 1024)) # bars per asset and timeframe
+REALTIME_STORE_ASSETS = 128
+
+MAGIC = 0x424f4e44
+HEADER_SIZE = 8
+MAGIC_FIELD, ASSETS_FIELD, TIMEFRAMES_FIELD, ROWS_FIELD, SEQUENCE_FIELD, READY_FIELD, EPOCH_FIELD, OVERFLOW_FIELD = range(8)
+TIMEFRAMES = sorted(timeframes.values())
+READ_RETRIES = 5
+
+def recent_bars_query(rows):
+    # the newest `rows` bars of every asset and timeframe, for warming the buffers
+    ranked = select(
+        BondYieldRealtime.asset_id,
+        BondYieldRealtime.timeframe,
+        BondYieldRealtime.datetime,
+        BondYieldRealtime.bond_yield,
+        func.row_number().over(
+            partition_by=(BondYieldRealtime.asset_id, BondYieldRealtime.timeframe),
+            order_by=BondYieldRealtime.datetime.desc(),
+        ).label("rank"),
+    ).subquery()
+    return select(ranked.c.asset_id, ranked.c.timeframe, ranked.c.datetime, ranked.c.bond_yield).where(
+        ranked.c.rank <= rows
+    ).order_by(ranked.c.datetime)
+
+def table_timezone():
+    # bond_yield_realtime has no time zone, PostgreSQL stores an aware tick converted to the session's
+    if db.engine.dialect.name != "postgresql":
+        return None
+    name = db.session.execute(text("SHOW TIME ZONE")).scalar()
+    try:
+        return pytz.timezone(name)
+    except pytz.UnknownTimeZoneError:
+        return pytz.utc
+
+def to_seconds(value, zone=None):
+    # the naive wall clock bond_yield_realtime ends up holding for value
+    if value.tzinfo is not None and zone is not None:
+        value = value.astimezone(zone)
+    return int(np.datetime64(value.replace(tzinfo=None), 's').astype(np.int64))
+
+class RealtimeStore():
+    '''
+    The ring buffers of REALTIME_STORE_PATH. The daemon calls create()/warm() once and push() after
+    every tick it commits; the app calls open() and latest() per request, which returns None when
+    the buffers cannot answer exactly and the caller should query the table instead.
+    '''
+
+    def __init__(self, path=REALTIME_STORE_PATH, rows=REALTIME_STORE_ROWS, assets=REALTIME_STORE_ASSETS):
+        self.path = path
+        self.rows = rows
+        self.assets = assets
+        self.inode = None
+        self.mapping = None
+        self.zone = None # set by the writer from table_timezone()
+
+    @staticmethod
+    def size(assets, rows):
+        timeframe_count = len(TIMEFRAMES)
+        return 8 * (HEADER_SIZE + assets + assets * timeframe_count + 2 * assets * timeframe_count * rows)
+
+    def map(self, mode):
+        self.mapping = np.memmap(self.path, dtype=np.int64, mode=mode)
+        self.header = self.mapping[:HEADER_SIZE]
+        assets, timeframe_count, rows = (int(self.header[field]) for field in (ASSETS_FIELD, TIMEFRAMES_FIELD, ROWS_FIELD))
+        if self.header[MAGIC_FIELD] != MAGIC or timeframe_count != len(TIMEFRAMES) or self.mapping.size * 8 != self.size(assets, rows):
+            self.mapping = None
+            return False
+
+        self.assets, self.rows = assets, rows
+        offset = HEADER_SIZE
+        self.asset_ids = self.mapping[offset:offset + assets]
+        offset += assets
+        self.counts = self.mapping[offset:offset + assets * timeframe_count].reshape(assets, timeframe_count)
+        offset += assets * timeframe_count
+        ring_size = assets * timeframe_count * rows
+        self.times = self.mapping[offset:offset + ring_size].reshape(assets, timeframe_count, rows)
+        offset += ring_size
+        self.closes = self.mapping[offset:offset + ring_size].view(np.float64).reshape(assets, timeframe_count, rows)
+        self.inode = os.stat(self.path).st_ino
+        return True
+
+    ##############################
+    # WRITER (realtime daemon)
+    ##############################
+
+    def create(self):
+        # a fresh file, swapped in whole so readers never map a half built one
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.truncate(self.size(self.assets, self.rows))
+        header = np.memmap(tmp_path, dtype=np.int64, mode='r+', shape=(HEADER_SIZE,))
+        epoch = int.from_bytes(os.urandom(8), 'little') >> 1
+        header[:] = [MAGIC, self.assets, len(TIMEFRAMES), self.rows, 0, 0, epoch, 0]
+        header.flush()
+        del header
+        os.replace(tmp_path, self.path)
+        self.map('r+')
+        return self
+
+    def begin(self):
+        self.header[SEQUENCE_FIELD] += 1
+
+    def end(self):
+        self.header[SEQUENCE_FIELD] += 1
+
+    def slot(self, asset_id):
+        found = np.flatnonzero(self.asset_ids == asset_id)
+        if len(found):
+            return int(found[0])
+        free = np.flatnonzero(self.asset_ids == 0)
+        if not len(free):
+            # the buffers no longer hold every asset, readers stop answering for all of them
+            self.header[OVERFLOW_FIELD] = 1
+            return None
+        self.asset_ids[free[0]] = asset_id
+        return int(free[0])
+
+    def append(self, asset_id, timeframe, seconds, close):
+        # a bar still being built is overwritten in place, an older bar than the newest is ignored
+        slot = self.slot(asset_id)
+        if slot is None:
+            return
+        column = TIMEFRAMES.index(timeframe)
+        count = int(self.counts[slot, column])
+        if count:
+            newest = (count - 1) % self.rows
+            if self.times[slot, column, newest] == seconds:
+                self.closes[slot, column, newest] = close
+                return
+            if self.times[slot, column, newest] > seconds:
+                return
+        position = count % self.rows
+        self.times[slot, column, position] = seconds
+        self.closes[slot, column, position] = close
+        self.counts[slot, column] = count + 1
+
+    def push(self, bar_rows):
+        # bar_rows as built by bonds_sync_realtime.build_tick_rows, after they were committed
+        self.begin()
+        try:
+            for row in bar_rows:
+                self.append(row['asset_id'], row['timeframe'], to_seconds(row['datetime'], self.zone), row['bond_yield'])
+        finally:
+            self.end()
+
+    def warm(self):
+        # refills every buffer from bond_yield_realtime, needs an app context
+        rows = db.session.execute(recent_bars_query(self.rows)).all()
+        self.begin()
+        try:
+            self.asset_ids[:] = 0
+            self.counts[:] = 0
+            self.header[OVERFLOW_FIELD] = 0
+            if rows:
+                asset_ids, bar_timeframes, bar_datetimes, bond_yields = zip(*rows)
+                asset_ids, bar_timeframes = np.array(asset_ids, dtype=np.int64), np.array(bar_timeframes, dtype=np.int64)
+                seconds = np.array(bar_datetimes, dtype='datetime64[s]').astype(np.int64)
+                bond_yields = np.array(bond_yields, dtype=float)
+                for asset_id in np.unique(asset_ids):
+                    slot = self.slot(int(asset_id))
+                    if slot is None:
+                        break
+                    for column, timeframe in enumerate(TIMEFRAMES):
+                        # oldest first, so the newest bar ends up at count - 1
+                        selected = (asset_ids == asset_id) & (bar_timeframes == timeframe)
+                        count = int(selected.sum())
+                        self.times[slot, column, :count] = seconds[selected]
+                        self.closes[slot, column, :count] = bond_yields[selected]
+                        # a full ring may have older bars in the table, counted as wrapped once so
+                        # latest() only answers from it while none of them is needed
+                        self.counts[slot, column] = count + self.rows if count == self.rows else count
+            self.header[READY_FIELD] = 1
+        finally:
+            self.end()
+
+    ##############################
+    # READERS (app workers)
+    ##############################
+
+    def open(self):
+        # maps the file read only, again whenever the daemon replaced it
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            self.mapping = None
+            return False
+        if self.mapping is None or inode != self.inode:
+            try:
+                return self.map('r')
+            except (OSError, ValueError):
+                self.mapping = None
+                return False
+        return True
+
+    @property
+    def version(self):
+        return int(self.header[SEQUENCE_FIELD])
+
+    @property
+    def epoch(self):
+        return int(self.header[EPOCH_FIELD])
+
+    def snapshot(self, asset_ids, timeframe):
+        # consistent copies of the rings of asset_ids (None for every asset) or None after a busy writer
+        column = TIMEFRAMES.index(timeframe)
+        for _ in range(READ_RETRIES):
+            sequence = self.version
+            if sequence % 2:
+                continue
+            slots = np.flatnonzero(self.asset_ids != 0) if asset_ids is None else np.flatnonzero(np.isin(self.asset_ids, asset_ids))
+            copy = (self.asset_ids[slots].copy(), self.counts[slots, column].copy(),
+                    self.times[slots, column].copy(), self.closes[slots, column].copy())
+            if self.version == sequence and self.header[READY_FIELD]:
+                return sequence, copy
+        return None, None
+
+    def latest(self, asset_ids, timeframe, max_rows):
+        '''
+        (version, datetimes, asset_ids, closes) of the max_rows newest bars across asset_ids, the same
+        rows as realtime_query. version is "epoch:sequence", unique across restarts of the writer. None
+        when the table may hold rows the buffers no longer do.
+        '''
+        if not self.open():
+            return None
+        sequence, copy = self.snapshot(asset_ids, timeframe)
+        if copy is None or self.header[OVERFLOW_FIELD]:
+            return None
+        version = f"{self.epoch}:{sequence}"
+        ids, counts, times, closes = copy
+
+        held = np.minimum(counts, self.rows)
+        valid = np.arange(self.rows) < held[:, None]
+        slot_of_row = np.broadcast_to(np.arange(len(ids))[:, None], valid.shape)[valid]
+        row_times, row_closes = times[valid], closes[valid]
+        if not len(row_times):
+            return None
+
+        if len(row_times) > max_rows:
+            newest = np.argpartition(-row_times, max_rows - 1)[:max_rows]
+            row_times, row_closes, slot_of_row = row_times[newest], row_closes[newest], slot_of_row[newest]
+            cutoff = row_times.min()
+        else:
+            cutoff = None
+
+        # a ring that wrapped has dropped its oldest bars, it answers only if none of them is needed
+        wrapped = counts > self.rows
+        if wrapped.any():
+            oldest = np.where(valid, times, np.iinfo(np.int64).max).min(axis=1)
+            if cutoff is None or (oldest[wrapped] > cutoff).any():
+                return None
+
+        return version, row_times.astype('datetime64[s]'), ids[slot_of_row], row_closes
@@ -0,0 +1,109 @@
+import json
+import os
+import time
+
+from parsers import loads
+
+##############################
+# CAPTURED PAGE SPOOL
+##############################
+
+# Captured historical rows the proxy persists when the sync is not listening on the handoff socket.
+# A spool is NDJSON and only ever appended to:
+#
+#   {"spool": 1, "id": "23801"}
+#   {"page": {"rows": 2}}
+#   {...row...}
+#   {...row...}
+#   {"footer": {"pages": 1, "rows": 2}}
+#
+# Each page costs one append however long the spool already is, and the proxy keeps the running
+# page and row counts for the footer. While the proxy is still paging the file is
+# {id}_PENDING.ndjson; the footer is written last and the file renamed to {id}_COMPLETE.ndjson.
+# A pending spool left by a crash is still readable up to its last whole line. A spool is only
+# deleted once every row of it is in the database; one that was not modified for
+# SPOOL_STALE_SECONDS is taken to be abandoned by the proxy.
+
+SPOOL_DIRECTORY = "/home/app/data"
+SPOOL_BATCH_ROWS = 5000
+SPOOL_STALE_SECONDS = 600
+
+def pending_path(_id, directory=SPOOL_DIRECTORY):
+    return os.path.join(directory, f"{_id}_PENDING.ndjson")
+
+def complete_path(_id, directory=SPOOL_DIRECTORY):
+    return os.path.join(directory, f"{_id}_COMPLETE.ndjson")
+
+def append_lines(path, lines, mode='ab'):
+    with open(path, mode) as file:
+        file.write(b"".join(json.dumps(line, separators=(',', ':')).encode() + b"\n" for line in lines))
+        file.flush()
+        os.fsync(file.fileno())
+
+def start_spool(_id, directory=SPOOL_DIRECTORY):
+    # a new capture replaces whatever an earlier one left behind
+    path = pending_path(_id, directory)
+    append_lines(path, [{"spool": 1, "id": str(_id)}], mode='wb')
+    return path
+
+def append_page(path, rows):
+    append_lines(path, [{"page": {"rows": len(rows)}}] + list(rows))
+
+def finish_spool(path, pages=None, rows=None):
+    # without the counts (a proxy restarted mid capture) they are taken from the page markers
+    if pages is None or rows is None:
+        pages = rows = 0
+        for page_rows in page_counts(path):
+            pages += 1
+            rows += page_rows
+    append_lines(path, [{"footer": {"pages": pages, "rows": rows}}])
+    completed = path.replace("_PENDING", "_COMPLETE")
+    os.replace(path, completed)
+    return completed
+
+def page_counts(path):
+    # page sizes from the page markers, without parsing the rows
+    with open(path, 'rb') as file:
+        for line in file:
+            if line.startswith(b'{"page":'):
+                yield json.loads(line)["page"]["rows"]
+
+def read_spool(path, batch_rows=SPOOL_BATCH_ROWS):
+    '''
+    Yields the rows of a spool in lists of up to batch_rows, one line at a time, so the whole
+    spool is never in memory. A truncated last line, from a crash mid-append, is skipped.
+    '''
+    batch = []
+    with open(path, 'rb') as file:
+        for line in file:
+            if not line.endswith(b"\n"):
+                break
+            if line.startswith((b'{"spool":', b'{"page":', b'{"footer":')):
+                continue
+            batch.append(loads(line))
+            if len(batch) >= batch_rows:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+def is_stale(path, min_age=SPOOL_STALE_SECONDS):
+    # no append for min_age seconds, the proxy is done with it or gone
+    return time.time() - os.path.getmtime(path) >= min_age
+
+def spool_id(path):
+    with open(path, 'rb') as file:
+        header = file.readline()
+    try:
+        return json.loads(header)["id"]
+    except (ValueError, KeyError):
+        return None
+
+def leftover_spools(directory=SPOOL_DIRECTORY):
+    # spools no sync consumed, complete or not
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, filename) for filename in os.listdir(directory)
+        if filename.endswith(("_PENDING.ndjson", "_COMPLETE.ndjson"))
+    )
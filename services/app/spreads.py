@@ -0,0 +1,137 @@
+import os
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy import func, delete
+
+from extensions import db
+from historical import HistoricalFrame, fetch_rows
+from models import Asset, BondSpread, unit_of_work
+from queries import spread_legs_query, previous_spreads_query, spread_query, realtime_spread_query
+
+##############################
+# 2Y-5Y SPREADS
+##############################
+
+# bond_spread holds the 5Y minus 2Y close of every country on the days both legs are stored, with
+# the day's change and a z-score against the trailing SPREAD_ZSCORE_DAYS spreads. write_series
+# recomputes a country from the first date it wrote, reading only SPREAD_ZSCORE_DAYS stored spreads
+# before that, so a daily append touches a handful of rows. bond_spread_realtime is written with
+# the realtime bars, one close per bar both legs were quoted in.
+
+SPREAD_PERIODS = (2, 5) # short leg, long leg
+SPREAD_FIELDS = ('spread', 'change', 'zscore')
+SPREAD_ZSCORE_DAYS = int(os.environ.get("SPREAD_ZSCORE_DAYS", 60))
+SPREAD_DECIMALS = 6 # quotes have at most 4, this only drops the float noise of the subtraction
+CHUNK_SIZE = 1000
+
+def spread_series(days, periods, closes):
+    # (days, long - short) on the days both legs have a close
+    short, long = periods == SPREAD_PERIODS[0], periods == SPREAD_PERIODS[1]
+    common, short_index, long_index = np.intersect1d(days[short], days[long], assume_unique=True, return_indices=True)
+    return common, np.round(closes[long][long_index] - closes[short][short_index], SPREAD_DECIMALS)
+
+def rolling_zscore(values, window):
+    # z-score of every value against the window ending at it, NaN until the window is full or flat
+    zscores = np.full(len(values), np.nan)
+    if window < 2 or len(values) < window:
+        return zscores
+    windows = sliding_window_view(values, window)
+    mean, std = windows.mean(axis=1), windows.std(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        zscores[window - 1:] = np.where(std > 0, (values[window - 1:] - mean) / std, np.nan)
+    return zscores
+
+def update_spreads(name, start_date=None, window=SPREAD_ZSCORE_DAYS):
+    '''
+    Recomputes the stored spreads of one country from start_date (everything when None) to its
+    last common date. Returns the number of rows written, the caller owns the transaction.
+    '''
+    # a day that lost one of its legs keeps no spread, so the range is cleared before it is rewritten
+    stale = delete(BondSpread).where(BondSpread.name == name)
+    if start_date is not None:
+        stale = stale.where(BondSpread.date >= start_date)
+    db.session.execute(stale)
+
+    rows = fetch_rows(spread_legs_query(name, SPREAD_PERIODS, start_date))
+    if not rows:
+        return 0
+    days, periods, closes = (np.array(column) for column in zip(*rows))
+    days, spreads = spread_series(days.astype(np.int64), periods.astype(np.int64), closes.astype(float))
+    if not len(days):
+        return 0
+
+    # the stored spreads before start_date feed the first change and z-scores
+    history = []
+    if start_date is not None:
+        history = db.session.execute(previous_spreads_query(name, start_date, max(window, 1))).scalars().all()[::-1]
+    values = np.concatenate([np.array(history, dtype=float), spreads])
+    changes = np.diff(values, prepend=np.nan)[len(history):]
+    zscores = rolling_zscore(values, window)[len(history):]
+
+    dates = days.astype('datetime64[D]').tolist()
+    nullable = lambda column: [None if value != value else value for value in column.tolist()]
+    columns = {'date': dates, 'name': [name] * len(dates), 'spread': spreads.tolist(), 'change': nullable(changes), 'zscore': nullable(zscores)}
+    for start in range(0, len(dates), CHUNK_SIZE):
+        BondSpread.upsert_many([{key: column[i] for key, column in columns.items()} for i in range(start, min(start + CHUNK_SIZE, len(dates)))])
+    return len(dates)
+
+def refresh_spreads(asset_id, changed_from):
+    # called by write_series once an asset's rows from changed_from on are written
+    asset = db.session.get(Asset, int(asset_id))
+    if asset is None or asset.period not in SPREAD_PERIODS:
+        return 0
+    with unit_of_work():
+        return update_spreads(asset.name, changed_from)
+
+def rebuild_spreads():
+    # every country with both legs from scratch, needs an app context
+    names = db.session.query(Asset.name).filter(Asset.period.in_(SPREAD_PERIODS)).group_by(Asset.name).having(
+        func.count(Asset.id) == len(SPREAD_PERIODS)
+    ).order_by(Asset.name)
+    written = 0
+    for (name,) in names.all():
+        with unit_of_work():
+            written += update_spreads(name)
+    return written
+
+def spread_bar_rows(bar_rows, labels):
+    # bond_spread_realtime rows for the bars of one tick, labels maps asset id -> (name, period)
+    legs = {}
+    for row in bar_rows:
+        name, period = labels[row['asset_id']]
+        if period in SPREAD_PERIODS:
+            legs.setdefault((row['datetime'], name, row['timeframe']), {})[period] = row['bond_yield']
+    short, long = SPREAD_PERIODS
+    return [
+        {'datetime': bar, 'name': name, 'timeframe': timeframe, 'spread': round(closes[long] - closes[short], SPREAD_DECIMALS)}
+        for (bar, name, timeframe), closes in legs.items() if len(closes) == len(SPREAD_PERIODS)
+    ]
+
+def spread_frame(dates, names, columns, fields):
+    # dense date x (country, field) matrix, columns maps each field to an array aligned with dates
+    unique_dates, row = np.unique(dates, return_inverse=True)
+    unique_names, column = np.unique(np.array(names, dtype=object), return_inverse=True)
+    labels = [(name, field) for name in unique_names.tolist() for field in fields]
+    values = np.full((len(unique_dates), len(labels)), np.nan)
+    for index, field in enumerate(fields):
+        values[row, column * len(fields) + index] = columns[field]
+    return HistoricalFrame(unique_dates, labels, values)
+
+def load_spread_frame(countries, start_date, end_date, fields):
+    rows = fetch_rows(spread_query(countries, start_date, end_date))
+    days, names, spreads, changes, zscores = zip(*rows) if rows else ((),) * 5
+    columns = {'spread': spreads, 'change': changes, 'zscore': zscores}
+    return spread_frame(
+        np.array(days, dtype=np.int64).astype('datetime64[D]'),
+        names,
+        {field: np.array(columns[field], dtype=float) for field in fields},
+        fields,
+    )
+
+def load_realtime_spread_frame(countries, timeframe, max_rows):
+    # None when no country has realtime spreads
+    rows = db.session.execute(realtime_spread_query(countries, timeframe, max_rows)).all()
+    if not rows:
+        return None
+    datetimes, names, spreads = zip(*rows)
+    return spread_frame(np.array(datetimes, dtype='datetime64[s]'), names, {'spread': np.array(spreads, dtype=float)}, ('spread',))
@@ -0,0 +1,202 @@
+from requests import RequestException
+
+from urllib.parse import urlparse
+import asyncio
+import logging
+import os
+import random
+import time
+import traceback
+
+from historical_api import HistoricalApiError
+from logging_config import write_to_logfile
+from metrics import get_registry
+
+##############################
+# DAILY SYNC PIPELINE
+##############################
+
+SYNC_CONCURRENCY = int(os.environ.get("SYNC_CONCURRENCY", 8))
+SYNC_RATE = float(os.environ.get("SYNC_RATE", 2)) # requests per second across all jobs
+SYNC_BURST = int(os.environ.get("SYNC_BURST", 4))
+SYNC_HOST_CONCURRENCY = int(os.environ.get("SYNC_HOST_CONCURRENCY", 4))
+SYNC_RETRIES = int(os.environ.get("SYNC_RETRIES", 4))
+SYNC_BACKOFF_SECONDS = 1.0
+SYNC_BACKOFF_CAP_SECONDS = 30.0
+
+RETRYABLE_ERRORS = (HistoricalApiError, RequestException)
+
+class TokenBucket():
+    '''
+    Allows `rate` acquisitions per second on average with bursts of up to `capacity`
+    '''
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class JobResult():
+
+    def __init__(self, country, year, window=None):
+        self.country = country
+        self.year = year
+        self.window = window # start of the backfilled window, None for a catch-up job
+        self.mode = None # api, browser or failed
+        self.rows = 0
+        self.attempts = 0
+        self.seconds = 0.0
+        self.error = None
+
+    def to_dict(self):
+        return {
+            "job": f"{self.country}_{self.year}",
+            "window": self.window.isoformat() if self.window else None,
+            "mode": self.mode,
+            "rows": self.rows,
+            "attempts": self.attempts,
+            "seconds": round(self.seconds, 3),
+            "error": self.error,
+        }
+
+class SyncReport():
+
+    def __init__(self, results, seconds):
+        self.results = results
+        self.seconds = seconds
+
+    def summary(self):
+        modes = {}
+        for result in self.results:
+            modes[result.mode] = modes.get(result.mode, 0) + 1
+        return {
+            "jobs": len(self.results),
+            "backfills": sum(1 for result in self.results if result.window),
+            "modes": modes,
+            "rows": sum(result.rows for result in self.results),
+            "attempts": sum(result.attempts for result in self.results),
+            "seconds": round(self.seconds, 3),
+        }
+
+class SyncPipeline():
+    '''
+    Runs every country/tenor job of a daily sync concurrently. Jobs whose instrument id is known
+    page through the historical API; all page requests share one token bucket and a per-host cap,
+    and failed pages are retried with jittered exponential backoff. Jobs without an id, or whose
+    API fetch keeps failing, fall back to the browser path on a worker thread, where the browser
+    pool bounds how many run at once. run() returns a SyncReport once every job has finished.
+    '''
+
+    def __init__(self, historical_client, browser_pool, concurrency=SYNC_CONCURRENCY, rate=SYNC_RATE,
+                 burst=SYNC_BURST, host_concurrency=SYNC_HOST_CONCURRENCY, retries=SYNC_RETRIES,
+                 backoff=SYNC_BACKOFF_SECONDS, metrics=None):
+        self.historical_client = historical_client
+        self.browser_pool = browser_pool
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.host_concurrency = host_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.metrics = metrics or get_registry("daily_sync")
+
+    def backoff_seconds(self, attempt):
+        # full jitter, so jobs that failed together do not retry together
+        return random.uniform(0, min(SYNC_BACKOFF_CAP_SECONDS, self.backoff * 2 ** attempt))
+
+    async def fetch_page(self, result, instrument_id, start_date, end_date):
+        host = urlparse(self.historical_client.base_url).netloc
+        host_slots = self.host_slots.setdefault(host, asyncio.Semaphore(self.host_concurrency))
+        for attempt in range(self.retries + 1):
+            result.attempts += 1
+            try:
+                async with host_slots:
+                    await self.bucket.acquire()
+                    return await asyncio.to_thread(self.historical_client.fetch_page, instrument_id, start_date, end_date)
+            except RETRYABLE_ERRORS:
+                if attempt == self.retries:
+                    raise
+                self.metrics.increment("page_retries")
+                await asyncio.sleep(self.backoff_seconds(attempt))
+
+    async def fetch(self, result, instrument_id, start_date, end_date=None):
+        start_date, end_date = self.historical_client.date_range(start_date, end_date)
+        pages = []
+        while start_date:
+            page = await self.fetch_page(result, instrument_id, start_date, end_date)
+            if not page:
+                break
+            pages.append(page)
+            start_date = self.historical_client.next_start(page, end_date)
+        return self.historical_client.assemble(pages)
+
+    async def run_api(self, job, result):
+        instrument_id = job.known_instrument_id() if self.historical_client else None
+        if not instrument_id:
+            return False
+
+        job._id = instrument_id
+        start_date = job.new_from_date.strftime('%Y-%m-%d') if job.new_from_date else None
+        end_date = job.new_to_date.strftime('%Y-%m-%d') if job.new_to_date else None
+        try:
+            items = await self.fetch(result, instrument_id, start_date, end_date)
+        except RETRYABLE_ERRORS as e:
+            write_to_logfile(job._id, f"(API) falling back to the browser: {e}")
+            return False
+
+        if items:
+            await asyncio.to_thread(job.write_payload, items)
+        result.mode = "api"
+        result.rows = len(items)
+        return True
+
+    async def run_job(self, job):
+        result = JobResult(job.country, job.year, job.new_from_date if job.backfill else None)
+        start = time.perf_counter()
+        try:
+            async with self.job_slots:
+                done = await self.run_api(job, result)
+            if not done and job.backfill:
+                # the browser path always resumes from the watermark, it cannot fetch a window
+                raise HistoricalApiError(f"{job.country}_{job.year}: backfill needs the historical API")
+            if not done:
+                # browser jobs queue on their own slots so they never hold up the API jobs
+                async with self.browser_slots:
+                    await asyncio.to_thread(job.run_main_thread, self.browser_pool)
+                result.mode = "browser"
+        except Exception as e:
+            result.mode = "failed"
+            result.error = str(e)
+            logging.error(traceback.format_exc())
+        result.seconds = time.perf_counter() - start
+        self.metrics.observe("job_seconds", result.seconds)
+        self.metrics.increment(f"jobs_{result.mode}")
+        return result
+
+    async def run(self, jobs):
+        # created here so they belong to the running event loop
+        self.bucket = TokenBucket(self.rate, self.burst)
+        self.job_slots = asyncio.Semaphore(self.concurrency)
+        self.browser_slots = asyncio.Semaphore(self.browser_pool.size)
+        self.host_slots = {}
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(self.run_job(job) for job in jobs))
+        report = SyncReport(list(results), time.perf_counter() - start)
+
+        self.metrics.observe("sync_seconds", report.seconds)
+        self.metrics.flush()
+        return report
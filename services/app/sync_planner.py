@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta, date
+import json
+import os
+
+from queries import watermarks_query
+
+##############################
+# DAILY SYNC PLANNING
+##############################
+
+# The planner reads the newest stored date of every series in one query and turns it into the
+# list of fetches the daily sync has to make. The same watermarks are written to WATERMARKS_PATH
+# for the proxy addon, which then answers "where does this instrument resume" without a query:
+#
+#   {"generated": "2024-01-05T06:00:00", "series": [
+#       {"asset_id": 3, "name": "spain", "period": 5, "ref_id": 23801, "latest_date": "2024-01-04"}, ...]}
+
+WATERMARKS_PATH = "/home/app/data/watermarks.json"
+PERIODS = ('2', '5')
+
+class PlannedJob():
+
+    def __init__(self, country, year, from_date, to_date, kind="catch_up", asset_id=None):
+        self.country = country
+        self.year = year
+        self.from_date = from_date # None when nothing is stored yet, the fetch starts at the first date
+        self.to_date = to_date
+        self.kind = kind # catch_up from the watermark, or backfill of a hole found by gap_scan
+        self.asset_id = asset_id
+
+    @property
+    def backfill(self):
+        return self.kind == "backfill"
+
+    def to_dict(self):
+        return {
+            "job": f"{self.country}_{self.year}",
+            "kind": self.kind,
+            "from_date": self.from_date.isoformat() if self.from_date else None,
+            "to_date": self.to_date.isoformat(),
+        }
+
+def series_watermarks():
+    # {(name, period): {...}} for every asset, needs an app context
+    watermarks = {}
+    for asset_id, name, period, latest_date, ref_id in watermarks_query():
+        watermarks[(name, period)] = {
+            "asset_id": asset_id,
+            "name": name,
+            "period": period,
+            "ref_id": ref_id,
+            "latest_date": latest_date,
+        }
+    return watermarks
+
+def plan_jobs(countries_list, watermarks, today=None, periods=PERIODS):
+    '''
+    One job per country and tenor that is behind, fetching from the day after its watermark up to
+    today. A series with no rows is fetched from the start.
+    '''
+    today = today or datetime.now().date()
+    jobs = []
+    for country in countries_list:
+        for year in periods:
+            latest_date = watermarks.get((country, int(year)), {}).get("latest_date")
+            if not latest_date or latest_date + timedelta(days=1) < today:
+                from_date = latest_date + timedelta(days=1) if latest_date else None
+                jobs.append(PlannedJob(country, year, from_date, today))
+    return jobs
+
+def save_watermarks(watermarks, path=WATERMARKS_PATH):
+    series = [
+        dict(entry, latest_date=entry["latest_date"].isoformat() if entry["latest_date"] else None)
+        for entry in watermarks.values()
+    ]
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump({"generated": datetime.now().isoformat(timespec='seconds'), "series": series}, file)
+    os.replace(tmp_path, path)
+
+class WatermarkCache():
+    '''
+    The proxy's view of WATERMARKS_PATH, reloaded whenever the planner rewrites the file.
+    latest_date() raises LookupError while there is no file, so the caller can fall back to the
+    database, and returns None for an instrument the file does not know.
+    '''
+
+    def __init__(self, path=WATERMARKS_PATH):
+        self.path = path
+        self.mtime = None
+        self.by_ref_id = {}
+
+    def reload(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            self.mtime = None
+            self.by_ref_id = {}
+            return False
+        if mtime != self.mtime:
+            try:
+                with open(self.path, 'r') as file:
+                    series = json.load(file)["series"]
+            except (OSError, ValueError, KeyError):
+                return self.mtime is not None
+            self.by_ref_id = {
+                str(entry["ref_id"]): date.fromisoformat(entry["latest_date"])
+                for entry in series if entry.get("ref_id") and entry.get("latest_date")
+            }
+            self.mtime = mtime
+        return True
+
+    def latest_date(self, ref_id):
+        if not self.reload():
+            raise LookupError(f"no watermarks at {self.path}")
+        return self.by_ref_id.get(str(ref_id))
@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# the app modules are flat and import each other by name, as they do when run from services/app;
+# the benchmarks keep the implementations they replaced, which some tests compare against
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(APP_DIR, "benchmarks"))
+sys.path.insert(0, APP_DIR)
+
+# Without a DATABASE_URL the suite runs against a throwaway SQLite file, and nothing it writes
+# (response cache, ring buffers, archive) leaves a temporary directory. Set DATABASE_URL to a
+# PostgreSQL database for the query plan checks; the SQLite tests skip then.
+SCRATCH_DIR = tempfile.mkdtemp(prefix="bond_yields_tests_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{SCRATCH_DIR}/tests.db")
+os.environ.setdefault("RESPONSE_CACHE_BACKEND", "memory")
+os.environ.setdefault("REALTIME_STORE_PATH", os.path.join(SCRATCH_DIR, "realtime_store"))
+os.environ.setdefault("HISTORICAL_ARCHIVE_DIR", os.path.join(SCRATCH_DIR, "archive"))
+
+@pytest.fixture
+def sqlite_db():
+    '''
+    An app context over an empty SQLite database with the current schema, created the way
+    create_db creates a fresh one. Skipped when DATABASE_URL points anywhere else.
+    '''
+    from app import app
+    from extensions import db
+
+    with app.app_context():
+        if db.engine.dialect.name != "sqlite":
+            pytest.skip("needs the SQLite test database")
+        db.drop_all()
+        result = app.test_cli_runner().invoke(args=["create_db"])
+        assert result.exit_code == 0, result.output
+        yield db
+        db.session.rollback()
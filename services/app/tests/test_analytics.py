@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+from analytics import rolling_stat, correlation, changes, ANALYTICS_MIN_FRACTION
+
+WINDOW = 20
+
+def yield_matrix(days=400, columns=6):
+    # random walks with holes, some columns starting late, the way the matrix holds series
+    rng = np.random.default_rng(0)
+    values = np.round(3 + np.cumsum(rng.normal(0, 0.05, (days, columns)), axis=0), 3)
+    values[rng.random(values.shape) < 0.05] = np.nan
+    values[:150, 1] = np.nan
+    values[:, 2] += 1000 # long levels, the sums must stay centred
+    return values
+
+def test_rolling_std_matches_pandas():
+    values = yield_matrix()
+    min_periods = max(2, int(np.ceil(WINDOW * ANALYTICS_MIN_FRACTION)))
+    expected = pd.DataFrame(values).rolling(WINDOW, min_periods=min_periods).std().values
+    assert np.allclose(rolling_stat(values, 'std', WINDOW), expected, equal_nan=True)
+
+def test_correlation_of_changes_matches_pandas():
+    values = yield_matrix()
+    expected = pd.DataFrame(values).apply(lambda column: column.dropna().diff()).corr().values
+    assert np.allclose(correlation(changes(values)), expected, equal_nan=True)
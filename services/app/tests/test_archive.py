@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from archive import HistoricalArchive, refresh_archive
+from extensions import db
+from historical import load_frame, pivot
+from ingest import write_series
+from models import Asset
+from queries import asset_generations_query
+
+COUNTRIES = "italy spain"
+
+def seed():
+    rng = np.random.default_rng(0)
+    dates = np.datetime64('2009-06-01') + np.arange(900)
+    for name in COUNTRIES.split():
+        for period in (2, 5):
+            asset = Asset.get_or_create(name=name, period=period)
+            db.session.commit()
+            # every series has its own holes
+            keep = rng.random(len(dates)) > 0.1
+            write_series(asset.id, 0, {'date': dates[keep], 'bond_yield': np.round(rng.normal(3, 0.5, keep.sum()), 3)})
+
+def generations():
+    return {asset_id: (value or 0, changed_from) for asset_id, value, changed_from in asset_generations_query(COUNTRIES)}
+
+@pytest.mark.parametrize("start_date, end_date", [("All", "All"), ("2010-01-01", "2010-12-31")])
+def test_archive_frame_matches_database(sqlite_db, tmp_path, start_date, end_date):
+    seed()
+    assert len(refresh_archive(str(tmp_path), COUNTRIES)) == 4
+    archive = HistoricalArchive(str(tmp_path))
+    assert archive.covers(generations())
+
+    expected = load_frame(COUNTRIES, start_date, end_date)
+    frame = pivot(*archive.columns(generations(), start_date, end_date))
+    assert frame.labels == expected.labels
+    assert np.array_equal(frame.dates, expected.dates)
+    assert np.array_equal(frame.values, expected.values, equal_nan=True)
+
+def test_written_asset_is_no_longer_covered(sqlite_db, tmp_path):
+    seed()
+    refresh_archive(str(tmp_path), COUNTRIES)
+    asset = Asset.get_or_create(name="spain", period=5)
+    write_series(asset.id, 0, {'date': np.array(['2012-01-02'], dtype='datetime64[D]'), 'bond_yield': np.array([9.0])})
+    assert not HistoricalArchive(str(tmp_path)).covers(generations())
+    # and only that asset is archived again
+    assert refresh_archive(str(tmp_path), COUNTRIES) == [asset.id]
@@ -0,0 +1,74 @@
+from datetime import date
+
+import numpy as np
+
+from bench_gaps import loop_missing, make_series
+from gap_scan import scan_gaps, plan_backfill, mark_checked, load_checked, business_days, missing_runs, merge_windows, to_day
+
+WATERMARKS = {("spain", 5): {"asset_id": 3, "name": "spain", "period": 5}}
+
+def days_between(first, last, holes=()):
+    # business days from first to last (ISO dates) without the [from, to] holes
+    days = business_days(to_day(first), to_day(last))
+    for start, end in holes:
+        days = days[(days < to_day(start)) | (days > to_day(end))]
+    return days
+
+def scan(days, checked=None):
+    return scan_gaps(WATERMARKS, {3: days}, checked=checked or {})[0]
+
+def test_full_series_has_no_windows():
+    entry = scan(days_between("2024-01-01", "2024-03-29"))
+    assert (entry["missing"], entry["coverage"], entry["windows"]) == (0, 1.0, [])
+    assert entry["first_date"] == date(2024, 1, 1)
+
+def test_weekends_are_not_holes():
+    # Friday to Monday
+    _, starts, _, _ = missing_runs(np.array([to_day("2024-01-05"), to_day("2024-01-08")]))
+    assert len(starts) == 0
+
+def test_hole_becomes_a_window():
+    entry = scan(days_between("2024-01-01", "2024-03-29", holes=[("2024-02-05", "2024-02-14")]))
+    assert entry["missing"] == 8
+    assert entry["windows"] == [(date(2024, 2, 5), date(2024, 2, 14))]
+    assert entry["coverage"] == round(1 - 8 / entry["business_days"], 4)
+
+def test_short_runs_are_holidays():
+    # a single missing day is below GAP_MIN_DAYS, it counts as missing but is not fetched
+    entry = scan(days_between("2024-01-01", "2024-03-29", holes=[("2024-01-15", "2024-01-15")]))
+    assert (entry["missing"], entry["windows"]) == (1, [])
+
+def test_neighbouring_holes_share_a_window():
+    starts = np.array([to_day("2024-01-08"), to_day("2024-01-29"), to_day("2024-06-03")])
+    ends = starts + 3
+    assert merge_windows(starts, ends, np.full(3, 4), min_days=3, merge_days=31) == [
+        (to_day("2024-01-08"), to_day("2024-02-01")),
+        (to_day("2024-06-03"), to_day("2024-06-06")),
+    ]
+
+def test_checked_windows_count_as_closed(tmp_path):
+    days = days_between("2024-01-01", "2024-03-29", holes=[("2024-02-05", "2024-02-14")])
+    path = str(tmp_path / "gap_checked.json")
+    mark_checked([(3, date(2024, 2, 5), date(2024, 2, 14))], path)
+    assert load_checked(path) == {"3": [["2024-02-05", "2024-02-14"]]}
+
+    entry = scan(days, checked=load_checked(path))
+    assert (entry["missing"], entry["closed"], entry["coverage"], entry["windows"]) == (0, 8, 1.0, [])
+
+def test_plan_backfill_worst_coverage_first():
+    report = [
+        {"asset_id": 1, "name": "italy", "period": 2, "coverage": 0.99, "windows": [(date(2024, 1, 8), date(2024, 1, 10))]},
+        {"asset_id": 2, "name": "spain", "period": 5, "coverage": 0.5,
+         "windows": [(date(2023, 1, 2), date(2023, 6, 30)), (date(2023, 9, 4), date(2023, 9, 8))]},
+    ]
+    jobs = plan_backfill(report, max_jobs=2)
+    assert [(job.country, job.year, job.from_date, job.to_date, job.kind, job.asset_id) for job in jobs] == [
+        ("spain", "5", date(2023, 1, 2), date(2023, 6, 30), "backfill", 2),
+        ("spain", "5", date(2023, 9, 4), date(2023, 9, 8), "backfill", 2),
+    ]
+    assert len(plan_backfill(report)) == 3
+
+def test_scan_matches_per_day_loop():
+    stored_days, watermarks = make_series(assets=20, years=5)
+    for entry in scan_gaps(watermarks, stored_days, checked={}):
+        assert entry["missing"] == loop_missing(stored_days[entry["asset_id"]]), entry["asset_id"]
@@ -0,0 +1,31 @@
+import pytest
+
+from historical_api import HistoricalClient
+from stub_upstream import serve, load_payload, DEFAULT_PAYLOAD
+
+INSTRUMENT_ID = "23801"
+
+@pytest.fixture(scope="module")
+def payload():
+    return load_payload(DEFAULT_PAYLOAD)
+
+def fetch(payload, page_rows, **dates):
+    server = serve({INSTRUMENT_ID: payload}, page_rows=page_rows)
+    client = HistoricalClient(base_url=f"http://127.0.0.1:{server.server_port}/api/financialdata/historical", page_rows=page_rows, retries=0)
+    try:
+        return client.fetch(INSTRUMENT_ID, **dates)
+    finally:
+        client.session.close()
+        server.shutdown()
+
+@pytest.mark.parametrize("page_rows", [5000, 1000, 777])
+def test_pages_join_into_the_payload(payload, page_rows):
+    rows = fetch(payload, page_rows, end_date="2099-12-31")
+    # oldest first, every row once
+    assert [row["rowDateTimestamp"] for row in rows] == [row["rowDateTimestamp"] for row in reversed(payload["data"])]
+
+def test_date_range_is_respected(payload):
+    rows = fetch(payload, 1000, start_date="2010-01-01", end_date="2010-12-31")
+    dates = [row["rowDateTimestamp"][:10] for row in rows]
+    assert dates == sorted(dates) and dates[0] >= "2010-01-01" and dates[-1] <= "2010-12-31"
+    assert len(dates) == len([row for row in payload["data"] if "2010-01-01" <= row["rowDateTimestamp"][:10] <= "2010-12-31"])
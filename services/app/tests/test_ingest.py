@@ -0,0 +1,121 @@
+import datetime
+
+import numpy as np
+
+from bench_payload import dataframe_parse
+from extensions import db
+from ingest import write_series, normalise_series, rollup_rows, parse_payload, PAYLOAD_FIELDS
+from models import Asset, BondYield, BondYieldRollup
+from stub_upstream import DEFAULT_PAYLOAD
+
+def create_asset(name="spain", period=2):
+    asset = Asset.get_or_create(name=name, period=period)
+    db.session.commit()
+    return asset.id
+
+def stored(asset_id):
+    return [
+        (row.date, row.bond_yield, row.high)
+        for row in BondYield.query.filter_by(asset_id=asset_id).order_by(BondYield.date)
+    ]
+
+def test_normalise_series_sorts_and_keeps_last_repeat():
+    series = normalise_series({
+        'date': np.array(['2024-01-03', '2024-01-02', '2024-01-03'], dtype='datetime64[D]'),
+        'bond_yield': np.array([1.0, 2.0, 3.0]),
+    })
+    assert series['date'].tolist() == [datetime.date(2024, 1, 2), datetime.date(2024, 1, 3)]
+    assert series['bond_yield'].tolist() == [2.0, 3.0]
+
+def test_repeated_dates_in_one_chunk_keep_the_last(sqlite_db):
+    asset_id = create_asset()
+    dates = np.array(['2024-01-02', '2024-01-03', '2024-01-02'], dtype='datetime64[D]')
+    assert write_series(asset_id, 1, {'date': dates, 'bond_yield': np.array([1.0, 2.0, 1.5])}) == 2
+    assert [(date, close) for date, close, _ in stored(asset_id)] == [
+        (datetime.date(2024, 1, 2), 1.5),
+        (datetime.date(2024, 1, 3), 2.0),
+    ]
+
+def test_chunks_smaller_than_the_series(sqlite_db):
+    asset_id = create_asset()
+    dates = np.datetime64('2024-01-01') + np.arange(25)
+    closes = np.round(np.linspace(3, 4, 25), 3)
+    assert write_series(asset_id, 1, {'date': dates, 'bond_yield': closes}, chunk_size=7) == 25
+    rows = stored(asset_id)
+    assert [date for date, _, _ in rows] == dates.tolist()
+    assert [close for _, close, _ in rows] == closes.tolist()
+
+def test_rewriting_a_series_overwrites_it(sqlite_db):
+    asset_id = create_asset()
+    dates = np.datetime64('2024-01-01') + np.arange(10)
+    write_series(asset_id, 1, {'date': dates, 'bond_yield': np.full(10, 3.0)}, chunk_size=4)
+    write_series(asset_id, 1, {'date': dates[5:], 'bond_yield': np.full(5, 4.0)}, chunk_size=4)
+    assert [close for _, close, _ in stored(asset_id)] == [3.0] * 5 + [4.0] * 5
+
+def test_nan_becomes_null(sqlite_db):
+    asset_id = create_asset()
+    dates = np.array(['2024-01-02', '2024-01-03'], dtype='datetime64[D]')
+    write_series(asset_id, 1, {'date': dates, 'bond_yield': np.array([3.0, 3.1]), 'high': np.array([np.nan, 3.2])})
+    assert [high for _, _, high in stored(asset_id)] == [None, 3.2]
+
+##############################
+# WEEKLY/MONTHLY ROLLUPS
+##############################
+
+def rollups(asset_id, resolution):
+    return {
+        row.date: (row.open, row.high, row.low, row.bond_yield, row.first_date, row.last_date)
+        for row in BondYieldRollup.query.filter_by(asset_id=asset_id, resolution=resolution)
+    }
+
+def test_rollup_rows_aggregate_each_period():
+    dates = np.array(['2024-01-29', '2024-01-31', '2024-02-01', '2024-02-05'], dtype='datetime64[D]')
+    series = {'date': dates, 'bond_yield': np.array([3.0, 3.2, 3.1, 3.4]), 'high': np.array([3.5, np.nan, 3.3, 3.6])}
+    weeks = rollup_rows(7, series, 'W')
+    assert [(row['date'], row['open'], row['high'], row['low'], row['bond_yield']) for row in weeks] == [
+        (datetime.date(2024, 1, 29), 3.0, 3.5, 3.0, 3.1),
+        (datetime.date(2024, 2, 5), 3.4, 3.6, 3.4, 3.4),
+    ]
+    months = rollup_rows(7, series, 'M')
+    assert [(row['date'], row['first_date'], row['last_date']) for row in months] == [
+        (datetime.date(2024, 1, 1), datetime.date(2024, 1, 29), datetime.date(2024, 1, 31)),
+        (datetime.date(2024, 2, 1), datetime.date(2024, 2, 1), datetime.date(2024, 2, 5)),
+    ]
+
+def test_rollups_span_chunk_boundaries(sqlite_db):
+    asset_id = create_asset()
+    dates = np.datetime64('2024-01-01') + np.arange(60)
+    closes = np.round(3 + np.sin(np.arange(60)) / 10, 4)
+    write_series(asset_id, 1, {'date': dates, 'bond_yield': closes}, chunk_size=9)
+    january = rollups(asset_id, 'M')[datetime.date(2024, 1, 1)]
+    assert january == (closes[0], closes[:31].max(), closes[:31].min(), closes[30], datetime.date(2024, 1, 1), datetime.date(2024, 1, 31))
+
+def test_correction_narrows_monthly_bar(sqlite_db):
+    asset_id = create_asset()
+    dates = np.datetime64('2024-03-01') + np.arange(20)
+    closes = np.full(20, 3.0)
+    highs, lows = closes + 0.1, closes - 0.1
+    highs[10], lows[12] = 9.9, 0.1 # bad ticks
+    write_series(asset_id, 1, {'date': dates, 'bond_yield': closes, 'high': highs, 'low': lows})
+    assert rollups(asset_id, 'M')[datetime.date(2024, 3, 1)][1:3] == (9.9, 0.1)
+
+    # the corrected days come in again on their own
+    corrected = dates[[10, 12]]
+    write_series(asset_id, 1, {'date': corrected, 'bond_yield': np.full(2, 3.0), 'high': np.full(2, 3.1), 'low': np.full(2, 2.9)})
+    assert rollups(asset_id, 'M')[datetime.date(2024, 3, 1)][1:3] == (3.1, 2.9)
+    week = rollups(asset_id, 'W')[datetime.date(2024, 3, 11)]
+    assert week[1:3] == (3.1, 2.9)
+
+##############################
+# HISTORICAL API PAYLOADS
+##############################
+
+def test_parse_payload_matches_dataframe_parse():
+    with open(DEFAULT_PAYLOAD, 'rb') as file:
+        content = file.read()
+    body = content[content.index(b'{'):]
+    columns, expected = parse_payload(body), dataframe_parse(body)
+    assert len(columns['date']) == 5000
+    assert np.array_equal(columns['date'], expected['date'].astype('datetime64[D]'))
+    for name in PAYLOAD_FIELDS:
+        assert np.allclose(columns[name], expected[name], equal_nan=True), name
@@ -0,0 +1,32 @@
+from sqlalchemy import inspect
+
+from app import app
+from migrations import MIGRATIONS, applied_migrations, explain_targets, run_migrations
+
+def declared_indexes(table):
+    return {index.name for index in table.indexes}
+
+def test_create_db_stamps_every_migration(sqlite_db):
+    assert applied_migrations() == {name for name, _ in MIGRATIONS}
+    # nothing is pending, so running them again changes nothing
+    run_migrations()
+    assert applied_migrations() == {name for name, _ in MIGRATIONS}
+
+def test_create_db_is_idempotent(sqlite_db):
+    result = app.test_cli_runner().invoke(args=["create_db"])
+    assert result.exit_code == 0, result.output
+    assert applied_migrations() == {name for name, _ in MIGRATIONS}
+
+def test_declared_indexes_exist(sqlite_db):
+    inspector = inspect(sqlite_db.engine)
+    for table in sqlite_db.Model.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        assert declared_indexes(table) <= existing, table.name
+
+def test_query_plan_indexes_are_declared(sqlite_db):
+    # every index the PostgreSQL plan check accepts (other than a primary key) has to exist
+    inspector = inspect(sqlite_db.engine)
+    existing = {index["name"] for table in inspector.get_table_names() for index in inspector.get_indexes(table)}
+    for description, _, index_names in explain_targets():
+        names = [name for name in index_names if not name.endswith("_pkey")]
+        assert names and set(names) <= existing, description
@@ -0,0 +1,47 @@
+import os
+
+from lxml import html
+from selenium.common.exceptions import NoSuchElementException
+
+from bonds_sync_daily import BondSync
+from parsers import parse_realtime_rows
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fixtures", "world_government_bonds.html")
+
+class FakeElement():
+    # the slice of the WebDriver element API extract_rows_webdriver uses, over an lxml tree
+
+    def __init__(self, element):
+        self.element = element
+
+    @property
+    def text(self):
+        # rendered text, whitespace collapsed the way the browser does
+        return " ".join(self.element.text_content().split())
+
+    def find_elements(self, by, xpath):
+        return [FakeElement(found) for found in self.element.xpath(xpath)]
+
+    def find_element(self, by, xpath):
+        found = self.find_elements(by, xpath)
+        if not found:
+            raise NoSuchElementException(xpath)
+        return found[0]
+
+def read_fixture():
+    with open(FIXTURE_PATH, 'r', encoding='utf-8') as file:
+        return file.read()
+
+def test_lxml_matches_webdriver_walk():
+    page_source = read_fixture()
+    expected = BondSync.extract_rows_webdriver(FakeElement(html.fromstring(page_source)))
+    assert parse_realtime_rows(page_source) == expected
+
+def test_fixture_rows():
+    rows = parse_realtime_rows(read_fixture())
+    # 35 countries, one 2Y and one 5Y row each
+    assert len(rows) == 70
+    assert [name for name, _, _ in rows[:2]] == ["Australia 2Y", "Australia 5Y"]
+    assert {status for _, _, status in rows} == {"open", "closed"}
+    for _, last, _ in rows:
+        float(last)
@@ -0,0 +1,47 @@
+# Partition maintenance of bond_yield_realtime, which is only partitioned on PostgreSQL. Everything
+# runs in one transaction that is rolled back, the DDL included.
+# Usage: DATABASE_URL=postgresql://... python -m pytest tests/test_partitions.py
+
+import datetime
+import os
+
+import pytest
+
+if not os.environ.get("DATABASE_URL", "").startswith("postgresql"):
+    pytest.skip("bond_yield_realtime is only partitioned on PostgreSQL", allow_module_level=True)
+
+from sqlalchemy import text
+
+from app import app
+from extensions import db
+from partitions import DEFAULT_PARTITION, ensure_partitions, partitions
+
+@pytest.fixture
+def connection():
+    with app.app_context():
+        result = app.test_cli_runner().invoke(args=["create_db"])
+        assert result.exit_code == 0, result.output
+        with db.engine.connect() as connection:
+            transaction = connection.begin()
+            yield connection
+            transaction.rollback()
+
+def insert_bar(connection, when):
+    asset_id = connection.execute(text("INSERT INTO asset (name, period) VALUES ('partition test', 2) RETURNING id")).scalar()
+    connection.execute(text("""
+        INSERT INTO bond_yield_realtime (datetime, asset_id, timeframe, open, high, low, bond_yield, is_open, is_close)
+        VALUES (:when, :asset_id, 1, 3, 3, 3, 3, 1, 0)
+    """), {"when": when, "asset_id": asset_id})
+
+def test_old_rows_leave_the_default_partition(connection):
+    # a month long before anything ensure_partitions creates going forward
+    insert_bar(connection, datetime.datetime(2001, 5, 3, 10, 30))
+    assert connection.execute(text(f"SELECT count(*) FROM {DEFAULT_PARTITION}")).scalar() == 1
+
+    created = ensure_partitions(connection, datetime.datetime.now(), 1)
+    assert "bond_yield_realtime_p2001_05" in created
+    assert "bond_yield_realtime_p2001_05" in partitions(connection)
+    assert connection.execute(text(f"SELECT count(*) FROM {DEFAULT_PARTITION}")).scalar() == 0
+    assert connection.execute(text("SELECT count(*) FROM bond_yield_realtime_p2001_05")).scalar() == 1
+    # nothing is left to move the next time
+    assert ensure_partitions(connection, datetime.datetime.now(), 1) == []
@@ -0,0 +1,147 @@
+# Drives proxy_script.CaptureAuthHeader with synthetic mitmproxy flows: a captured historical request
+# is answered page by page from synthetic rows and the replays the addon asks for are fed back
+# through it. A HandoffServer stands in for the daily sync; without one the addon spools to tmp_path.
+
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+tflow = pytest.importorskip("mitmproxy.test.tflow")
+tutils = pytest.importorskip("mitmproxy.test.tutils")
+
+import proxy_script
+from handoff import HandoffServer, HandoffClient
+from spool import read_spool, complete_path, pending_path, page_counts
+
+INSTRUMENT_ID = "23801"
+PAGE_ROWS = 5000 # investing.com answers with at most this many rows
+
+def make_rows(count):
+    # newest first, shaped like the rows of notebooks/23801_spain_5.txt
+    first = datetime(2000, 1, 1)
+    rows = []
+    for day in range(count):
+        date = first + timedelta(days=day)
+        close = 3 + (day % 200) / 100
+        rows.append({
+            "rowDate": date.strftime("%b %d, %Y"),
+            "rowDateTimestamp": date.strftime("%Y-%m-%dT00:00:00Z"),
+            "last_close": f"{close:.3f}",
+            "last_open": f"{close - 0.01:.3f}",
+            "last_max": f"{close + 0.02:.3f}",
+            "last_min": f"{close - 0.02:.3f}",
+            "change_precentRaw": 0.1,
+        })
+    return rows[::-1]
+
+def page_for(rows, start_date):
+    # the endpoint answers with at most PAGE_ROWS rows from the start of the range, newest first
+    in_range = [row for row in rows if row["rowDateTimestamp"][:10] >= start_date]
+    return in_range[-PAGE_ROWS:]
+
+def make_flow(start_date, is_replay):
+    path = (f"/api/financialdata/historical/{INSTRUMENT_ID}?start-date={start_date}"
+            f"&end-date={datetime.now().strftime('%Y-%m-%d')}&time-frame=Daily&add-missing-rows=false")
+    request = tutils.treq(scheme=b"https", host=b"api.investing.com", port=443, path=path.encode())
+    flow = tflow.tflow(req=request)
+    flow.is_replay = "request" if is_replay else None
+    return flow
+
+class ReplayRecorder():
+    # stands in for mitmproxy's ctx, replay.client only records the flow for the test to answer
+
+    def __init__(self):
+        self.flows = []
+        self.master = self
+        self.commands = self
+
+    def call(self, command, flows):
+        self.flows.extend(flows)
+
+def run_capture(addon, recorder, rows, max_pages=None):
+    # the first request and every replay it triggers, up to max_pages responses
+    flow = make_flow("2000-01-01", is_replay=False)
+    pages = 0
+    while flow is not None and (max_pages is None or pages < max_pages):
+        addon.request(flow)
+        body = json.dumps({"data": page_for(rows, flow.request.query["start-date"])}).encode()
+        flow.response = tutils.tresp(status_code=200, content=body)
+        addon.response(flow)
+        pages += 1
+        flow = recorder.flows.pop(0) if recorder.flows else None
+        if flow is not None:
+            flow.is_replay = "request"
+    return pages
+
+@pytest.fixture
+def addon(tmp_path, monkeypatch):
+    recorder = ReplayRecorder()
+    monkeypatch.setattr(proxy_script, "ctx", recorder)
+    monkeypatch.setattr(proxy_script, "save_captured_headers", lambda headers: None)
+    monkeypatch.setattr(proxy_script, "write_to_logfile", lambda _id, log: None)
+    addon = proxy_script.CaptureAuthHeader()
+    # no database behind the tests, every capture starts from scratch
+    addon.get_latest_date_by_ref_id = lambda _id: None
+    addon.spool_directory = str(tmp_path)
+    # nothing listens here until a test starts a HandoffServer on it
+    addon.handoff = HandoffClient(str(tmp_path / "handoff.sock"))
+    addon.recorder = recorder
+    return addon
+
+def test_pages_go_over_the_socket(addon, tmp_path):
+    rows = make_rows(12000)
+    server = HandoffServer(str(tmp_path / "handoff.sock")).start()
+    try:
+        received = []
+        consumer = threading.Thread(target=lambda: received.extend(
+            row for page in server.pages(INSTRUMENT_ID, timeout=10) for row in page["data"]
+        ))
+        consumer.start()
+        assert run_capture(addon, addon.recorder, rows) == 3
+        consumer.join(timeout=30)
+    finally:
+        server.close()
+
+    assert len(received) == len(rows)
+    assert {row["rowDateTimestamp"] for row in received} == {row["rowDateTimestamp"] for row in rows}
+    # nothing was spooled
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".ndjson")]
+
+def test_spools_when_nothing_listens(addon, tmp_path):
+    rows = make_rows(12000)
+    assert run_capture(addon, addon.recorder, rows) == 3
+
+    complete_file = complete_path(INSTRUMENT_ID, str(tmp_path))
+    assert not os.path.exists(pending_path(INSTRUMENT_ID, str(tmp_path)))
+    written = [row for batch in read_spool(complete_file, batch_rows=1000) for row in batch]
+    assert len(written) == len(rows)
+    assert {row["rowDateTimestamp"] for row in written} == {row["rowDateTimestamp"] for row in rows}
+    with open(complete_file, 'rb') as file:
+        footer = json.loads(file.readlines()[-1])["footer"]
+    assert footer == {"pages": 3, "rows": len(rows)}
+
+def test_pending_spool_is_readable_mid_capture(addon, tmp_path):
+    # the proxy went away after the first page, before the replay it asked for was answered
+    rows = make_rows(12000)
+    run_capture(addon, addon.recorder, rows, max_pages=1)
+
+    pending_file = pending_path(INSTRUMENT_ID, str(tmp_path))
+    assert not os.path.exists(complete_path(INSTRUMENT_ID, str(tmp_path)))
+    assert list(page_counts(pending_file)) == [PAGE_ROWS]
+
+    # and it died halfway through appending the next page
+    with open(pending_file, 'ab') as file:
+        file.write(b'{"page":{"rows":5000}}\n{"rowDate":"Jan 01, 2020","last_cl')
+    written = [row for batch in read_spool(pending_file) for row in batch]
+    assert len(written) == PAGE_ROWS
+    assert written[0] == page_for(rows, "2000-01-01")[0]
+
+def test_up_to_date_capture_is_an_empty_spool(addon, tmp_path):
+    flow = make_flow("2000-01-01", is_replay=False)
+    flow.response = tutils.tresp(status_code=204, content=b"Database is up to date")
+    addon.response(flow)
+    complete_file = complete_path(INSTRUMENT_ID, str(tmp_path))
+    assert list(read_spool(complete_file)) == []
@@ -0,0 +1,29 @@
+# Every endpoint query shape must be answered through one of its indexes, see explain_endpoint_queries.
+# Needs a PostgreSQL DATABASE_URL; the schema is brought up to date by create_db (which only creates
+# missing tables and runs pending migrations) and nothing is written to the tables.
+# Usage: DATABASE_URL=postgresql://... python -m pytest tests/test_query_plans.py
+
+import os
+
+import pytest
+
+if not os.environ.get("DATABASE_URL", "").startswith("postgresql"):
+    pytest.skip("query plans are only checked against PostgreSQL", allow_module_level=True)
+
+from app import app
+from migrations import explain_endpoint_queries, explain_targets
+
+with app.app_context():
+    DESCRIPTIONS = [description for description, _, _ in explain_targets()]
+
+@pytest.fixture(scope="module")
+def plans():
+    with app.app_context():
+        result = app.test_cli_runner().invoke(args=["create_db"])
+        assert result.exit_code == 0, result.output
+        return {description: (index_names, used, indexes) for description, index_names, used, indexes in explain_endpoint_queries()}
+
+@pytest.mark.parametrize("description", DESCRIPTIONS)
+def test_query_uses_index(plans, description):
+    index_names, used, indexes = plans[description]
+    assert used, f"{description}: expected one of {list(index_names)}, plan used {indexes}"
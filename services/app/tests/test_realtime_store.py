@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from extensions import db
+from models import Asset, BondYieldRealtime
+from queries import realtime_query
+from realtime_store import RealtimeStore, READY_FIELD
+
+START = datetime(2024, 3, 4, 9, 0)
+
+def bars(asset_id, count, timeframe=1, first=0):
+    return [
+        {'asset_id': asset_id, 'timeframe': timeframe, 'datetime': START + timedelta(minutes=minute), 'bond_yield': 3 + minute / 100}
+        for minute in range(first, first + count)
+    ]
+
+def answered(latest):
+    # (datetime, asset id, close) of every row latest() answered with, newest first
+    _, datetimes, asset_ids, closes = latest
+    return sorted(zip(datetimes.astype('datetime64[us]').tolist(), asset_ids.tolist(), closes.tolist()), reverse=True)
+
+def expected(rows, max_rows):
+    return sorted(((row['datetime'], row['asset_id'], row['bond_yield']) for row in rows), reverse=True)[:max_rows]
+
+def make_store(tmp_path, rows=4, assets=2):
+    writer = RealtimeStore(str(tmp_path / "store"), rows=rows, assets=assets).create()
+    writer.header[READY_FIELD] = 1 # as warm() leaves it
+    return writer, RealtimeStore(str(tmp_path / "store"))
+
+def test_reader_sees_pushed_bars(tmp_path):
+    writer, reader = make_store(tmp_path)
+    pushed = bars(7, 3) + bars(8, 2)
+    writer.push(pushed)
+    assert answered(reader.latest([7, 8], 1, 10)) == expected(pushed, 10)
+    assert answered(reader.latest([8], 1, 10)) == expected(pushed[3:], 10)
+    # nothing for that timeframe
+    assert reader.latest([7, 8], 5, 10) is None
+
+def test_bar_being_built_is_overwritten(tmp_path):
+    writer, reader = make_store(tmp_path)
+    writer.push(bars(7, 2))
+    writer.push([dict(bars(7, 1, first=1)[0], bond_yield=9.0)])
+    assert [close for _, _, close in answered(reader.latest([7], 1, 10))] == [9.0, 3.0]
+
+def test_wrapped_ring_answers_only_from_bars_it_holds(tmp_path):
+    writer, reader = make_store(tmp_path, rows=4)
+    pushed = bars(7, 6)
+    writer.push(pushed)
+    # the newest 3 bars are all still in the ring
+    assert answered(reader.latest([7], 1, 3)) == expected(pushed, 3)
+    # the 4 it holds could be all, but the table has 2 older ones
+    assert reader.latest([7], 1, 4) is None
+    assert reader.latest([7], 1, 10) is None
+
+def test_wrapped_ring_next_to_a_short_one(tmp_path):
+    writer, reader = make_store(tmp_path, rows=4)
+    # asset 8 only ticked at the start, asset 7 wrapped since
+    pushed = bars(8, 2) + bars(7, 6, first=2)
+    writer.push(pushed)
+    assert answered(reader.latest([7, 8], 1, 3)) == expected(pushed, 3)
+    # the 5th newest row would be asset 7's 5th newest bar, which the ring dropped
+    assert reader.latest([7, 8], 1, 5) is None
+
+def test_version_changes_with_every_push_and_every_file(tmp_path):
+    writer, reader = make_store(tmp_path)
+    writer.push(bars(7, 1))
+    first = reader.latest([7], 1, 10)[0]
+    writer.push(bars(7, 1, first=1))
+    second = reader.latest([7], 1, 10)[0]
+    assert first != second and first.split(":")[0] == second.split(":")[0]
+
+    # a restarted daemon starts the sequence again in a new file, the epoch tells them apart
+    writer, _ = make_store(tmp_path)
+    writer.push(bars(7, 1))
+    writer.push(bars(7, 1, first=1))
+    restarted = reader.latest([7], 1, 10)[0]
+    assert restarted.split(":")[1] == second.split(":")[1]
+    assert restarted != second
+
+def test_overflow_falls_back_to_sql(tmp_path):
+    writer, reader = make_store(tmp_path, assets=2)
+    writer.push(bars(7, 1) + bars(8, 1))
+    assert reader.latest([7], 1, 10) is not None
+    writer.push(bars(9, 1))
+    assert reader.latest([7], 1, 10) is None
+
+def test_busy_writer_falls_back_to_sql(tmp_path):
+    writer, reader = make_store(tmp_path)
+    writer.push(bars(7, 1))
+    writer.begin()
+    assert reader.latest([7], 1, 10) is None
+    writer.end()
+    assert reader.latest([7], 1, 10) is not None
+
+##############################
+# WARMING FROM THE TABLE
+##############################
+
+def store_bars(rows):
+    asset = Asset.get_or_create(name="spain", period=2)
+    db.session.flush()
+    for row in rows:
+        db.session.add(BondYieldRealtime(row['datetime'], asset.id, row['bond_yield'], 0, row['timeframe']))
+    db.session.commit()
+    return asset.id
+
+def from_table(max_rows):
+    return [(row.datetime, row.asset_id, row.bond_yield) for row in realtime_query("spain", 1, max_rows)]
+
+def test_warm_from_a_short_table(sqlite_db, tmp_path):
+    asset_id = store_bars(bars(1, 3))
+    writer = RealtimeStore(str(tmp_path / "store"), rows=4).create()
+    writer.warm()
+    assert answered(RealtimeStore(str(tmp_path / "store")).latest([asset_id], 1, 10)) == from_table(10)
+
+def test_warm_from_a_longer_table_falls_back_past_the_window(sqlite_db, tmp_path):
+    asset_id = store_bars(bars(1, 6))
+    writer = RealtimeStore(str(tmp_path / "store"), rows=4).create()
+    writer.warm()
+    reader = RealtimeStore(str(tmp_path / "store"))
+    assert answered(reader.latest([asset_id], 1, 3)) == from_table(3)
+    # the ring is full and the table holds older bars, only SQL has the 5 newest
+    assert reader.latest([asset_id], 1, 5) is None
+    assert len(from_table(5)) == 5
+    assert np.isclose(writer.closes[0, 0, :4], [row['bond_yield'] for row in bars(1, 6)[2:]]).all()
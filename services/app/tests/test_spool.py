@@ -0,0 +1,83 @@
+import json
+import os
+import time
+
+import pytest
+
+import spool
+from bonds_sync_daily import CountryYearData
+from spool import start_spool, append_page, finish_spool, read_spool, complete_path, pending_path, is_stale
+
+def footer(path):
+    with open(path, 'rb') as file:
+        return json.loads(file.readlines()[-1])["footer"]
+
+def test_finish_spool_uses_running_counts(tmp_path, monkeypatch):
+    path = start_spool("1", str(tmp_path))
+    append_page(path, [{"a": 1}, {"a": 2}])
+    append_page(path, [{"a": 3}])
+    # the counts are passed in, nothing is read back
+    monkeypatch.setattr(spool, "page_counts", lambda path: pytest.fail("spool rescanned"))
+    completed = finish_spool(path, 2, 3)
+    assert completed == complete_path("1", str(tmp_path))
+    assert footer(completed) == {"pages": 2, "rows": 3}
+
+def test_finish_spool_without_counts_reads_page_markers(tmp_path):
+    path = start_spool("1", str(tmp_path))
+    append_page(path, [{"a": 1}, {"a": 2}])
+    append_page(path, [{"a": 3}])
+    assert footer(finish_spool(path)) == {"pages": 2, "rows": 3}
+
+def test_is_stale(tmp_path):
+    path = start_spool("1", str(tmp_path))
+    assert not is_stale(path)
+    old = time.time() - 3600
+    os.utime(path, (old, old))
+    assert is_stale(path)
+
+##############################
+# CONSUMING SPOOLS
+##############################
+
+@pytest.fixture
+def job(tmp_path, monkeypatch):
+    monkeypatch.setattr("bonds_sync_daily.write_to_logfile", lambda _id, log: None)
+    job = CountryYearData("spain", "5", None)
+    job._id = "23801"
+    job.data_directory = tmp_path
+    return job
+
+def spooled(tmp_path, rows):
+    path = start_spool("23801", str(tmp_path))
+    append_page(path, rows)
+    return path
+
+def test_spool_removed_once_written(job, tmp_path, monkeypatch):
+    written = []
+    monkeypatch.setattr(job, "write_payload", written.extend)
+    path = finish_spool(spooled(tmp_path, [{"a": 1}, {"a": 2}]), 1, 2)
+    assert job.write_to_database(path)
+    assert written == [{"a": 1}, {"a": 2}]
+    assert not os.path.exists(path)
+
+def test_spool_kept_when_a_write_fails(job, tmp_path, monkeypatch):
+    def write_payload(items):
+        raise RuntimeError("database is down")
+    monkeypatch.setattr(job, "write_payload", write_payload)
+    path = finish_spool(spooled(tmp_path, [{"a": 1}]), 1, 1)
+    assert not job.write_to_database(path)
+    assert [row for batch in read_spool(path) for row in batch] == [{"a": 1}]
+
+def test_recent_pending_spool_left_for_the_next_run(job, tmp_path, monkeypatch):
+    written = []
+    monkeypatch.setattr(job, "wait_for_file_complete", lambda: 0)
+    monkeypatch.setattr(job, "write_to_database", written.append)
+    path = spooled(tmp_path, [{"a": 1}])
+    job.update_file()
+    assert written == []
+
+    # one the proxy has not touched for SPOOL_STALE_SECONDS is taken
+    old = time.time() - spool.SPOOL_STALE_SECONDS - 1
+    os.utime(path, (old, old))
+    job.update_file()
+    assert [str(path) for path in written] == [pending_path("23801", str(tmp_path))]
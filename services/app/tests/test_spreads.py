@@ -0,0 +1,45 @@
+import datetime
+
+import numpy as np
+
+from extensions import db
+from ingest import write_series
+from models import Asset, BondYield, BondSpread, unit_of_work
+from spreads import update_spreads
+
+DATES = np.datetime64('2024-01-01') + np.arange(10)
+
+def write_legs():
+    ids = {}
+    for period, close in ((2, 3.0), (5, 3.5)):
+        asset = Asset.get_or_create(name="spain", period=period)
+        db.session.commit()
+        ids[period] = asset.id
+        write_series(asset.id, period, {'date': DATES, 'bond_yield': np.full(len(DATES), close)})
+    return ids
+
+def stored_spreads():
+    return {row.date: row.spread for row in BondSpread.query.filter_by(name="spain")}
+
+def drop_leg_days(asset_id, from_date):
+    BondYield.query.filter(BondYield.asset_id == asset_id, BondYield.date >= from_date).delete()
+    db.session.commit()
+
+def test_spreads_follow_the_legs(sqlite_db):
+    write_legs()
+    assert stored_spreads() == {date: 0.5 for date in DATES.tolist()}
+
+def test_day_without_a_leg_loses_its_spread(sqlite_db):
+    ids = write_legs()
+    drop_leg_days(ids[5], datetime.date(2024, 1, 8))
+    with unit_of_work():
+        assert update_spreads("spain", datetime.date(2024, 1, 6)) == 2
+    # the days before start_date are not touched
+    assert sorted(stored_spreads()) == DATES[:7].tolist()
+
+def test_no_common_days_left(sqlite_db):
+    ids = write_legs()
+    drop_leg_days(ids[5], datetime.date(2024, 1, 1))
+    with unit_of_work():
+        assert update_spreads("spain") == 0
+    assert stored_spreads() == {}
@@ -0,0 +1,60 @@
+import os
+from datetime import date
+
+import numpy as np
+import pytest
+
+from extensions import db
+from ingest import write_series
+from models import Asset
+from sync_planner import plan_jobs, series_watermarks, save_watermarks, WatermarkCache
+
+TODAY = date(2024, 1, 10)
+
+def watermark(latest_date, ref_id=23801):
+    return {"asset_id": 1, "name": "spain", "period": 5, "ref_id": ref_id, "latest_date": latest_date}
+
+def test_plan_jobs_resumes_after_the_watermark():
+    watermarks = {("spain", 2): watermark(date(2024, 1, 5)), ("spain", 5): watermark(date(2024, 1, 8))}
+    jobs = plan_jobs(["spain"], watermarks, today=TODAY)
+    assert [job.to_dict() for job in jobs] == [
+        {"job": "spain_2", "kind": "catch_up", "from_date": "2024-01-06", "to_date": "2024-01-10"},
+        {"job": "spain_5", "kind": "catch_up", "from_date": "2024-01-09", "to_date": "2024-01-10"},
+    ]
+
+def test_plan_jobs_skips_series_up_to_yesterday():
+    watermarks = {("spain", 2): watermark(date(2024, 1, 9)), ("spain", 5): watermark(date(2024, 1, 10))}
+    assert plan_jobs(["spain"], watermarks, today=TODAY) == []
+
+def test_plan_jobs_fetches_unknown_series_from_the_start():
+    jobs = plan_jobs(["italy"], {("italy", 5): watermark(None)}, today=TODAY)
+    assert [(job.year, job.from_date, job.to_date, job.backfill) for job in jobs] == [
+        ('2', None, TODAY, False),
+        ('5', None, TODAY, False),
+    ]
+
+def test_series_watermarks(sqlite_db):
+    asset = Asset.get_or_create(name="spain", period=5)
+    Asset.get_or_create(name="italy", period=2)
+    db.session.commit()
+    dates = np.array(['2024-01-03', '2024-01-05', '2024-01-04'], dtype='datetime64[D]')
+    write_series(asset.id, 23801, {'date': dates, 'bond_yield': np.array([3.0, 3.1, 3.2])})
+
+    watermarks = series_watermarks()
+    assert watermarks[("spain", 5)]["latest_date"] == date(2024, 1, 5)
+    assert watermarks[("spain", 5)]["ref_id"] == 23801
+    assert watermarks[("italy", 2)]["latest_date"] is None
+
+def test_watermark_cache_follows_the_file(tmp_path):
+    path = str(tmp_path / "watermarks.json")
+    cache = WatermarkCache(path)
+    with pytest.raises(LookupError):
+        cache.latest_date(23801)
+
+    save_watermarks({("spain", 5): watermark(date(2024, 1, 5))}, path)
+    assert cache.latest_date(23801) == date(2024, 1, 5)
+    assert cache.latest_date(99999) is None
+
+    save_watermarks({("spain", 5): watermark(date(2024, 1, 8))}, path)
+    os.utime(path, (0, 1)) # two writes can share an mtime on a coarse clock, the cache keys on it
+    assert cache.latest_date("23801") == date(2024, 1, 8)
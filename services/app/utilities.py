@@ -25,4 +25,12 @@ timeframes = {
     '15M': 15,
     '5M': 5,
     '1M': 1
-}
\ No newline at end of file
+}
+# daily rows come from bond_yield, weekly/monthly bars from bond_yield_rollup
+resolutions = ['D', 'W', 'M']
+
+
+def bar_start(dt, timeframe):
+    # bars are aligned to midnight, eg 5M bars start at 10:00, 10:05, ...
+    minutes = (dt.hour * 60 + dt.minute) % timeframe
+    return dt - timedelta(minutes=minutes, seconds=dt.second, microseconds=dt.microsecond)